@@ -0,0 +1,183 @@
+"""Request admission: token-bucket rate limits per client and load shedding.
+
+Every request spends a token from its client's bucket for the route's budget,
+once per IP address and once per logged-in user. Budgets are ``(tokens per
+second, bucket size)`` pairs in RATE_LIMITS; routes opt into a non-default
+budget with ``@limiter.budget('auth')``. Requests that pass are still refused
+with 503 while MAX_IN_FLIGHT requests are running in this process or the
+database pool's recent checkout wait exceeds POOL_WAIT_THRESHOLD.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, request, session
+
+from config import db
+import metrics
+
+DEFAULT_RATE_LIMITS = {'default': (10.0, 50)}
+DEFAULT_MAX_BUCKETS = 100000
+DEFAULT_MAX_IN_FLIGHT = 64
+DEFAULT_POOL_WAIT_THRESHOLD = 0.5
+SHED_RETRY_AFTER = 1
+EXEMPT_ENDPOINTS = frozenset({'metrics', 'static'})
+
+rejections = metrics.registry.counter('savor_requests_rejected_total', 'Requests refused before reaching a view.')
+
+# KEYS[1] = bucket key, ARGV = rate, capacity. Uses the server clock so every app server agrees.
+TAKE_SCRIPT = """
+local rate, capacity = tonumber(ARGV[1]), tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+
+class MemoryBuckets:
+    """Token buckets for this process, least recently used ones dropped past ``max_buckets``."""
+
+    def __init__(self, max_buckets=DEFAULT_MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key, rate, capacity):
+        """Spend one token; returns ``(allowed, tokens left)``."""
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.buckets[key] = (tokens, now)
+            while len(self.buckets) > self.max_buckets:
+                self.buckets.popitem(last=False)
+        return allowed, tokens
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+
+
+class RedisBuckets:
+    """Buckets shared by every process, for any client exposing redis-py's ``register_script``."""
+
+    def __init__(self, client, prefix='savor:rate:'):
+        self.prefix = prefix
+        self.script = client.register_script(TAKE_SCRIPT)
+
+    def take(self, key, rate, capacity):
+        allowed, tokens = self.script(keys=[self.prefix + key], args=[rate, capacity])
+        return bool(allowed), float(tokens)
+
+
+def make_backend(app):
+    if app.config.get('RATE_LIMIT_BACKEND', 'memory') == 'redis':
+        import redis
+        client = redis.Redis.from_url(app.config.get('RATE_LIMIT_REDIS_URL', 'redis://localhost:6379/0'))
+        return RedisBuckets(client)
+    return MemoryBuckets(app.config.get('RATE_LIMIT_MAX_BUCKETS', DEFAULT_MAX_BUCKETS))
+
+
+def pool_wait():
+    """Longest recent checkout wait across the database pools, in seconds."""
+    waits = [engine.pool.wait_time() for engine in db.engines.values() if hasattr(engine.pool, 'wait_time')]
+    return max(waits, default=0.0)
+
+
+def client_ip(app):
+    if app.config.get('RATE_LIMIT_TRUST_PROXY'):
+        return request.access_route[0]
+    return request.remote_addr
+
+
+class Limiter:
+    def __init__(self):
+        self.app = None
+        self.backend = None
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.backend = make_backend(app)
+        app.before_request(self.admit)
+        app.teardown_request(self.release)
+        metrics.registry.gauge('savor_requests_in_flight', 'Requests being served by this process.',
+                               lambda: self.in_flight)
+        metrics.registry.gauge('savor_db_pool_wait_seconds', 'Recent average wait for a pooled connection.',
+                               lambda: round(pool_wait(), 6))
+
+    def budget(self, name):
+        """Charge requests to this view against the ``name`` budget instead of ``default``."""
+        def decorator(f):
+            f.rate_limit_budget = name
+            return f
+        return decorator
+
+    def request_budget(self):
+        view = self.app.view_functions.get(request.endpoint)
+        view_class = getattr(view, 'view_class', None)
+        if view_class is not None:
+            view = getattr(view_class, request.method.lower(), None)
+        return getattr(view, 'rate_limit_budget', 'default')
+
+    def admit(self):
+        if request.endpoint in EXEMPT_ENDPOINTS:
+            return None
+        config = self.app.config
+        if config.get('RATE_LIMIT_ENABLED', True):
+            refused = self.check_rate_limits()
+            if refused:
+                return refused
+
+        wait = pool_wait()
+        with self.lock:
+            overloaded = self.in_flight >= config.get('MAX_IN_FLIGHT', DEFAULT_MAX_IN_FLIGHT)
+            slow_pool = wait > config.get('POOL_WAIT_THRESHOLD', DEFAULT_POOL_WAIT_THRESHOLD)
+            if not (overloaded or slow_pool):
+                self.in_flight += 1
+                g.admitted = True
+                return None
+        rejections.inc(reason='in_flight' if overloaded else 'pool_wait')
+        return {'error': 'Server is busy, try again shortly'}, 503, {'Retry-After': str(SHED_RETRY_AFTER)}
+
+    def check_rate_limits(self):
+        budget = self.request_budget()
+        limits = self.app.config.get('RATE_LIMITS', DEFAULT_RATE_LIMITS)
+        rate, capacity = limits.get(budget) or limits['default']
+        identities = [f'ip:{client_ip(self.app)}']
+        if session.get('user_id') is not None:
+            identities.append(f'user:{session["user_id"]}')
+
+        retry_after = 0
+        for identity in identities:
+            allowed, tokens = self.backend.take(f'{budget}:{identity}', rate, capacity)
+            if not allowed:
+                retry_after = max(retry_after, (1 - tokens) / rate)
+        if not retry_after:
+            return None
+        rejections.inc(reason='rate_limit')
+        return {'error': 'Too many requests'}, 429, {'Retry-After': str(math.ceil(retry_after))}
+
+    def release(self, exc):
+        if g.pop('admitted', False):
+            with self.lock:
+                self.in_flight -= 1
+
+
+limiter = Limiter()
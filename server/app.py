@@ -1,21 +1,48 @@
-from flask import  request, make_response, session, abort, jsonify, Flask
+from flask import  request, make_response, session, abort, jsonify, Flask, Response, stream_with_context
 from flask_restful import Api, Resource
 from flask_login import current_user, login_required
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.exceptions import NotFound, Unauthorized
-from models import User, Recipe, Ingredient, RecipeIngredient, Category, RecipeCategory, db
-from config import db, api, app, CORS, migrate, bcrypt, load_user, login_manager
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, selectinload
+from models import User, Recipe, Ingredient, RecipeIngredient, Category, RecipeCategory, db, DuplicateEmailError, normalize_email
+from config import db, api, app, CORS, bcrypt, load_user, login_manager
+from pagination import (Page, paginate, page_size, encode_cursor, decode_cursor, decode_keyset, decode_offset,
+                        keyset_after, cursor_value)
+from search import search_recipes
+import pantry
+import cascades
+from cache import response_cache, profile_cache
+from passwords import PasswordHasherBusy
+from admission import limiter
+import metrics
+import stats
+import similarity
+import changes
+import jobs
+from quantities import scaled_quantity, servings_factor
+from serializers import format_value, serialize
+from lazy import add_lazy_resource
 import os
 
 from flask_login import LoginManager
 
 login_manager.init_app(app)
+response_cache.init_app(app)
+profile_cache.init_app(app)
+metrics.init_app(app, api)
+limiter.init_app(app)
+jobs.init_app(app)
 
 
 class Users(Resource):
     def get(self):
-        users = [user.to_dict() for user in User.query.all()]
-        return users, 200
+        try:
+            page = paginate(User)
+        except ValueError as e:
+            return {'error': str(e)}, 400
+        return page.items, 200, page.headers
 
     def post(self):
         data = request.get_json()
@@ -24,15 +51,27 @@ class Users(Resource):
         first_name = data.get('first_name')
         last_name = data.get('last_name')
 
-        if User.query.filter_by(email=email).first():
+        try:
+            new_user = User(email=email, first_name=first_name, last_name=last_name)
+        except DuplicateEmailError:
             return {'error': 'Email already in use'}, 409
+        except ValueError as e:
+            return {'error': str(e)}, 422
+        if not password:
+            return {'error': 'Password must be provided'}, 422
+        try:
+            new_user.password_hash = password
+        except PasswordHasherBusy:
+            return {'error': 'Server busy, please retry'}, 503, {'Retry-After': '1'}
 
-        new_user = User(email=email, password=password, first_name=first_name, last_name=last_name)
-        
         db.session.add(new_user)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return {'error': 'Email already in use'}, 409
 
-        return new_user.to_dict(), 201
+        return serialize(new_user), 201
 
 api.add_resource(Users, '/users')
 
@@ -41,37 +80,150 @@ class UserByID(Resource):
         user = User.query.filter_by(id=id).first()
         if not user:
             return {'error': 'User not found'}, 404
-        return user.to_dict(), 200
+        data = serialize(user)
+        if request.args.get('with_counts'):
+            data['recipe_count'] = stats.user_recipe_count(id)
+        return data, 200
 
+    @response_cache.invalidates('users')
     def put(self, id):
         user = User.query.filter_by(id=id).first()
         if not user:
             return {'error': 'User not found'}, 404
 
         data = request.get_json()
-        user.email = data.get('email', user.email)
-        user.password = data.get('password', user.password)
-        user.first_name = data.get('first_name', user.first_name)
-        user.last_name = data.get('last_name', user.last_name)
-        db.session.commit()
+        try:
+            user.email = data.get('email', user.email)
+            user.first_name = data.get('first_name', user.first_name)
+            user.last_name = data.get('last_name', user.last_name)
+            if data.get('password'):
+                user.password_hash = data['password']
+        except PasswordHasherBusy:
+            db.session.rollback()
+            return {'error': 'Server busy, please retry'}, 503, {'Retry-After': '1'}
+        except DuplicateEmailError:
+            db.session.rollback()
+            return {'error': 'Email already in use'}, 409
+        except ValueError as e:
+            db.session.rollback()
+            return {'error': str(e)}, 422
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return {'error': 'Email already in use'}, 409
+        profile_cache.invalidate(id)
 
-        return user.to_dict(), 200
+        return serialize(user), 200
 
+    @response_cache.invalidates('users', *cascades.RECIPE_TAGS)
     def delete(self, id):
-        user = User.query.filter_by(id=id).first()
-        if not user:
+        deleted, recipe_ids = cascades.delete_rows(db.session, User, [id])
+        if not deleted:
+            db.session.rollback()
             return {'error': 'User not found'}, 404
-        db.session.delete(user)
         db.session.commit()
+        profile_cache.invalidate(id)
+        response_cache.bump([f'recipe:{recipe_id}' for recipe_id in recipe_ids])
         return {}, 204
 
 api.add_resource(UserByID, '/users/<int:id>')
 
+RECIPE_EXPANSIONS = ('ingredients', 'categories', 'user')
+
+
+def requested_expansions():
+    expand = request.args.get('expand')
+    if not expand:
+        return ()
+    names = tuple(name.strip() for name in expand.split(',') if name.strip())
+    unknown = [name for name in names if name not in RECIPE_EXPANSIONS]
+    if unknown:
+        raise ValueError(f'Unknown expansions: {", ".join(unknown)}')
+    if request.args.get('fields'):
+        raise ValueError('expand cannot be combined with fields')
+    return names
+
+
+EXPANSION_TAGS = {
+    'ingredients': ('ingredients',),
+    'categories': ('categories',),
+    'user': ('users',),
+}
+LINK_TAGS = {
+    'ingredients': 'recipe_ingredients',
+    'categories': 'recipe_categories',
+}
+
+
+def recipe_tags(id=None):
+    expand = [name.strip() for name in request.args.get('expand', '').split(',')]
+    if request.args.get('servings'):
+        expand.append('ingredients')
+    tags = ['recipes'] if id is None else [f'recipe:{id}']
+    for name in expand:
+        tags.extend(EXPANSION_TAGS.get(name, ()))
+        if id is None and name in LINK_TAGS:
+            tags.append(LINK_TAGS[name])
+    return tags
+
+
+def expanded_recipe_query(expansions):
+    options = []
+    if 'ingredients' in expansions:
+        options.append(selectinload(Recipe.recipe_ingredients).joinedload(RecipeIngredient.ingredient))
+    if 'categories' in expansions:
+        options.append(selectinload(Recipe.recipe_category).joinedload(RecipeCategory.category))
+    if 'user' in expansions:
+        options.append(joinedload(Recipe.user))
+    return Recipe.query.options(*options)
+
+
+def requested_servings():
+    servings = request.args.get('servings')
+    if servings is None:
+        return None
+    if not servings.isdigit() or int(servings) < 1:
+        raise ValueError('servings must be a positive integer')
+    return int(servings)
+
+
+def serialize_recipe(recipe, expansions=(), servings=None):
+    data = serialize(recipe)
+    if servings:
+        data['servings'] = servings
+    if 'ingredients' in expansions:
+        factor = servings_factor(servings, recipe.servings)
+        data['ingredients'] = [
+            dict(serialize(ri.ingredient), **scaled_quantity(ri.quantity, ri.amount, ri.unit, factor))
+            for ri in recipe.recipe_ingredients if ri.ingredient
+        ]
+    if 'categories' in expansions:
+        data['categories'] = [serialize(rc.category) for rc in recipe.recipe_category if rc.category]
+    if 'user' in expansions:
+        data['user'] = serialize(recipe.user) if recipe.user else None
+    return data
+
+
 class Recipes(Resource):
+    @limiter.budget('expensive')
+    @response_cache.cached(recipe_tags)
     def get(self):
-        recipes = [recipe.to_dict() for recipe in Recipe.query.all()]
-        return recipes, 200
+        try:
+            expansions = requested_expansions()
+            if expansions:
+                page = paginate(
+                    Recipe,
+                    query=expanded_recipe_query(expansions),
+                    serialize=lambda recipe: serialize_recipe(recipe, expansions),
+                )
+            else:
+                page = paginate(Recipe)
+        except ValueError as e:
+            return {'error': str(e)}, 400
+        return page.items, 200, page.headers
 
+    @response_cache.invalidates('recipes')
     def post(self):
         data = request.get_json()
         title = data.get('title')
@@ -83,18 +235,105 @@ class Recipes(Resource):
         db.session.add(new_recipe)
         db.session.commit()
 
-        return new_recipe.to_dict(), 201
+        return serialize(new_recipe), 201
 
 api.add_resource(Recipes, '/recipes')
 
 
+add_lazy_resource(api, 'bulk.RecipesBulk', '/recipes/bulk', methods=['GET', 'POST', 'DELETE'])
+
+
+class JobByID(Resource):
+    def get(self, id):
+        job = jobs.get_job(id)
+        if job is None:
+            return {'error': 'Job not found'}, 404
+        return job, 200
+
+api.add_resource(JobByID, '/jobs/<int:id>')
+
+
+class RecipeSearch(Resource):
+    @limiter.budget('expensive')
+    def get(self):
+        query = request.args.get('q', '').strip()
+        if not query:
+            return {'error': 'q must be provided'}, 400
+        try:
+            expansions = requested_expansions()
+            limit = page_size()
+            offset = decode_offset(request.args.get('cursor'))
+        except ValueError as e:
+            return {'error': str(e)}, 400
+
+        ranked = search_recipes(query, limit + 1, offset)
+        headers = {}
+        if len(ranked) > limit:
+            ranked = ranked[:limit]
+            headers['X-Next-Cursor'] = encode_cursor([offset + limit])
+
+        ids = [recipe_id for recipe_id, score in ranked]
+        recipes = {recipe.id: recipe for recipe in expanded_recipe_query(expansions).filter(Recipe.id.in_(ids))}
+        results = [
+            dict(serialize_recipe(recipes[recipe_id], expansions), score=round(score, 4))
+            for recipe_id, score in ranked if recipe_id in recipes
+        ]
+        return results, 200, headers
+
+api.add_resource(RecipeSearch, '/recipes/search')
+
+
+class MakeableRecipes(Resource):
+    @limiter.budget('expensive')
+    def get(self):
+        try:
+            ingredient_ids = {int(i) for i in request.args.get('ingredients', '').split(',') if i.strip()}
+            max_missing = request.args.get('max_missing', type=int)
+            limit = page_size()
+            offset = decode_offset(request.args.get('cursor'))
+        except ValueError as e:
+            return {'error': str(e)}, 400
+        if not ingredient_ids:
+            return {'error': 'ingredients must be a comma separated list of ingredient ids'}, 400
+
+        index = pantry.get_index()
+        matches = index.match(ingredient_ids, limit + 1, offset, max_missing)
+        headers = {}
+        if len(matches) > limit:
+            matches = matches[:limit]
+            headers['X-Next-Cursor'] = encode_cursor([offset + limit])
+
+        recipes = {recipe.id: recipe for recipe in Recipe.query.filter(Recipe.id.in_([m[0] for m in matches]))}
+        results = [
+            dict(
+                serialize(recipes[recipe_id]),
+                covered=covered,
+                missing=missing,
+                missing_ingredient_ids=index.missing(recipe_id, ingredient_ids),
+            )
+            for recipe_id, covered, missing in matches if recipe_id in recipes
+        ]
+        return results, 200, headers
+
+api.add_resource(MakeableRecipes, '/recipes/makeable')
+
+
 class RecipeByID(Resource):
+    @response_cache.cached(recipe_tags)
     def get(self, id):
-        recipe = Recipe.query.filter_by(id=id).first()
+        try:
+            expansions = requested_expansions()
+            servings = requested_servings()
+        except ValueError as e:
+            return {'error': str(e)}, 400
+        if servings and 'ingredients' not in expansions:
+            expansions += ('ingredients',)
+        recipe = expanded_recipe_query(expansions).filter_by(id=id).first()
         if not recipe:
             return {'error': 'Recipe not found'}, 404
-        return recipe.to_dict(), 200
+        return serialize_recipe(recipe, expansions, servings), 200
 
+    @response_cache.invalidates('recipes', 'recipe:{id}')
     def put(self, id):
         recipe = Recipe.query.filter_by(id=id).first()
         if not recipe:
@@ -103,29 +342,55 @@ class RecipeByID(Resource):
         data = request.get_json()
         recipe.title = data.get('title', recipe.title)
         recipe.content = data.get('content', recipe.content)
+        recipe.servings = data.get('servings', recipe.servings)
         recipe.user_id = data.get('user_id', recipe.user_id)
         recipe.category_id = data.get('category_id', recipe.category_id)
 
         db.session.commit()
 
-        return recipe.to_dict(), 200
+        return serialize(recipe), 200
 
+    @response_cache.invalidates(*cascades.RECIPE_TAGS, 'recipe:{id}')
     def delete(self, id):
-        recipe = Recipe.query.filter_by(id=id).first()
-        if not recipe:
+        deleted, _ = cascades.delete_rows(db.session, Recipe, [id])
+        if not deleted:
+            db.session.rollback()
             return {'error': 'Recipe not found'}, 404
-        db.session.delete(recipe)
         db.session.commit()
         return {}, 204
 
 api.add_resource(RecipeByID, '/recipes/<int:id>')
 
 
+class SimilarRecipes(Resource):
+    @response_cache.cached('recipes', 'recipe_ingredients', 'recipe_categories', 'recipe_neighbors')
+    def get(self, id):
+        try:
+            limit = min(page_size(), similarity.neighbor_count())
+        except ValueError as e:
+            return {'error': str(e)}, 400
+        results = similarity.similar_recipes(id, limit)
+        if not results and db.session.get(Recipe, id) is None:
+            return {'error': 'Recipe not found'}, 404
+        return results, 200
+
+api.add_resource(SimilarRecipes, '/recipes/<int:id>/similar')
+
+
+add_lazy_resource(api, 'shopping.ShoppingList', '/shopping-list', methods=['GET'])
+
+
 class Ingredients(Resource):
+    @limiter.budget('expensive')
+    @response_cache.cached('ingredients')
     def get(self):
-        ingredients = [ingredient.to_dict() for ingredient in Ingredient.query.all()]
-        return ingredients, 200
+        try:
+            page = paginate(Ingredient)
+        except ValueError as e:
+            return {'error': str(e)}, 400
+        return page.items, 200, page.headers
 
+    @response_cache.invalidates('ingredients')
     def post(self):
         data = request.get_json()
         name = data.get('name')
@@ -135,17 +400,30 @@ class Ingredients(Resource):
         db.session.add(new_ingredient)
         db.session.commit()
 
-        return new_ingredient.to_dict(), 201
+        return serialize(new_ingredient), 201
 
 api.add_resource(Ingredients, '/ingredients')
 
+
+class TopIngredients(Resource):
+    @response_cache.cached('ingredients', 'recipe_ingredients')
+    def get(self):
+        try:
+            limit = page_size()
+        except ValueError as e:
+            return {'error': str(e)}, 400
+        return stats.top_ingredients(limit), 200
+
+api.add_resource(TopIngredients, '/ingredients/top')
+
 class IngredientByID(Resource):
     def get(self, id):
         ingredient = Ingredient.query.filter_by(id=id).first()
         if not ingredient:
             return {'error': 'Ingredient not found'}, 404
-        return ingredient.to_dict(), 200
+        return serialize(ingredient), 200
 
+    @response_cache.invalidates('ingredients')
     def put(self, id):
         ingredient = Ingredient.query.filter_by(id=id).first()
         if not ingredient:
@@ -156,19 +434,84 @@ class IngredientByID(Resource):
         ingredient.quantity = data.get('quantity', ingredient.quantity)
         db.session.commit()
 
-        return ingredient.to_dict(), 200
+        return serialize(ingredient), 200
 
+    @response_cache.invalidates('ingredients', 'recipe_ingredients')
     def delete(self, id):
-        ingredient = Ingredient.query.filter_by(id=id).first()
-        if not ingredient:
+        deleted, _ = cascades.delete_rows(db.session, Ingredient, [id])
+        if not deleted:
+            db.session.rollback()
             return {'error': 'Ingredient not found'}, 404
-        db.session.delete(ingredient)
         db.session.commit()
         return {}, 204
 
 api.add_resource(IngredientByID, '/ingredients/<int:id>')
 
+def sync_recipe_links(recipe_id, link_model, target_model, key, desired):
+    """Make the recipe's ``link_model`` rows match ``desired`` ({target id: column values}).
+
+    Loads the current rows once, then lets a single flush apply the inserts,
+    updates and deletes in batches. Returns None if any target id is unknown.
+    """
+    found = {id for (id,) in db.session.query(target_model.id).filter(target_model.id.in_(list(desired)))}
+    if len(found) != len(desired):
+        return None
+
+    counts = {'added': 0, 'updated': 0, 'removed': 0}
+    kept = set()
+    for link in link_model.query.filter_by(recipe_id=recipe_id).all():
+        target_id = getattr(link, key)
+        if target_id not in desired or target_id in kept:
+            db.session.delete(link)
+            counts['removed'] += 1
+            continue
+        kept.add(target_id)
+        for column, value in desired[target_id].items():
+            if getattr(link, column) != value:
+                setattr(link, column, value)
+                counts['updated'] += 1
+    db.session.add_all([
+        link_model(recipe_id=recipe_id, **{key: target_id}, **values)
+        for target_id, values in desired.items() if target_id not in kept
+    ])
+    counts['added'] = len(desired) - len(kept)
+    db.session.commit()
+    return counts
+
+
+def owned_recipe(recipe_id):
+    user_id = session.get('user_id')
+    if user_id is None:
+        return {'error': 'Unauthorized'}, 401
+    recipe = db.session.query(Recipe.id, Recipe.user_id).filter(Recipe.id == recipe_id).first()
+    if not recipe:
+        return {'error': 'Recipe not found'}, 404
+    if recipe.user_id != user_id:
+        return {'error': 'Unauthorized'}, 401
+    return None
+
+
 class RecipeIngredients(Resource):
+    @response_cache.invalidates('recipe:{recipe_id}', 'recipe_ingredients')
+    def put(self, recipe_id):
+        error = owned_recipe(recipe_id)
+        if error:
+            return error
+
+        entries = (request.get_json() or {}).get('ingredients')
+        if not isinstance(entries, list):
+            return {'error': 'ingredients must be a list'}, 400
+        try:
+            desired = {int(entry['ingredient_id']): {'quantity': entry.get('quantity')} for entry in entries}
+        except (KeyError, TypeError, ValueError):
+            return {'error': 'Each ingredient needs an ingredient_id'}, 400
+
+        counts = sync_recipe_links(recipe_id, RecipeIngredient, Ingredient, 'ingredient_id', desired)
+        if counts is None:
+            return {'error': 'Ingredient not found'}, 404
+        return counts, 200
+
+    @response_cache.invalidates('recipe:{recipe_id}', 'recipe_ingredients')
     def post(self, recipe_id):
         user_id = get_jwt_identity()
         
@@ -191,6 +534,7 @@ class RecipeIngredients(Resource):
         
         return {'message': 'Ingredient added successfully'}, 200
 
+    @response_cache.invalidates('recipe:{recipe_id}', 'recipe_ingredients')
     def delete(self, recipe_id):
         user_id = get_jwt_identity()
         
@@ -216,11 +560,29 @@ class RecipeIngredients(Resource):
 api.add_resource(RecipeIngredients, '/recipes/<int:recipe_id>/ingredients')
 
 
+def category_tags():
+    if request.args.get('with_counts'):
+        return ['categories', 'recipe_categories']
+    return ['categories']
+
+
 class Categories(Resource):
+    @limiter.budget('expensive')
+    @response_cache.cached(category_tags)
     def get(self):
-        categories = [category.to_dict() for category in Category.query.all()]
-        return categories, 200
-
+        try:
+            page = paginate(Category)
+        except ValueError as e:
+            return {'error': str(e)}, 400
+        if request.args.get('with_counts'):
+            if any('id' not in item for item in page.items):
+                return {'error': 'fields must include id when with_counts is set'}, 400
+            counts = stats.category_counts([item['id'] for item in page.items])
+            for item in page.items:
+                item['recipe_count'] = counts.get(item['id'], 0)
+        return page.items, 200, page.headers
+
+    @response_cache.invalidates('categories')
     def post(self):
         data = request.get_json()
         name = data.get('name')
@@ -229,7 +591,7 @@ class Categories(Resource):
         db.session.add(new_category)
         db.session.commit()
 
-        return new_category.to_dict(), 201
+        return serialize(new_category), 201
 
 api.add_resource(Categories, '/categories')
 
@@ -238,8 +600,9 @@ class CategoryByID(Resource):
         category = Category.query.filter_by(id=id).first()
         if not category:
             return {'error': 'Category not found'}, 404
-        return category.to_dict(), 200
+        return serialize(category), 200
 
+    @response_cache.invalidates('categories')
     def put(self, id):
         category = Category.query.filter_by(id=id).first()
         if not category:
@@ -249,13 +612,14 @@ class CategoryByID(Resource):
         category.name = data.get('name', category.name)
         db.session.commit()
 
-        return category.to_dict(), 200
+        return serialize(category), 200
 
+    @response_cache.invalidates('categories', 'recipe_categories')
     def delete(self, id):
-        category = Category.query.filter_by(id=id).first()
-        if not category:
+        deleted, _ = cascades.delete_rows(db.session, Category, [id])
+        if not deleted:
+            db.session.rollback()
             return {'error': 'Category not found'}, 404
-        db.session.delete(category)
         db.session.commit()
         return {}, 204
 
@@ -263,6 +627,26 @@ api.add_resource(CategoryByID, '/categories/<int:id>')
 
 
 class RecipeCategories(Resource):
+    @response_cache.invalidates('recipe:{recipe_id}', 'recipe_categories')
+    def put(self, recipe_id):
+        error = owned_recipe(recipe_id)
+        if error:
+            return error
+
+        category_ids = (request.get_json() or {}).get('category_ids')
+        if not isinstance(category_ids, list):
+            return {'error': 'category_ids must be a list'}, 400
+        try:
+            desired = {int(category_id): {} for category_id in category_ids}
+        except (TypeError, ValueError):
+            return {'error': 'category_ids must be integers'}, 400
+
+        counts = sync_recipe_links(recipe_id, RecipeCategory, Category, 'category_id', desired)
+        if counts is None:
+            return {'error': 'Category not found'}, 404
+        return counts, 200
+
+    @response_cache.invalidates('recipe:{recipe_id}', 'recipe_categories')
     def post(self, recipe_id):
         user_id = get_jwt_identity()
 
@@ -285,6 +669,7 @@ class RecipeCategories(Resource):
         
         return {'message': 'Category added successfully'}, 200
 
+    @response_cache.invalidates('recipe:{recipe_id}', 'recipe_categories')
     def delete(self, recipe_id):
         user_id = get_jwt_identity()
 
@@ -311,6 +696,7 @@ api.add_resource(RecipeCategories, '/recipes/<int:recipe_id>/categories')
 
 
 class Signup(Resource):
+     @limiter.budget('auth')
      def post(self):
         
         first_name = request.get_json()['first_name']
@@ -318,42 +704,64 @@ class Signup(Resource):
         email = request.get_json()['email']
         password = request.get_json()['password']
 
-        new_user = User(first_name=first_name, last_name=last_name, email=email, admin=False)
-        new_user.password_hash = password
+        try:
+            new_user = User(first_name=first_name, last_name=last_name, email=email, admin=False)
+        except DuplicateEmailError as e:
+            return {'error': str(e)}, 409
+        except ValueError as e:
+            return {'error': str(e)}, 422
+        try:
+            new_user.password_hash = password
+        except PasswordHasherBusy:
+            return {'error': 'Server busy, please retry'}, 503, {'Retry-After': '1'}
         db.session.add(new_user)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return {'error': 'This email is already registered to an account - please log in.'}, 409
 
         session['user_id'] = new_user.id
                 
-        return new_user.to_dict(), 201
+        return serialize(new_user), 201
 
 api.add_resource(Signup, '/signup', endpoint='signup')
 
 
 class Login(Resource):
+    @limiter.budget('auth')
     def post(self):
         try:
-            user = User.query.filter_by(email=request.get_json()['email']).first()
+            user = User.query.filter_by(email_key=normalize_email(request.get_json()['email'])).first()
             if user.authenticate(request.get_json()['password']):
+                if db.session.is_modified(user):
+                    db.session.commit()
                 session['user_id'] = user.id
                 response = make_response(
-                    user.to_dict(),
+                    serialize(user),
                     200
                 )
                 return response
+        except PasswordHasherBusy:
+            return {'error': 'Server busy, please retry'}, 503, {'Retry-After': '1'}
         except:
             abort(401, "Incorrect Email or Password")
 
 api.add_resource(Login, '/login')
 
 
+def load_profile(user_id):
+    user = User.query.filter_by(id=user_id).first()
+    return serialize(user) if user else None
+
+
 class AuthorizedSession(Resource):
     def get(self):
         try:
-            user = User.query.filter_by(id=session['user_id']).first()
+            user_id = session['user_id']
+            profile = profile_cache.get(user_id, lambda: load_profile(user_id))
             response = make_response(
-                user.to_dict(),
-        
+                profile,
                 200
             )
             return response
@@ -382,23 +790,126 @@ def handle_not_found(e):
     return response
 
 
+SUMMARY_SORT_KEYS = ('created_at', 'updated_at')
+
+
+def user_recipe_summaries(user_id):
+    """One keyset page of a user's recipes as name, ingredient count and category names.
+
+    ``sort`` is created_at or updated_at (recipes never edited sort by their
+    creation time). The page is limited in a subquery and its categories are
+    joined onto it, so the whole page is one statement.
+    """
+    sort = request.args.get('sort', 'created_at')
+    if sort not in SUMMARY_SORT_KEYS:
+        raise ValueError(f'sort must be one of: {", ".join(SUMMARY_SORT_KEYS)}')
+    descending = request.args.get('order', 'asc') == 'desc'
+    limit = page_size()
+
+    recipes = Recipe.__table__
+    sort_key = recipes.c.created_at if sort == 'created_at' else db.func.coalesce(recipes.c.updated_at, recipes.c.created_at)
+    sort_columns = [sort_key, recipes.c.id]
+    query = select(recipes.c.id, recipes.c.name, recipes.c.created_at, recipes.c.updated_at, sort_key.label('sort_key'))
+    query = query.where(recipes.c.user_id == user_id)
+    cursor = request.args.get('cursor')
+    if cursor:
+        query = query.where(keyset_after(sort_columns, decode_keyset(cursor, sort), descending))
+    order = [column.desc() if descending else column.asc() for column in sort_columns]
+    page = query.order_by(*order).limit(limit + 1).subquery()
+
+    links, categories = RecipeCategory.__table__, Category.__table__
+    ingredient_count = (
+        select(db.func.count()).select_from(RecipeIngredient.__table__)
+        .where(RecipeIngredient.__table__.c.recipe_id == page.c.id)
+        .scalar_subquery()
+    )
+    page_order = [column.desc() if descending else column.asc() for column in (page.c.sort_key, page.c.id)]
+    rows = db.session.execute(
+        select(page, ingredient_count.label('ingredient_count'), categories.c.name.label('category'))
+        .outerjoin(links, links.c.recipe_id == page.c.id)
+        .outerjoin(categories, categories.c.id == links.c.category_id)
+        .order_by(*page_order, categories.c.name)
+    )
+
+    summaries = {}
+    for row in rows:
+        summary = summaries.get(row.id)
+        if summary is None:
+            summary = summaries[row.id] = {
+                'id': row.id,
+                'name': row.name,
+                'ingredient_count': row.ingredient_count,
+                'categories': [],
+                'created_at': format_value(row.created_at),
+                'updated_at': format_value(row.updated_at),
+                'sort_key': cursor_value(row.sort_key),
+            }
+        if row.category is not None:
+            summary['categories'].append(row.category)
+
+    items = list(summaries.values())
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor([items[-1]['sort_key'], items[-1]['id']])
+    for item in items:
+        del item['sort_key']
+    return Page(items, next_cursor)
+
+
 class UserRecipes(Resource):
-    @jwt_required()
+    @limiter.budget('expensive')
     def get(self, id):
-        user_id = get_jwt_identity()
-        if user_id != id:
+        if session.get('user_id') != id:
             return {'error': 'Unauthorized'}, 401
 
-        user = User.query.filter_by(id=id).first()
-        if not user:
+        if db.session.get(User, id) is None:
             return {'error': 'User not found'}, 404
-        recipes = [recipe.to_dict() for recipe in user.recipes]
-        return recipes, 200
+        try:
+            page = user_recipe_summaries(id)
+        except ValueError as e:
+            return {'error': str(e)}, 400
+        return page.items, 200, page.headers
 
 api.add_resource(UserRecipes, '/users/<int:id>/recipes')
 
 
-if __name__ == '__main__':
-    app.run(port=5000, debug=True)
+class UserRecommendations(Resource):
+    @limiter.budget('expensive')
+    @response_cache.cached('recipes', 'recipe_ingredients', 'recipe_categories', 'recipe_neighbors')
+    def get(self, id):
+        try:
+            limit = page_size()
+        except ValueError as e:
+            return {'error': str(e)}, 400
+        if db.session.get(User, id) is None:
+            return {'error': 'User not found'}, 404
+        return similarity.recommended_recipes(id, limit), 200
+
+api.add_resource(UserRecommendations, '/users/<int:id>/recommendations')
+
 
+class Changes(Resource):
+    def get(self):
+        connection = db.session.connection()
+        since = request.args.get('since')
+        if since is None:
+            return {'changes': [], 'next': encode_cursor([changes.head(connection)]), 'more': False}, 200
+        try:
+            values = decode_cursor(since)
+            if not (isinstance(values, list) and len(values) == 1 and isinstance(values[0], int)):
+                raise ValueError('Invalid change token')
+            limit = page_size()
+            deltas, token, more = changes.changes_since(
+                connection, values[0], limit, app.config.get('CHANGE_FEED_SETTLE_SECONDS', 0))
+        except ValueError as e:
+            return {'error': str(e)}, 400
+        except changes.ResyncRequired:
+            return {'error': 'Change token has expired; refetch the lists and sync from a new token'}, 410
+        return {'changes': deltas, 'next': encode_cursor([token]), 'more': more}, 200
+
+api.add_resource(Changes, '/changes')
 
+
+if __name__ == '__main__':
+    app.run(port=5000, debug=True)
@@ -0,0 +1,244 @@
+"""ASGI entry point: async handlers for the hot read endpoints, Flask for everything else.
+
+    uvicorn asgi:application --workers 4
+
+GET /recipes, /recipes/<id>, /ingredients, /ingredients/<id>, /categories and
+/categories/<id> are served here on an async SQLAlchemy engine; every other
+request is passed to the WSGI app through asgiref.
+
+Async requests still run inside a Flask request context. The app's
+before_request, after_request and teardown hooks run around each handler,
+covering admission, metrics, replica routing and the session. Handlers for
+cached views share the response cache and its ETags with the WSGI views.
+The hooks, and lookups in a Redis response cache, are synchronous, so they
+run on a worker thread instead of blocking the event loop.
+"""
+import asyncio
+import io
+import re
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from flask import g, request
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app import app
+from cache import response_cache
+import metrics
+from models import User, Recipe, Ingredient, RecipeIngredient, Category, RecipeCategory
+from pagination import cursor_value, decode_keyset, encode_cursor, keyset_after, page_size, requested_fields, sort_keys
+from serializers import serializer_for
+
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite', 'postgresql': 'postgresql+asyncpg', 'mysql': 'mysql+aiomysql'}
+COLLECTIONS = {'recipes': Recipe, 'ingredients': Ingredient, 'categories': Category}
+ROUTE = re.compile(r'^/(recipes|ingredients|categories)(?:/(\d+))?$')
+
+
+def async_url(url):
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+
+
+def make_engine(url, options):
+    return create_async_engine(
+        url, **{key: value for key, value in options.items() if key not in ('connect_args', 'poolclass', 'url')})
+
+
+engine = make_engine(
+    app.config.get('ASYNC_DATABASE_URL') or async_url(app.config['SQLALCHEMY_DATABASE_URI']),
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'],
+)
+replica_engine = None
+if 'replica' in app.config.get('SQLALCHEMY_BINDS', {}):
+    replica = app.config['SQLALCHEMY_BINDS']['replica']
+    replica_engine = make_engine(app.config.get('ASYNC_REPLICA_DATABASE_URL') or async_url(replica['url']), replica)
+
+
+def current_engine():
+    """The replica for reads that config.route_reads sends there, like RoutingSession does."""
+    if replica_engine is not None and g.get('use_replica'):
+        return replica_engine
+    return engine
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def query_args(scope):
+    return {key: values[-1] for key, values in parse_qs(scope['query_string'].decode('latin-1')).items()}
+
+
+async def fetch_page(model, args):
+    """Async counterpart of pagination.paginate for column-only pages."""
+    sort = args.get('sort', 'id')
+    keys = sort_keys(model)
+    if sort not in keys:
+        raise BadRequest(f'sort must be one of: {", ".join(keys)}')
+    descending = args.get('order', 'asc') == 'desc'
+    try:
+        limit = page_size()
+        fields = requested_fields(model)
+    except ValueError as e:
+        raise BadRequest(str(e))
+
+    serializer = serializer_for(model)
+    fields = fields or list(serializer.fields)
+
+    table = model.__table__
+    sort_columns = [table.c.id] if sort == 'id' else [table.c[sort], table.c.id]
+    extra = [column for column in sort_columns if column.key not in fields]
+    statement = select(*[table.c[name] for name in fields], *extra)
+    if args.get('cursor'):
+        try:
+            values = decode_keyset(args['cursor'], sort)
+        except ValueError as e:
+            raise BadRequest(str(e))
+        statement = statement.where(keyset_after(sort_columns, values, descending))
+    order = [column.desc() if descending else column.asc() for column in sort_columns]
+    statement = statement.order_by(*order).limit(limit + 1)
+
+    rows = await fetch_rows(statement)
+
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers['X-Next-Cursor'] = encode_cursor([cursor_value(getattr(rows[-1], c.key)) for c in sort_columns])
+    return [serializer.row(row, fields) for row in rows], headers
+
+
+async def fetch_rows(statement):
+    async with current_engine().connect() as connection:
+        return (await connection.execute(statement)).all()
+
+
+async def fetch_one(model, id):
+    serializer = serializer_for(model)
+    rows = await fetch_rows(select(*serializer.columns).where(model.__table__.c.id == id))
+    return serializer.row(rows[0]) if rows else None
+
+
+async def fetch_recipe(id, expansions):
+    """Load a recipe and its expansions concurrently, one connection per query."""
+    ingredient_serializer = serializer_for(Ingredient)
+    category_serializer = serializer_for(Category)
+    links = RecipeIngredient.__table__
+    recipe_categories = RecipeCategory.__table__
+
+    tasks = {'recipe': fetch_one(Recipe, id)}
+    if 'ingredients' in expansions:
+        tasks['ingredients'] = fetch_rows(
+            select(*ingredient_serializer.columns, links.c.quantity, links.c.amount, links.c.unit)
+            .join(links, links.c.ingredient_id == Ingredient.__table__.c.id)
+            .where(links.c.recipe_id == id).order_by(links.c.id)
+        )
+    if 'categories' in expansions:
+        tasks['categories'] = fetch_rows(
+            select(*category_serializer.columns)
+            .join(recipe_categories, recipe_categories.c.category_id == Category.__table__.c.id)
+            .where(recipe_categories.c.recipe_id == id).order_by(recipe_categories.c.id)
+        )
+    if 'user' in expansions:
+        user_serializer = serializer_for(User)
+        tasks['user'] = fetch_rows(
+            select(*user_serializer.columns)
+            .join(Recipe.__table__, Recipe.__table__.c.user_id == User.__table__.c.id)
+            .where(Recipe.__table__.c.id == id)
+        )
+    results = dict(zip(tasks, await asyncio.gather(*tasks.values())))
+
+    recipe = results['recipe']
+    if recipe is None:
+        return None
+    if 'ingredients' in results:
+        recipe['ingredients'] = [
+            dict(ingredient_serializer.row(row), quantity=row.quantity, amount=row.amount, unit=row.unit)
+            for row in results['ingredients']
+        ]
+    if 'categories' in results:
+        recipe['categories'] = [category_serializer.row(row) for row in results['categories']]
+    if 'user' in results:
+        rows = results['user']
+        recipe['user'] = serializer_for(User).row(rows[0]) if rows else None
+    return recipe
+
+
+def fast_route(scope):
+    """``(model, id, args, expansions)`` for a GET the async handlers serve, else None."""
+    match = ROUTE.match(scope['path'])
+    if not match:
+        return None
+    collection, id = match.group(1), match.group(2)
+    model = COLLECTIONS[collection]
+    args = query_args(scope)
+    expansions = tuple(name.strip() for name in args.get('expand', '').split(',') if name.strip())
+    if id is None and (expansions or args.get('with_counts')):
+        return None
+    if model is Recipe and id is not None and args.get('servings'):
+        return None
+    return model, None if id is None else int(id), args, expansions
+
+
+async def handle(model, id, args, expansions):
+    """Build the response body as a Flask view would return it: ``(body, status, headers)``."""
+    try:
+        if id is None:
+            items, headers = await fetch_page(model, args)
+            return items, 200, headers
+        if model is Recipe:
+            unknown = [name for name in expansions if name not in ('ingredients', 'categories', 'user')]
+            if unknown:
+                raise BadRequest(f'Unknown expansions: {", ".join(unknown)}')
+            item = await fetch_recipe(id, expansions)
+        else:
+            item = await fetch_one(model, id)
+    except BadRequest as e:
+        return {'error': str(e)}, 400, {}
+    if item is None:
+        return {'error': f'{model.__name__} not found'}, 404, {}
+    return item, 200, {}
+
+
+def wsgi_environ(scope):
+    """The environ Flask would see for this bodiless request through WsgiToAsgi."""
+    instance = WsgiToAsgiInstance(app)
+    instance.scope = scope
+    return instance.build_environ(scope, io.BytesIO())
+
+
+async def serve(scope, send, model, id, args, expansions):
+    """Answer a request in a Flask request context, so the app's hooks run around the async handler."""
+    # Leaving the context runs the teardown hooks, as it does after a WSGI request.
+    with app.request_context(wsgi_environ(scope)):
+        response = await asyncio.to_thread(app.preprocess_request)
+        # The hooks ran on a thread, so the handler's serializer calls need pointing at this request.
+        metrics.track_serialization()
+        if response is None:
+            view = getattr(app.view_functions[request.endpoint], 'view_class', None)
+            tags = getattr(getattr(view, 'get', None), 'cache_tags', None)
+            if tags is None:
+                response = await handle(model, id, args, expansions)
+            else:
+                response = await response_cache.cached_async(
+                    tags, request.view_args, lambda: handle(model, id, args, expansions))
+        response = await asyncio.to_thread(lambda: app.process_response(app.make_response(response)))
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': [(key.lower().encode('latin-1'), value.encode('latin-1')) for key, value in response.headers.items()],
+    })
+    await send({'type': 'http.response.body', 'body': response.get_data()})
+
+
+wsgi_application = WsgiToAsgi(app)
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['method'] == 'GET':
+        route = fast_route(scope)
+        if route is not None:
+            await serve(scope, send, *route)
+            return
+    await wsgi_application(scope, receive, send)
@@ -0,0 +1,9 @@
+"""Splitting id lists into batches that stay under database bind-parameter limits."""
+
+CHUNK_SIZE = 500
+
+
+def chunked(values, size=CHUNK_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
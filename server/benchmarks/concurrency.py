@@ -0,0 +1,82 @@
+"""Requests/sec and latency percentiles for GET requests at several concurrency levels.
+
+Start the server under test, then for example:
+
+    python -m benchmarks.concurrency http://127.0.0.1:8000 /recipes /recipes/1?expand=ingredients,categories \
+        --clients 100 250 500 1000 --duration 20
+"""
+import argparse
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+
+async def fetch(host, port, path):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n'.encode())
+        await writer.drain()
+        status_line = await reader.readline()
+        await reader.read()
+        return int(status_line.split()[1])
+    finally:
+        writer.close()
+
+
+async def client(host, port, paths, deadline, latencies, errors):
+    n = 0
+    while time.perf_counter() < deadline:
+        path = paths[n % len(paths)]
+        n += 1
+        started = time.perf_counter()
+        try:
+            status = await fetch(host, port, path)
+        except OSError:
+            errors.append(path)
+            continue
+        if status >= 500:
+            errors.append(path)
+        else:
+            latencies.append(time.perf_counter() - started)
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def run(url, paths, clients, duration):
+    parts = urlsplit(url)
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*(
+        client(parts.hostname, parts.port or 80, paths, deadline, latencies, errors) for _ in range(clients)
+    ))
+    latencies.sort()
+    return {
+        'clients': clients,
+        'rps': len(latencies) / duration,
+        'p50': percentile(latencies, 0.50) * 1000,
+        'p99': percentile(latencies, 0.99) * 1000,
+        'errors': len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('url')
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--clients', type=int, nargs='+', default=[100, 250, 500, 1000])
+    parser.add_argument('--duration', type=float, default=20)
+    args = parser.parse_args()
+
+    print(f'{"clients":>8} {"req/s":>10} {"p50 ms":>10} {"p99 ms":>10} {"errors":>8}')
+    for clients in args.clients:
+        result = asyncio.run(run(args.url, args.paths, clients, args.duration))
+        print(f'{result["clients"]:>8} {result["rps"]:>10.1f} {result["p50"]:>10.1f} '
+              f'{result["p99"]:>10.1f} {result["errors"]:>8}')
+
+
+if __name__ == '__main__':
+    main()
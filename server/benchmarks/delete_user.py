@@ -0,0 +1,91 @@
+"""Statements and time taken to delete a user with a large recipe collection.
+
+Run from ``server/`` against a scratch database:
+
+    python -m benchmarks.delete_user --recipes 10000 --links 8
+
+With ON DELETE CASCADE the statement count stays flat as ``--recipes`` grows;
+an ORM cascade issues one per recipe and link.
+"""
+import argparse
+import time
+
+from sqlalchemy import event
+
+from app import app
+import cascades
+from models import db, User, Recipe, Ingredient, RecipeIngredient, Category, RecipeCategory
+
+DOMAIN = 'bench.invalid'
+
+
+def fill_user(recipes, links, batch_size=10000):
+    user_id = db.session.execute(User.__table__.insert().values(
+        first_name='Bench', last_name='Delete', email=f'delete@{DOMAIN}', email_key=f'delete@{DOMAIN}',
+    )).inserted_primary_key[0]
+    ingredient_ids = [
+        db.session.execute(Ingredient.__table__.insert().values(name=f'bench ingredient {n}')).inserted_primary_key[0]
+        for n in range(links)
+    ]
+    category_id = db.session.execute(Category.__table__.insert().values(name='bench category')).inserted_primary_key[0]
+    recipes_table = Recipe.__table__
+    for offset in range(0, recipes, batch_size):
+        rows = [{'name': f'Bench {n}', 'user_id': user_id} for n in range(offset, min(offset + batch_size, recipes))]
+        recipe_ids = db.session.execute(recipes_table.insert().returning(recipes_table.c.id), rows).scalars().all()
+        db.session.execute(RecipeIngredient.__table__.insert(), [
+            {'recipe_id': recipe_id, 'ingredient_id': ingredient_id, 'quantity': '1'}
+            for recipe_id in recipe_ids for ingredient_id in ingredient_ids
+        ])
+        db.session.execute(RecipeCategory.__table__.insert(), [
+            {'recipe_id': recipe_id, 'category_id': category_id} for recipe_id in recipe_ids
+        ])
+    db.session.commit()
+    return user_id, ingredient_ids, category_id
+
+
+def time_delete(user_id):
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        started = time.perf_counter()
+        deleted, removed = cascades.delete_rows(db.session, User, [user_id])
+        db.session.commit()
+        elapsed = time.perf_counter() - started
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+    return deleted, len(removed), len(statements), elapsed
+
+
+def cleanup(ingredient_ids=(), category_id=None):
+    User.query.filter(User.email_key.like(f'%@{DOMAIN}')).delete(synchronize_session=False)
+    Ingredient.query.filter(Ingredient.id.in_(ingredient_ids)).delete(synchronize_session=False)
+    Category.query.filter(Category.id == category_id).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--recipes', type=int, default=10000)
+    parser.add_argument('--links', type=int, default=8, help='ingredients per recipe')
+    args = parser.parse_args()
+
+    with app.app_context():
+        cleanup()
+        user_id, ingredient_ids, category_id = fill_user(args.recipes, args.links)
+        try:
+            deleted, recipes, statements, elapsed = time_delete(user_id)
+            left = db.session.query(Recipe).filter(Recipe.user_id == user_id).count()
+            print(f'deleted {deleted} user, {recipes} recipes with {statements} statements in {elapsed * 1000:.1f} ms')
+            if left:
+                print(f'{left} recipes were left behind; run migrate_indexes.py to add ON DELETE CASCADE')
+        finally:
+            cleanup(ingredient_ids, category_id)
+
+
+if __name__ == '__main__':
+    main()
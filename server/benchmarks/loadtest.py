@@ -0,0 +1,243 @@
+"""Mixed-workload load test for the REST API with stored baselines.
+
+Start a server on a seeded database, then:
+
+    python -m benchmarks.loadtest http://127.0.0.1:5555 --users 50 --duration 60 --save-baseline
+    python -m benchmarks.loadtest http://127.0.0.1:5555 --users 50 --duration 60 --compare
+
+--compare exits non-zero when any scenario's p95 latency, throughput or
+SQL statements per request regress past --tolerance against the baseline.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError
+from urllib.request import HTTPCookieProcessor, Request, build_opener
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+METRIC_LINE = re.compile(r'^savor_request_sql_statements_(sum|count)\{endpoint="([^"]+)"\} ([0-9.e+]+)$')
+
+
+class Client:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = build_opener(HTTPCookieProcessor(CookieJar()))
+
+    def request(self, method, path, body=None, content_type='application/json'):
+        data = None
+        if body is not None:
+            data = body if isinstance(body, bytes) else json.dumps(body).encode('utf-8')
+        request = Request(self.base_url + path, data=data, method=method)
+        if data is not None:
+            request.add_header('Content-Type', content_type)
+        try:
+            with self.opener.open(request, timeout=30) as response:
+                return response.status, response.read()
+        except HTTPError as e:
+            return e.code, e.read()
+
+
+class VirtualUser:
+    """One client session: signs up, owns a recipe, then runs weighted scenarios."""
+
+    def __init__(self, base_url, rng):
+        self.client = Client(base_url)
+        self.rng = rng
+        self.token = uuid.uuid4().hex
+        self.email = f'load-{self.token}@loadtest.invalid'
+        self.password = 'loadtest!pw'
+        self.user_id = None
+        self.recipe_id = None
+        self.ingredient_ids = []
+        self.recipe_ids = []
+
+    def setup(self):
+        status, body = self.client.request('POST', '/signup', {
+            'first_name': 'Load', 'last_name': 'Test', 'email': self.email, 'password': self.password,
+        })
+        if status == 201:
+            self.user_id = json.loads(body)['id']
+        marker = f'loadtest{self.token}'
+        line = json.dumps({'name': f'{marker} stew', 'description': 'load test recipe',
+                           'user_id': self.user_id, 'ingredients': ['Salt', 'Flour'], 'categories': ['Dinner']})
+        self.client.request('POST', '/recipes/bulk', (line + '\n').encode(), 'application/x-ndjson')
+        status, body = self.client.request('GET', f'/recipes/search?q={marker}&limit=1')
+        if status == 200 and json.loads(body):
+            self.recipe_id = json.loads(body)[0]['id']
+        status, body = self.client.request('GET', '/ingredients?fields=id&limit=200')
+        if status == 200:
+            self.ingredient_ids = [row['id'] for row in json.loads(body)]
+        status, body = self.client.request('GET', '/recipes?fields=id&limit=500')
+        if status == 200:
+            self.recipe_ids = [row['id'] for row in json.loads(body)] or [1]
+
+    def login(self):
+        return self.client.request('POST', '/login', {'email': self.email, 'password': self.password})
+
+    def list_recipes(self):
+        return self.client.request('GET', '/recipes?limit=50')
+
+    def list_ingredients(self):
+        return self.client.request('GET', '/ingredients?limit=100')
+
+    def recipe_detail(self):
+        return self.client.request('GET', f'/recipes/{self.rng.choice(self.recipe_ids)}?expand=ingredients,categories')
+
+    def search(self):
+        return self.client.request('GET', f'/recipes/search?q={self.rng.choice(["cho", "sal", "bread", "egg"])}')
+
+    def edit_ingredients(self):
+        if not (self.recipe_id and self.ingredient_ids):
+            return 0, b''
+        chosen = self.rng.sample(self.ingredient_ids, min(len(self.ingredient_ids), self.rng.randint(3, 12)))
+        return self.client.request('PUT', f'/recipes/{self.recipe_id}/ingredients', {
+            'ingredients': [{'ingredient_id': i, 'quantity': f'{self.rng.randint(1, 4)} cups'} for i in chosen],
+        })
+
+
+SCENARIOS = {
+    'login': (VirtualUser.login, 5),
+    'list_recipes': (VirtualUser.list_recipes, 30),
+    'list_ingredients': (VirtualUser.list_ingredients, 10),
+    'recipe_detail': (VirtualUser.recipe_detail, 35),
+    'search': (VirtualUser.search, 15),
+    'edit_ingredients': (VirtualUser.edit_ingredients, 5),
+}
+
+
+def sql_per_endpoint(base_url):
+    status, body = Client(base_url).request('GET', '/metrics')
+    totals = defaultdict(lambda: [0.0, 0.0])
+    if status != 200:
+        return totals
+    for line in body.decode('utf-8').splitlines():
+        match = METRIC_LINE.match(line)
+        if match:
+            totals[match.group(2)][0 if match.group(1) == 'sum' else 1] = float(match.group(3))
+    return totals
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(base_url, users, duration, seed):
+    names = list(SCENARIOS)
+    weights = [SCENARIOS[name][1] for name in names]
+    samples = defaultdict(list)
+    failures = defaultdict(int)
+    lock = threading.Lock()
+    before = sql_per_endpoint(base_url)
+
+    def worker(index):
+        rng = random.Random(seed + index)
+        user = VirtualUser(base_url, rng)
+        user.setup()
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            status, body = SCENARIOS[name][0](user)
+            elapsed = time.perf_counter() - started
+            with lock:
+                if status and 200 <= status < 400:
+                    samples[name].append(elapsed)
+                elif status:
+                    failures[name] += 1
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    after = sql_per_endpoint(base_url)
+    results = {}
+    for name in names:
+        latencies = sorted(samples[name])
+        results[name] = {
+            'requests': len(latencies),
+            'failures': failures[name],
+            'throughput': len(latencies) / duration,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+        }
+    results['sql_per_request'] = {
+        endpoint: (after[endpoint][0] - before[endpoint][0]) / (after[endpoint][1] - before[endpoint][1])
+        for endpoint in after if after[endpoint][1] > before[endpoint][1]
+    }
+    return results
+
+
+def report(results):
+    print(f'{"scenario":<18} {"req":>7} {"fail":>5} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}')
+    for name in SCENARIOS:
+        r = results[name]
+        print(f'{name:<18} {r["requests"]:>7} {r["failures"]:>5} {r["throughput"]:>8.1f} '
+              f'{r["p50_ms"]:>8.1f} {r["p95_ms"]:>8.1f} {r["p99_ms"]:>8.1f}')
+    print('\nSQL statements per request')
+    for endpoint, statements in sorted(results['sql_per_request'].items()):
+        print(f'  {endpoint:<24} {statements:.1f}')
+
+
+def regressions(results, baseline, tolerance):
+    found = []
+    for name in SCENARIOS:
+        if name not in baseline or not baseline[name]['requests']:
+            continue
+        current, previous = results[name], baseline[name]
+        if current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            found.append(f'{name}: p95 {previous["p95_ms"]:.1f} -> {current["p95_ms"]:.1f} ms')
+        if current['throughput'] < previous['throughput'] * (1 - tolerance):
+            found.append(f'{name}: throughput {previous["throughput"]:.1f} -> {current["throughput"]:.1f} req/s')
+    for endpoint, statements in results['sql_per_request'].items():
+        previous = baseline.get('sql_per_request', {}).get(endpoint)
+        if previous is not None and statements > previous + 0.5:
+            found.append(f'{endpoint}: {previous:.1f} -> {statements:.1f} SQL statements per request')
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('url')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--compare', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = run(args.url, args.users, args.duration, args.seed)
+    report(results)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+        print(f'\nBaseline written to {args.baseline}')
+    if args.compare:
+        with open(args.baseline) as baseline_file:
+            found = regressions(results, json.load(baseline_file), args.tolerance)
+        if found:
+            print('\nRegressions against baseline:')
+            for line in found:
+                print(f'  {line}')
+            return 1
+        print('\nNo regressions against baseline.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""Compare SerializerMixin.to_dict() with the compiled serializers.
+
+Run from ``server/``:
+
+    python -m benchmarks.serializers --rows 10000
+"""
+import argparse
+import time
+from datetime import datetime
+
+from sqlalchemy.orm.attributes import set_committed_value
+
+from models import User, Recipe, Ingredient, RecipeIngredient, Category, RecipeCategory
+from serializers import serializer_for
+
+MODELS = (User, Recipe, Ingredient, RecipeIngredient, Category, RecipeCategory)
+
+
+def sample_value(column, n):
+    python_type = column.type.python_type
+    if python_type is int:
+        return n
+    if python_type is datetime:
+        return datetime(2023, 1, 1, 12, 0, n % 60)
+    return f'{column.key}-{n}'
+
+
+def build_instances(model, count):
+    """Detached instances populated without running validators or touching a database."""
+    manager = model._sa_class_manager
+    instances = []
+    for n in range(count):
+        instance = manager.new_instance()
+        for column in model.__table__.columns:
+            set_committed_value(instance, column.key, sample_value(column, n))
+        instances.append(instance)
+    return instances
+
+
+def timed(function, items):
+    started = time.perf_counter()
+    for item in items:
+        function(item)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    args = parser.parse_args()
+
+    print(f'{"model":<18} {"to_dict ms":>12} {"compiled ms":>12} {"row ms":>10} {"speedup":>8}')
+    for model in MODELS:
+        serializer = serializer_for(model)
+        instances = build_instances(model, args.rows)
+        rows = [tuple(getattr(instance, key) for key in serializer.fields) for instance in instances]
+
+        baseline = timed(lambda instance: instance.to_dict(), instances)
+        compiled = timed(serializer, instances)
+        from_rows = timed(serializer.row, rows)
+        print(f'{model.__name__:<18} {baseline * 1000:>12.1f} {compiled * 1000:>12.1f} '
+              f'{from_rows * 1000:>10.1f} {baseline / compiled:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
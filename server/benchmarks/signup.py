@@ -0,0 +1,67 @@
+"""Signup latency as the users table grows.
+
+Run from ``server/`` against a scratch database:
+
+    python -m benchmarks.signup --tiers 1000 10000 100000 1000000
+"""
+import argparse
+import time
+
+from app import app
+from models import db, User, normalize_email
+
+DOMAIN = 'bench.invalid'
+
+
+def fill_users(start, stop, batch_size=10000):
+    table = User.__table__
+    for offset in range(start, stop, batch_size):
+        rows = []
+        for n in range(offset, min(offset + batch_size, stop)):
+            email = f'user{n}@{DOMAIN}'
+            rows.append({'first_name': 'Bench', 'last_name': str(n), 'email': email, 'email_key': normalize_email(email)})
+        db.session.execute(table.insert(), rows)
+    db.session.commit()
+
+
+def time_signups(count, tier):
+    timings = []
+    for n in range(count):
+        email = f'Signup{tier}-{n}@{DOMAIN.upper()}'
+        started = time.perf_counter()
+        user = User(first_name='Bench', last_name='Signup', email=email)
+        user._password_hash = 'x'
+        db.session.add(user)
+        db.session.commit()
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.99) - 1]
+
+
+def cleanup():
+    User.query.filter(User.email_key.like(f'%@{DOMAIN}')).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tiers', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--signups', type=int, default=200)
+    args = parser.parse_args()
+
+    with app.app_context():
+        cleanup()
+        size = 0
+        print(f'{"users":>10} {"p50 ms":>10} {"p99 ms":>10}')
+        try:
+            for tier in sorted(args.tiers):
+                fill_users(size, tier)
+                size = tier
+                p50, p99 = time_signups(args.signups, tier)
+                print(f'{tier:>10} {p50 * 1000:>10.3f} {p99 * 1000:>10.3f}')
+        finally:
+            cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Cold-start time of a server process, with a per-module import breakdown.
+
+Run from ``server/``:
+
+    python -m benchmarks.startup                       # timings plus the slowest imports
+    python -m benchmarks.startup --runs 10 --budget-ms 1500
+
+Each run starts a fresh interpreter that calls ``wsgi.create_app()`` and serves
+one request through the test client. --budget-ms exits non-zero when the
+median cold start (process launch to first response) exceeds the budget, so
+it can run as a check next to the load tests.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COLD_START_BUDGET_MS = 1500
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)')
+
+PROBE = """
+import json, time
+started = time.perf_counter()
+import wsgi
+app = wsgi.create_app()
+ready = time.perf_counter()
+status = app.test_client().get({path!r}).status_code
+served = time.perf_counter()
+print(json.dumps({{'import_ms': (ready - started) * 1000, 'first_request_ms': (served - ready) * 1000,
+                  'status': status}}))
+"""
+
+
+def probe(path, importtime=False):
+    """Start one interpreter; returns its timings and, with ``importtime``, the -X importtime report."""
+    command = [sys.executable]
+    if importtime:
+        command += ['-X', 'importtime']
+    command += ['-c', PROBE.format(path=path)]
+    started = time.perf_counter()
+    completed = subprocess.run(command, cwd=SERVER_DIR, capture_output=True, text=True)
+    elapsed = (time.perf_counter() - started) * 1000
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr else 'probe failed')
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result['process_ms'] = elapsed
+    return result, completed.stderr
+
+
+def parse_importtime(report):
+    """``[(module, self_us, cumulative_us, depth)]`` from ``python -X importtime`` output."""
+    modules = []
+    for line in report.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            depth = (len(match.group(3)) - 1) // 2
+            modules.append((match.group(4), int(match.group(1)), int(match.group(2)), depth))
+    return modules
+
+
+def local_modules():
+    return {name[:-3] for name in os.listdir(SERVER_DIR) if name.endswith('.py')}
+
+
+def report_imports(modules, top):
+    print(f'\nSlowest imports by cumulative time (top {top})')
+    print(f'  {"module":<40} {"self ms":>9} {"total ms":>9}')
+    for name, own, cumulative, depth in sorted(modules, key=lambda m: -m[2])[:top]:
+        print(f'  {name:<40} {own / 1000:>9.1f} {cumulative / 1000:>9.1f}')
+
+    ours = local_modules()
+    print('\nApplication modules')
+    print(f'  {"module":<40} {"self ms":>9} {"total ms":>9}')
+    for name, own, cumulative, depth in sorted(modules, key=lambda m: -m[2]):
+        if name in ours:
+            print(f'  {name:<40} {own / 1000:>9.1f} {cumulative / 1000:>9.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--path', default='/metrics', help='request served after startup')
+    parser.add_argument('--top', type=int, default=25, help='imports listed in the breakdown')
+    parser.add_argument('--budget-ms', type=float, nargs='?', const=COLD_START_BUDGET_MS,
+                        help=f'fail if the median cold start exceeds this (default {COLD_START_BUDGET_MS} ms)')
+    args = parser.parse_args()
+
+    runs = [probe(args.path)[0] for _ in range(args.runs)]
+    print(f'{"run":>4} {"process ms":>11} {"import ms":>10} {"1st req ms":>11} {"status":>7}')
+    for n, run in enumerate(runs, start=1):
+        print(f'{n:>4} {run["process_ms"]:>11.1f} {run["import_ms"]:>10.1f} '
+              f'{run["first_request_ms"]:>11.1f} {run["status"]:>7}')
+    cold_start = statistics.median(run['process_ms'] for run in runs)
+    print(f'\nMedian cold start: {cold_start:.1f} ms')
+
+    _, importtime = probe(args.path, importtime=True)
+    report_imports(parse_importtime(importtime), args.top)
+
+    if args.budget_ms is not None:
+        if cold_start > args.budget_ms:
+            print(f'\nCold start {cold_start:.1f} ms is over the {args.budget_ms:.0f} ms budget.')
+            return 1
+        print(f'\nCold start is within the {args.budget_ms:.0f} ms budget.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
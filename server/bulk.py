@@ -0,0 +1,312 @@
+"""NDJSON bulk import and export of recipes, and the /recipes/bulk resource.
+
+app.py registers RecipesBulk lazily, so this module loads with the first bulk
+request, or when a worker first runs a ``bulk.import`` job.
+"""
+import json
+import os
+import shutil
+import tempfile
+from collections import Counter, defaultdict
+
+from flask import Response, request, session, stream_with_context
+from flask_restful import Resource
+from sqlalchemy import func, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from admission import limiter
+from batches import chunked
+from cache import response_cache
+import cascades
+from config import app, db
+from models import Recipe, Ingredient, RecipeIngredient, Category, RecipeCategory
+import changes
+import jobs
+import pantry
+from quantities import parse_quantity
+import search
+import similarity
+import stats
+
+BATCH_SIZE = 1000
+EXPORT_PARTITION = 1000
+IMPORT_TAGS = ('recipes', 'ingredients', 'categories', 'recipe_ingredients', 'recipe_categories')
+
+
+class RowError(ValueError):
+    pass
+
+
+def parse_line(line):
+    if isinstance(line, bytes):
+        try:
+            line = line.decode('utf-8')
+        except UnicodeDecodeError as e:
+            raise RowError(f'Invalid UTF-8: {e}')
+    try:
+        data = json.loads(line)
+    except ValueError as e:
+        raise RowError(f'Invalid JSON: {e}')
+    if not isinstance(data, dict):
+        raise RowError('Each line must be a JSON object')
+    name = data.get('name')
+    if not name or not isinstance(name, str):
+        raise RowError('name must be provided')
+
+    ingredients = []
+    for entry in data.get('ingredients') or []:
+        if isinstance(entry, str):
+            entry = {'name': entry}
+        if not isinstance(entry, dict) or not isinstance(entry.get('name'), str) or not entry['name'].strip():
+            raise RowError('ingredients must be names or objects with a name')
+        ingredient_name = entry['name'].strip()
+        if all(ingredient_name != existing for existing, quantity in ingredients):
+            ingredients.append((ingredient_name, entry.get('quantity')))
+
+    servings = data.get('servings')
+    if servings is not None and (not isinstance(servings, int) or isinstance(servings, bool) or servings < 1):
+        raise RowError('servings must be a positive integer')
+
+    categories = []
+    for entry in data.get('categories') or []:
+        if not isinstance(entry, str) or not entry.strip():
+            raise RowError('categories must be a list of names')
+        if entry.strip() not in categories:
+            categories.append(entry.strip())
+
+    return {
+        'recipe': {
+            'name': name, 'description': data.get('description'), 'servings': servings, 'user_id': data.get('user_id'),
+        },
+        'ingredients': ingredients,
+        'categories': categories,
+    }
+
+
+def upsert_names(connection, model, names):
+    """Return ``{name: id}`` for ``names``, inserting the ones that do not exist yet."""
+    table = model.__table__
+    names = set(names)
+    if not names:
+        return {}
+    existing = {}
+    for names_chunk in chunked(names):
+        rows = connection.execute(
+            select(table.c.name, func.min(table.c.id)).where(table.c.name.in_(names_chunk)).group_by(table.c.name)
+        )
+        existing.update({name: id for name, id in rows})
+    missing = sorted(names - set(existing))
+    if missing:
+        rows = connection.execute(
+            table.insert().returning(table.c.name, table.c.id, sort_by_parameter_order=True),
+            [{'name': name} for name in missing],
+        )
+        inserted = {name: id for name, id in rows}
+        changes.record(connection, table.name, inserted.values(), 'insert')
+        existing.update(inserted)
+    return existing
+
+
+def insert_links(connection, model, links):
+    table = model.__table__
+    result = connection.execute(table.insert().returning(table.c.id, sort_by_parameter_order=True), links)
+    changes.record(connection, table.name, [link_id for (link_id,) in result], 'insert',
+                   [link['recipe_id'] for link in links])
+
+
+def insert_batch(connection, rows):
+    """Insert parsed rows with one executemany per table; returns the new recipe ids."""
+    ingredient_ids = upsert_names(
+        connection, Ingredient, (name for row in rows for name, quantity in row['ingredients']))
+    category_ids = upsert_names(
+        connection, Category, (name for row in rows for name in row['categories']))
+
+    recipes = Recipe.__table__
+    result = connection.execute(
+        recipes.insert().returning(recipes.c.id, sort_by_parameter_order=True),
+        [row['recipe'] for row in rows],
+    )
+    recipe_ids = [recipe_id for (recipe_id,) in result]
+    changes.record(connection, recipes.name, recipe_ids, 'insert')
+
+    links = [
+        {'recipe_id': recipe_id, 'ingredient_id': ingredient_ids[name], 'quantity': quantity}
+        for recipe_id, row in zip(recipe_ids, rows) for name, quantity in row['ingredients']
+    ]
+    for link in links:
+        link['amount'], link['unit'] = parse_quantity(link['quantity'])
+    if links:
+        insert_links(connection, RecipeIngredient, links)
+    category_links = [
+        {'recipe_id': recipe_id, 'category_id': category_ids[name]}
+        for recipe_id, row in zip(recipe_ids, rows) for name in row['categories']
+    ]
+    if category_links:
+        insert_links(connection, RecipeCategory, category_links)
+
+    stats.apply_deltas(connection, stats.INGREDIENT_USAGE, Counter(link['ingredient_id'] for link in links))
+    stats.apply_deltas(connection, stats.CATEGORY_RECIPES, Counter(link['category_id'] for link in category_links))
+    stats.apply_deltas(connection, stats.USER_RECIPES, Counter(row['recipe']['user_id'] for row in rows))
+    return recipe_ids
+
+
+def flush_batch(batch, report):
+    """Write one batch in its own transaction, isolating failing rows if the batch is rejected."""
+    session = db.session
+    inserted = []
+    try:
+        with session.begin_nested():
+            inserted = insert_batch(session.connection(), [row for line_number, row in batch])
+    except SQLAlchemyError:
+        for line_number, row in batch:
+            try:
+                with session.begin_nested():
+                    inserted.extend(insert_batch(session.connection(), [row]))
+            except SQLAlchemyError as e:
+                report['errors'].append({'line': line_number, 'error': str(e.orig if hasattr(e, 'orig') else e)})
+    if inserted:
+        search.mark_recipes_changed(session, inserted)
+        pantry.mark_recipes_changed(session, inserted)
+        similarity.mark_recipes_changed(session, inserted)
+    session.commit()
+    report['inserted'] += len(inserted)
+
+
+def import_ndjson(lines, batch_size=BATCH_SIZE):
+    """Import recipes from an iterable of NDJSON lines and return a per-row report."""
+    report = {'inserted': 0, 'errors': []}
+    batch = []
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            batch.append((line_number, parse_line(line)))
+        except RowError as e:
+            report['errors'].append({'line': line_number, 'error': str(e)})
+        if len(batch) >= batch_size:
+            flush_batch(batch, report)
+            batch = []
+    if batch:
+        flush_batch(batch, report)
+    return report
+
+
+def spool(stream, directory):
+    """Copy an upload to a file in ``directory`` so a job can import it after the request ends."""
+    os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix='.ndjson', dir=directory)
+    with os.fdopen(fd, 'wb') as spooled:
+        shutil.copyfileobj(stream, spooled)
+    return path
+
+
+def enqueue_import(stream, directory, key=None):
+    """Spool an upload and queue its import; returns the job id.
+
+    A key that already names a job returns that job, and the new copy of the
+    upload is deleted rather than left in the spool directory.
+    """
+    path = spool(stream, directory)
+    try:
+        job_id = jobs.enqueue('bulk.import', {'path': path}, key=key)
+    except Exception:
+        os.remove(path)
+        raise
+    if key is not None and (jobs.get_payload(job_id) or {}).get('path') != path:
+        os.remove(path)
+    return job_id
+
+
+# Batches commit as they go, so a retry would insert the first batches again.
+@jobs.task('bulk.import', max_attempts=1)
+def import_file(path):
+    with open(path, 'rb') as lines:
+        report = import_ndjson(lines)
+    os.remove(path)
+    response_cache.bump(IMPORT_TAGS)
+    return report
+
+
+def export_ndjson():
+    """Yield every recipe as an NDJSON line, reading recipes through a server-side cursor."""
+    recipes = Recipe.__table__
+    links = RecipeIngredient.__table__
+    ingredients = Ingredient.__table__
+    recipe_categories = RecipeCategory.__table__
+    categories = Category.__table__
+
+    result = db.session.execute(
+        select(recipes.c.id, recipes.c.name, recipes.c.description, recipes.c.servings, recipes.c.user_id)
+        .order_by(recipes.c.id),
+        execution_options={'yield_per': EXPORT_PARTITION},
+    )
+    for partition in result.partitions():
+        ids = [row.id for row in partition]
+        recipe_ingredients = defaultdict(list)
+        for row in db.session.execute(
+            select(links.c.recipe_id, ingredients.c.name, links.c.quantity)
+            .join(ingredients, links.c.ingredient_id == ingredients.c.id)
+            .where(links.c.recipe_id.in_(ids))
+            .order_by(links.c.id)
+        ):
+            recipe_ingredients[row.recipe_id].append({'name': row.name, 'quantity': row.quantity})
+        recipe_category_names = defaultdict(list)
+        for row in db.session.execute(
+            select(recipe_categories.c.recipe_id, categories.c.name)
+            .join(categories, recipe_categories.c.category_id == categories.c.id)
+            .where(recipe_categories.c.recipe_id.in_(ids))
+            .order_by(recipe_categories.c.id)
+        ):
+            recipe_category_names[row.recipe_id].append(row.name)
+        for row in partition:
+            yield json.dumps({
+                'id': row.id,
+                'name': row.name,
+                'description': row.description,
+                'servings': row.servings,
+                'user_id': row.user_id,
+                'ingredients': recipe_ingredients[row.id],
+                'categories': recipe_category_names[row.id],
+            }) + '\n'
+
+
+class RecipesBulk(Resource):
+    @limiter.budget('expensive')
+    def get(self):
+        return Response(stream_with_context(export_ndjson()), mimetype='application/x-ndjson')
+
+    @limiter.budget('expensive')
+    @response_cache.invalidates(*IMPORT_TAGS)
+    def post(self):
+        if request.args.get('async'):
+            key = request.headers.get('Idempotency-Key')
+            key = key and f'bulk.import:{key}'
+            job_id = key and jobs.job_for_key(key)
+            if not job_id:
+                directory = app.config.get('JOB_SPOOL_DIR') or os.path.join(app.instance_path, 'imports')
+                job_id = enqueue_import(request.stream, directory, key=key)
+            return {'job': job_id}, 202, {'Location': f'/jobs/{job_id}'}
+        report = import_ndjson(request.stream)
+        return report, 200
+
+    @limiter.budget('expensive')
+    @response_cache.invalidates(*cascades.RECIPE_TAGS)
+    def delete(self):
+        ids = (request.get_json(silent=True) or {}).get('ids')
+        if not isinstance(ids, list) or not ids or not all(isinstance(id, int) for id in ids):
+            return {'error': 'ids must be a non-empty list of recipe ids'}, 400
+        if len(ids) > BATCH_SIZE:
+            return {'error': f'At most {BATCH_SIZE} recipes can be deleted at once'}, 400
+        user_id = session.get('user_id')
+        if user_id is None:
+            return {'error': 'Unauthorized'}, 401
+        owners = dict(db.session.query(Recipe.id, Recipe.user_id).filter(Recipe.id.in_(ids)))
+        missing = sorted(set(ids) - set(owners))
+        if missing:
+            return {'error': 'Recipes not found', 'ids': missing}, 404
+        if any(owner != user_id for owner in owners.values()):
+            return {'error': 'Unauthorized'}, 401
+        deleted, recipe_ids = cascades.delete_rows(db.session, Recipe, ids)
+        db.session.commit()
+        response_cache.bump([f'recipe:{recipe_id}' for recipe_id in recipe_ids])
+        return {'deleted': deleted}, 200
@@ -0,0 +1,310 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import request, Response
+from sqlalchemy.engine import make_url
+
+DEFAULT_TTL = 60
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_SYNC_SECONDS = 1.0
+PROFILE_TTL = 30
+
+
+class MemoryCache:
+    """Thread-safe LRU with a per-entry TTL and a bound on the number of entries."""
+
+    blocking = False
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get_versions(self, tags):
+        with self.lock:
+            return [self.versions.get(tag, 0) for tag in tags]
+
+    def bump(self, tags):
+        with self.lock:
+            for tag in tags:
+                self.versions[tag] = self.versions.get(tag, 0) + 1
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.versions.clear()
+
+
+class RedisCache:
+    """Backend for any client exposing the redis-py ``get``/``set``/``mget``/``incr`` calls."""
+
+    blocking = True
+
+    def __init__(self, client, ttl=DEFAULT_TTL, prefix='savor'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(f'{self.prefix}:entry:{key}')
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value):
+        self.client.set(f'{self.prefix}:entry:{key}', json.dumps(value), ex=self.ttl)
+
+    def delete(self, key):
+        self.client.delete(f'{self.prefix}:entry:{key}')
+
+    def get_versions(self, tags):
+        if not tags:
+            return []
+        values = self.client.mget([f'{self.prefix}:tag:{tag}' for tag in tags])
+        return [int(value or 0) for value in values]
+
+    def bump(self, tags):
+        pipeline = self.client.pipeline(transaction=False)
+        for tag in tags:
+            pipeline.incr(f'{self.prefix}:tag:{tag}')
+        pipeline.execute()
+
+    def clear(self):
+        for key in self.client.scan_iter(f'{self.prefix}:*'):
+            self.client.delete(key)
+
+
+class SharedGeneration:
+    """A counter in index_versions that tells a process's MemoryCache about other processes' writes.
+
+    A MemoryCache's tag versions only change in the process that bumps them,
+    so every bump also advances this counter and every key includes it. Each
+    process re-reads the counter at most once per ``interval`` seconds, so a
+    write in another web process or in a worker stops this process serving its
+    cached responses within that interval. Any write anywhere drops them all.
+    """
+
+    name = 'response_cache'
+
+    def __init__(self, engine, interval=DEFAULT_SYNC_SECONDS):
+        self.engine = engine
+        self.interval = interval
+        self.value = 0
+        self.checked = None
+        self.lock = threading.Lock()
+
+    def due(self):
+        return self.checked is None or time.monotonic() - self.checked >= self.interval
+
+    def current(self):
+        if self.due():
+            import versions
+            with self.engine().connect() as connection:
+                self.seen(versions.current(connection, self.name))
+        return self.value
+
+    def advance(self):
+        import versions
+        with self.engine().begin() as connection:
+            self.seen(versions.advance(connection, self.name))
+
+    def seen(self, value):
+        with self.lock:
+            # A slower read may finish after a newer value was seen.
+            self.value = max(self.value, value)
+            self.checked = time.monotonic()
+
+
+class ResponseCache:
+    """Caches serialized GET responses under versioned tags.
+
+    Writes bump the version of every tag they affect, so stale entries are
+    never read again and simply age out of the backend. With the memory
+    backend and a database other processes can reach, a SharedGeneration
+    carries the bumps between processes.
+    """
+
+    def __init__(self, backend=None, generation=None):
+        self.backend = backend or MemoryCache()
+        self.generation = generation
+
+    def init_app(self, app):
+        self.backend = make_backend(app, app.config.get('CACHE_TTL', DEFAULT_TTL), 'savor')
+        self.generation = None
+        if isinstance(self.backend, MemoryCache) and shared_database(app.config['SQLALCHEMY_DATABASE_URI']):
+            from config import db
+            interval = app.config.get('CACHE_SYNC_SECONDS', DEFAULT_SYNC_SECONDS)
+            self.generation = SharedGeneration(lambda: db.engine, interval)
+
+    def cached(self, *tags):
+        def decorator(method):
+            @wraps(method)
+            def wrapper(resource, *args, **kwargs):
+                key, entry = self.lookup(tags, kwargs)
+                if entry is None:
+                    result = method(resource, *args, **kwargs)
+                    entry = self.store(key, result)
+                    if entry is None:
+                        return result
+                return self.respond(entry)
+            # asgi.py looks these up to cache its async handlers under the same keys.
+            wrapper.cache_tags = tags
+            return wrapper
+        return decorator
+
+    async def cached_async(self, tags, kwargs, handler):
+        """``cached`` for an awaitable ``handler()`` standing in for a cached view.
+
+        A backend that does network I/O is called on a worker thread rather
+        than on the event loop.
+        """
+        key, entry = await self.off_loop(self.lookup, tags, kwargs)
+        if entry is None:
+            result = await handler()
+            entry = await self.off_loop(self.store, key, result)
+            if entry is None:
+                return result
+        return self.respond(entry)
+
+    async def off_loop(self, function, *args):
+        if self.backend.blocking or (self.generation is not None and self.generation.due()):
+            return await asyncio.to_thread(function, *args)
+        return function(*args)
+
+    def lookup(self, tags, kwargs):
+        key = self.key(tags, kwargs)
+        return key, self.backend.get(key)
+
+    def key(self, tags, kwargs):
+        versions = self.backend.get_versions(resolve_tags(tags, kwargs))
+        if self.generation is not None:
+            versions.insert(0, self.generation.current())
+        args_key = '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+        return f'{request.endpoint}:{json.dumps(kwargs, sort_keys=True)}:{args_key}:' + \
+            '.'.join(str(version) for version in versions)
+
+    def bump(self, tags):
+        """Invalidate every cached response under ``tags``, in other processes too."""
+        self.backend.bump(tags)
+        if self.generation is not None:
+            self.generation.advance()
+
+    def store(self, key, result):
+        """Cache a 200 result and return its entry; other statuses are not cached."""
+        data, status, headers = unpack(result)
+        if status != 200:
+            return None
+        body = json.dumps(data)
+        entry = {
+            'body': body,
+            'headers': dict(headers or {}),
+            'etag': hashlib.sha1(body.encode('utf-8')).hexdigest(),
+        }
+        self.backend.set(key, entry)
+        return entry
+
+    def respond(self, entry):
+        headers = dict(entry['headers'], ETag=f'"{entry["etag"]}"')
+        if entry['etag'] in request.if_none_match:
+            return Response(status=304, headers=headers)
+        return Response(entry['body'], status=200, headers=headers, mimetype='application/json')
+
+    def invalidates(self, *tags):
+        def decorator(method):
+            @wraps(method)
+            def wrapper(resource, *args, **kwargs):
+                result = method(resource, *args, **kwargs)
+                data, status, headers = unpack(result)
+                if 200 <= status < 300:
+                    self.bump(resolve_tags(tags, kwargs))
+                return result
+            return wrapper
+        return decorator
+
+
+def shared_database(url):
+    """Whether other processes can open the database at ``url``; an in-memory SQLite one is private."""
+    url = make_url(url)
+    return url.get_backend_name() != 'sqlite' or url.database not in (None, '', ':memory:')
+
+
+def make_backend(app, ttl, prefix):
+    if app.config.get('CACHE_BACKEND', 'memory') == 'redis':
+        import redis
+        client = redis.Redis.from_url(app.config.get('CACHE_REDIS_URL', 'redis://localhost:6379/0'))
+        return RedisCache(client, ttl=ttl, prefix=prefix)
+    return MemoryCache(app.config.get('CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES), ttl)
+
+
+class ProfileCache:
+    """Short-lived cache of serialized users keyed by ``session['user_id']``."""
+
+    def __init__(self, backend=None):
+        self.backend = backend or MemoryCache(ttl=PROFILE_TTL)
+
+    def init_app(self, app):
+        self.backend = make_backend(app, app.config.get('PROFILE_CACHE_TTL', PROFILE_TTL), 'savor:profile')
+
+    def get(self, user_id, load):
+        profile = self.backend.get(str(user_id))
+        if profile is None:
+            profile = load()
+            if profile is not None:
+                self.backend.set(str(user_id), profile)
+        return profile
+
+    def invalidate(self, user_id):
+        self.backend.delete(str(user_id))
+
+
+def resolve_tags(tags, kwargs):
+    names = []
+    for tag in tags:
+        if callable(tag):
+            names.extend(tag(**kwargs))
+        else:
+            names.append(tag.format(**kwargs))
+    return names
+
+
+def unpack(result):
+    if isinstance(result, Response):
+        return None, result.status_code, result.headers
+    if isinstance(result, tuple):
+        data = result[0]
+        status = result[1] if len(result) > 1 else 200
+        headers = result[2] if len(result) > 2 else {}
+        return data, status, headers
+    return result, 200, {}
+
+
+response_cache = ResponseCache()
+profile_cache = ProfileCache()
@@ -0,0 +1,93 @@
+"""Set-based deletes that leave child rows to ON DELETE CASCADE.
+
+Deleting a user removes their recipes, and deleting a recipe, ingredient or
+category removes its links, inside the database without loading a child.
+Cascaded rows never pass through the session's flush hooks, so before the
+DELETE runs, ``delete_rows`` works out with grouped queries what goes with
+it and hands that to the aggregates, indexes and change log the same way the
+Core bulk writers do.
+"""
+from sqlalchemy import func, or_, select
+
+from batches import chunked
+import changes
+import pantry
+import search
+import similarity
+import stats
+from models import User, Recipe, Ingredient, RecipeIngredient, Category, RecipeCategory
+
+# response cache tags a deleted recipe's cascade can make stale
+RECIPE_TAGS = ('recipes', 'recipe_ingredients', 'recipe_categories', 'recipe_neighbors')
+# link model -> (key column, aggregate counting it, model whose deletion removes the link)
+LINKS = {
+    RecipeIngredient: ('ingredient_id', stats.INGREDIENT_USAGE, Ingredient),
+    RecipeCategory: ('category_id', stats.CATEGORY_RECIPES, Category),
+}
+
+
+def removed_recipes_query(model, ids):
+    recipes = Recipe.__table__
+    if model is User:
+        return select(recipes.c.id).where(recipes.c.user_id.in_(ids))
+    if model is Recipe:
+        return select(recipes.c.id).where(recipes.c.id.in_(ids))
+    return None
+
+
+def delete_rows(session, model, ids):
+    """Delete ``model`` rows by id along with everything that cascades from them.
+
+    Runs in the session's transaction; returns ``(rows deleted, ids of recipes deleted)``.
+    """
+    ids = sorted(set(ids))
+    if not ids:
+        return 0, []
+    session.flush()
+    connection = session.connection()
+    table = model.__table__
+
+    removed_query = removed_recipes_query(model, ids)
+    removed = connection.execute(removed_query).scalars().all() if removed_query is not None else []
+    changed = set()
+    for link_model, (key, aggregate, target) in LINKS.items():
+        links = link_model.__table__
+        conditions = []
+        if removed:
+            conditions.append(links.c.recipe_id.in_(removed_query))
+        if model is target:
+            conditions.append(links.c[key].in_(ids))
+            changed.update(connection.execute(select(links.c.recipe_id).where(links.c[key].in_(ids)).distinct()).scalars())
+        if not conditions:
+            continue
+        condition = or_(*conditions)
+        if model is not target:
+            # A deleted ingredient's or category's own stats row cascades away with it.
+            counts = connection.execute(select(links.c[key], func.count()).where(condition).group_by(links.c[key]))
+            stats.apply_deltas(connection, aggregate, {k: -count for k, count in counts})
+        changes.record_query(connection, links.name, select(links.c.id, links.c.recipe_id).where(condition), 'delete')
+
+    if model is Recipe:
+        recipes = Recipe.__table__
+        counts = connection.execute(
+            select(recipes.c.user_id, func.count()).where(recipes.c.id.in_(ids)).group_by(recipes.c.user_id))
+        stats.apply_deltas(connection, stats.USER_RECIPES, {k: -count for k, count in counts})
+    elif removed:
+        changes.record_query(connection, Recipe.__tablename__, removed_query, 'delete')
+    changes.record_query(connection, table.name, select(table.c.id).where(table.c.id.in_(ids)), 'delete')
+
+    if removed:
+        # recipe_neighbors rows go with the recipes, so find the lists that lose a neighbour first.
+        similarity.pending_changes(session)['orphaned'].update(similarity.referencing(connection, removed_query))
+
+    deleted = 0
+    for chunk in chunked(ids):
+        deleted += connection.execute(table.delete().where(table.c.id.in_(chunk))).rowcount
+
+    changed.discard(None)
+    changed -= set(removed)
+    if changed or removed:
+        search.mark_recipes_changed(session, changed, removed)
+        pantry.mark_recipes_changed(session, changed, removed)
+        similarity.mark_recipes_changed(session, changed, removed)
+    return deleted, removed
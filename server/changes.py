@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""Append-only change log behind the ``/changes`` sync feed.
+
+Every flush that inserts, updates or deletes a row of one of the six API
+models appends ``(table, row id, op)`` entries to change_log in the same
+transaction. An entry's id is the sync token: clients fetch the lists once,
+then poll ``/changes?since=<token>`` and receive only what changed after it.
+
+Core writes bypass the session hooks and call ``record`` themselves.
+Tokens assume entries become visible in id order. That holds for SQLite's
+single writer; on a server database two overlapping transactions can commit
+out of order, so the feed holds back entries younger than
+CHANGE_FEED_SETTLE_SECONDS, which should exceed the longest write transaction.
+Entries older than CHANGE_LOG_RETENTION_DAYS are pruned; a client whose
+token predates the oldest entry has to refetch the lists.
+
+    python changes.py --prune             # drop entries past the retention period
+"""
+import argparse
+from datetime import datetime, timedelta
+from itertools import repeat
+
+from sqlalchemy import event, func, literal, select
+from sqlalchemy.orm import Session
+
+from batches import chunked
+from config import app, db
+from models import User, Recipe, Ingredient, RecipeIngredient, Category, RecipeCategory, ChangeLogEntry
+from serializers import serializer_for
+
+DEFAULT_RETENTION_DAYS = 30
+TRACKED = (User, Recipe, Ingredient, RecipeIngredient, Category, RecipeCategory)
+MODELS = {model.__tablename__: model for model in TRACKED}
+LINKS = (RecipeIngredient, RecipeCategory)
+# Written by seed.py after it rewrites tables behind the log's back; every older token is stale.
+RESET = 'reset'
+
+
+class ResyncRequired(Exception):
+    """The token predates the retained log, so the client must refetch the lists."""
+
+
+def record(connection, table_name, row_ids, op, recipe_ids=None):
+    """Append ``op`` entries for rows written with Core statements; pass ``recipe_ids`` for link rows."""
+    rows = [
+        {'table_name': table_name, 'row_id': row_id, 'recipe_id': recipe_id, 'op': op}
+        for row_id, recipe_id in zip(row_ids, recipe_ids or repeat(None))
+    ]
+    if rows:
+        connection.execute(ChangeLogEntry.__table__.insert(), rows)
+
+
+def record_query(connection, table_name, rows, op):
+    """Append ``op`` entries for every row a select of ``id`` (or ``id, recipe_id`` for links) returns.
+
+    Runs as one INSERT ... SELECT.
+    """
+    columns = ['row_id', 'recipe_id'][:len(rows.selected_columns)]
+    rows = rows.add_columns(literal(table_name), literal(op))
+    connection.execute(ChangeLogEntry.__table__.insert().from_select([*columns, 'table_name', 'op'], rows))
+
+
+def mark_reset(connection):
+    connection.execute(ChangeLogEntry.__table__.insert(), [{'table_name': '*', 'row_id': None, 'op': RESET}])
+
+
+@event.listens_for(Session, 'after_flush')
+def record_changes(session, flush_context):
+    rows = []
+    for instances, op in ((session.new, 'insert'), (session.dirty, 'update'), (session.deleted, 'delete')):
+        for instance in instances:
+            if not isinstance(instance, TRACKED) or instance.id is None:
+                continue
+            if op == 'update' and not session.is_modified(instance, include_collections=False):
+                continue
+            recipe_id = instance.recipe_id if isinstance(instance, LINKS) else None
+            rows.append({
+                'table_name': instance.__tablename__, 'row_id': instance.id, 'recipe_id': recipe_id, 'op': op,
+            })
+    if rows:
+        rows.sort(key=lambda row: (row['table_name'], row['row_id']))
+        session.connection().execute(ChangeLogEntry.__table__.insert(), rows)
+
+
+def head(connection):
+    """Token for "now": the newest entry, or 0 for an empty log."""
+    return connection.execute(select(func.coalesce(func.max(ChangeLogEntry.__table__.c.id), 0))).scalar()
+
+
+def entries_since(connection, since, limit, settle=0):
+    """Return ``(entries, next token)`` for replaying the log after ``since`` onto a copy of the data.
+
+    Raises ResyncRequired when the log no longer covers ``since``, when it
+    was reset, or when more than ``limit`` entries are waiting. Entries
+    younger than ``settle`` seconds are returned, but the token stays before
+    them so the next call reads them again.
+    """
+    table = ChangeLogEntry.__table__
+    oldest = connection.execute(select(func.min(table.c.id))).scalar()
+    if oldest is not None and since < oldest - 1:
+        raise ResyncRequired()
+    entries = connection.execute(
+        select(table.c.id, table.c.table_name, table.c.row_id, table.c.recipe_id, table.c.op, table.c.created_at)
+        .where(table.c.id > since)
+        .order_by(table.c.id)
+        .limit(limit + 1)
+    ).all()
+    if len(entries) > limit or any(entry.op == RESET for entry in entries):
+        raise ResyncRequired()
+    next_token = entries[-1].id if entries else since
+    if settle and entries:
+        cutoff = connection.execute(select(func.now())).scalar() - timedelta(seconds=settle)
+        unsettled = next((entry for entry in entries if entry.created_at > cutoff), None)
+        if unsettled is not None:
+            next_token = unsettled.id - 1
+    return entries, next_token
+
+
+def touched_recipes(entries, link_tables=()):
+    """Ids of the recipes ``entries`` wrote, or whose links in ``link_tables`` they wrote."""
+    recipe_ids = set()
+    for entry in entries:
+        if entry.table_name == Recipe.__tablename__:
+            recipe_ids.add(entry.row_id)
+        elif entry.table_name in link_tables:
+            recipe_ids.add(entry.recipe_id)
+    recipe_ids.discard(None)
+    return recipe_ids
+
+
+def current_rows(connection, table_name, row_ids):
+    model = MODELS[table_name]
+    serializer = serializer_for(model)
+    table = model.__table__
+    rows = {}
+    for ids in chunked(row_ids):
+        for row in connection.execute(select(*serializer.columns).where(table.c.id.in_(ids))):
+            rows[row.id] = serializer.row(row)
+    return rows
+
+
+def changes_since(connection, since, limit, settle=0):
+    """Return ``(changes, next token, more)`` for up to ``limit`` log entries after ``since``.
+
+    Entries for the same row are collapsed to one delta holding the row as it
+    is now: ``{'type', 'id', 'op': 'upsert', 'data'}``, or ``op: 'delete'``
+    once the row is gone. Deltas are ordered by their last entry. The batch
+    stops before the first entry written less than ``settle`` seconds ago.
+    """
+    table = ChangeLogEntry.__table__
+    oldest = connection.execute(select(func.min(table.c.id))).scalar()
+    if oldest is None:
+        if since:
+            raise ResyncRequired()
+        return [], 0, False
+    if since < oldest - 1 or since > head(connection):
+        raise ResyncRequired()
+
+    entries = connection.execute(
+        select(table.c.id, table.c.table_name, table.c.row_id, table.c.op, table.c.created_at)
+        .where(table.c.id > since)
+        .order_by(table.c.id)
+        .limit(limit + 1)
+    ).all()
+    more = len(entries) > limit
+    entries = entries[:limit]
+    if settle and entries:
+        cutoff = connection.execute(select(func.now())).scalar() - timedelta(seconds=settle)
+        settled = next((n for n, entry in enumerate(entries) if entry.created_at > cutoff), len(entries))
+        more = more and settled == len(entries)
+        entries = entries[:settled]
+
+    latest = {}
+    for entry in entries:
+        if entry.op == RESET:
+            raise ResyncRequired()
+        key = (entry.table_name, entry.row_id)
+        latest.pop(key, None)
+        latest[key] = entry
+
+    upserts = {}
+    for (table_name, row_id), entry in latest.items():
+        if entry.op != 'delete':
+            upserts.setdefault(table_name, []).append(row_id)
+    found = {table_name: current_rows(connection, table_name, ids) for table_name, ids in upserts.items()}
+
+    changes = []
+    for (table_name, row_id), entry in latest.items():
+        data = found.get(table_name, {}).get(row_id)
+        if data is None:
+            changes.append({'type': table_name, 'id': row_id, 'op': 'delete'})
+        else:
+            changes.append({'type': table_name, 'id': row_id, 'op': 'upsert', 'data': data})
+    next_token = entries[-1].id if entries else since
+    return changes, next_token, more
+
+
+def prune(connection, before):
+    """Delete entries created before ``before``, always keeping the newest one."""
+    table = ChangeLogEntry.__table__
+    newest = head(connection)
+    result = connection.execute(table.delete().where(table.c.created_at < before, table.c.id < newest))
+    return result.rowcount
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--prune', action='store_true', help='delete entries past the retention period')
+    parser.add_argument('--days', type=int, help='retention period (default CHANGE_LOG_RETENTION_DAYS)')
+    args = parser.parse_args()
+    with app.app_context():
+        with db.engine.begin() as connection:
+            if args.prune:
+                days = args.days or app.config.get('CHANGE_LOG_RETENTION_DAYS', DEFAULT_RETENTION_DAYS)
+                removed = prune(connection, datetime.utcnow() - timedelta(days=days))
+                print(f'Pruned {removed} change log entries older than {days} days')
+            print(f'Change log head: {head(connection)}')
+
+
+if __name__ == '__main__':
+    main()
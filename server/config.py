@@ -0,0 +1,266 @@
+# Standard library imports
+import math
+import os
+import sqlite3
+import time
+
+# Remote library imports
+from flask import Flask, g, has_request_context, request
+from flask_bcrypt import Bcrypt
+from flask_cors import CORS
+from flask_login import LoginManager
+from flask_restful import Api
+from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import MetaData, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql import functions
+
+# Local imports
+from lazy import LazyGroup
+
+
+class Config:
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'dev')
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///app.db')
+    REPLICA_DATABASE_URL = os.environ.get('REPLICA_DATABASE_URL')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    POOL_SIZE = 5
+    POOL_MAX_OVERFLOW = 10
+    POOL_TIMEOUT = 30
+    POOL_RECYCLE = 1800
+    POOL_PRE_PING = True
+    STATEMENT_TIMEOUT = 30
+
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'foreign_keys': 'ON',
+        'busy_timeout': 5000,
+        'cache_size': -64000,
+        'temp_store': 'MEMORY',
+        'mmap_size': 268435456,
+    }
+
+    PAGE_SIZE = 50
+    MAX_PAGE_SIZE = 500
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    # How often a memory cache checks whether another process has invalidated responses.
+    CACHE_SYNC_SECONDS = float(os.environ.get('CACHE_SYNC_SECONDS', 1.0))
+    BCRYPT_LOG_ROUNDS = 12
+    PASSWORD_HASH_WORKERS = os.cpu_count() or 1
+    SIMILARITY_METRIC = 'cosine'
+    SIMILARITY_NEIGHBORS = 20
+
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1') != '0'
+    RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+    RATE_LIMIT_REDIS_URL = os.environ.get('RATE_LIMIT_REDIS_URL', 'redis://localhost:6379/0')
+    RATE_LIMIT_TRUST_PROXY = False
+    # budget: (tokens per second, bucket size), applied per IP and per logged-in user
+    RATE_LIMITS = {
+        'default': (10.0, 50),
+        'expensive': (2.0, 10),
+        'auth': (0.2, 5),
+    }
+    MAX_IN_FLIGHT = int(os.environ.get('MAX_IN_FLIGHT', 64))
+    POOL_WAIT_THRESHOLD = 0.5
+
+    CHANGE_LOG_RETENTION_DAYS = 30
+    CHANGE_FEED_SETTLE_SECONDS = 0
+
+    JOB_QUEUE_URL = os.environ.get('JOB_QUEUE_URL', 'sqlite:///jobs.db')
+    # Worker threads per web process; 0 leaves every job to `python worker.py`.
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+    JOB_POLL_INTERVAL = 1.0
+    JOB_LEASE_SECONDS = 300
+    JOB_RETENTION_DAYS = 7
+    JOB_SPOOL_DIR = os.environ.get('JOB_SPOOL_DIR')
+
+
+class DevelopmentConfig(Config):
+    POOL_SIZE = 2
+    PASSWORD_HASH_WORKERS = 0
+    BCRYPT_LOG_ROUNDS = 10
+
+
+class TestingConfig(Config):
+    TESTING = True
+    RATE_LIMIT_ENABLED = False
+    JOB_QUEUE_URL = 'sqlite://'
+    JOB_WORKERS = 0
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite://')
+    PASSWORD_HASH_WORKERS = 0
+    BCRYPT_LOG_ROUNDS = 4
+
+
+class ProductionConfig(Config):
+    POOL_SIZE = int(os.environ.get('POOL_SIZE', 20))
+    POOL_MAX_OVERFLOW = int(os.environ.get('POOL_MAX_OVERFLOW', 20))
+    POOL_RECYCLE = 600
+    STATEMENT_TIMEOUT = int(os.environ.get('STATEMENT_TIMEOUT', 10))
+    CHANGE_FEED_SETTLE_SECONDS = int(os.environ.get('CHANGE_FEED_SETTLE_SECONDS', 15))
+
+
+CONFIGS = {
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+    'production': ProductionConfig,
+}
+
+
+def engine_options(config, url):
+    """SQLAlchemy engine arguments for ``url`` under ``config``."""
+    url = make_url(url)
+    options = {'pool_pre_ping': config.POOL_PRE_PING}
+    if url.get_backend_name() == 'sqlite':
+        options['connect_args'] = {'timeout': config.STATEMENT_TIMEOUT, 'check_same_thread': False}
+        if url.database and url.database != ':memory:':
+            options.update(poolclass=TimedQueuePool, pool_size=config.POOL_SIZE, max_overflow=config.POOL_MAX_OVERFLOW)
+        return options
+    options.update(
+        poolclass=TimedQueuePool,
+        pool_size=config.POOL_SIZE,
+        max_overflow=config.POOL_MAX_OVERFLOW,
+        pool_timeout=config.POOL_TIMEOUT,
+        pool_recycle=config.POOL_RECYCLE,
+    )
+    if url.get_backend_name() == 'postgresql':
+        options['connect_args'] = {'options': f'-c statement_timeout={config.STATEMENT_TIMEOUT * 1000}'}
+    elif url.get_backend_name() == 'mysql':
+        options['connect_args'] = {'init_command': f'SET SESSION max_execution_time={config.STATEMENT_TIMEOUT * 1000}'}
+    return options
+
+
+def load_config(app, name=None):
+    config = CONFIGS[name or os.environ.get('SAVOR_ENV', 'development')]
+    app.config.from_object(config)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(config, config.SQLALCHEMY_DATABASE_URI)
+    if config.REPLICA_DATABASE_URL:
+        app.config['SQLALCHEMY_BINDS'] = {
+            'replica': dict(engine_options(config, config.REPLICA_DATABASE_URL), url=config.REPLICA_DATABASE_URL),
+        }
+
+
+@event.listens_for(Engine, 'connect')
+def configure_sqlite(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for pragma, value in app.config.get('SQLITE_PRAGMAS', {}).items():
+        cursor.execute(f'PRAGMA {pragma} = {value}')
+    cursor.close()
+
+    # SQLite has no statement timeout; abort statements that run past their deadline.
+    info = connection_record.info
+    info['deadline'] = None
+    dbapi_connection.set_progress_handler(
+        lambda: info['deadline'] is not None and time.monotonic() > info['deadline'], 10000)
+
+
+@compiles(functions.now, 'sqlite')
+def sqlite_now(element, compiler, **kw):
+    # CURRENT_TIMESTAMP stores whole seconds, while SQLAlchemy binds datetimes with six fractional
+    # digits; SQLite compares the two as text, so keyset pages would skip rows stored by the default.
+    return "strftime('%Y-%m-%d %H:%M:%f000', 'now')"
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_sqlite_deadline(conn, cursor, statement, parameters, context, executemany):
+    if 'deadline' in conn.connection.info:
+        conn.connection.info['deadline'] = time.monotonic() + app.config.get('STATEMENT_TIMEOUT', 30)
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def clear_sqlite_deadline(conn, cursor, statement, parameters, context, executemany):
+    if 'deadline' in conn.connection.info:
+        conn.connection.info['deadline'] = None
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that keeps a moving average of how long checkouts wait for a connection.
+
+    The average decays while nothing checks out, so a burst of waiting stops
+    counting against admission once it has passed.
+    """
+
+    smoothing = 0.2
+    decay = 5.0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._wait = 0.0
+        self._wait_updated = time.monotonic()
+
+    def _do_get(self):
+        started = time.monotonic()
+        try:
+            return super()._do_get()
+        finally:
+            now = time.monotonic()
+            self._wait = self.wait_time(now) * (1 - self.smoothing) + (now - started) * self.smoothing
+            self._wait_updated = now
+
+    def wait_time(self, now=None):
+        now = time.monotonic() if now is None else now
+        return self._wait * math.exp(-(now - self._wait_updated) / self.decay)
+
+
+class RoutingSession(Session):
+    """Sends reads made while serving GET requests to the replica, everything else to the primary."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and 'replica' in app.config.get('SQLALCHEMY_BINDS', {}) \
+                and has_request_context() and g.get('use_replica'):
+            return db.engines['replica']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+# Instantiate app, set attributes
+app = Flask(__name__)
+load_config(app)
+app.json.compact = False
+
+# Define metadata, instantiate db
+metadata = MetaData(naming_convention={
+    "ix": "ix_%(column_0_label)s",
+    "uq": "uq_%(table_name)s_%(column_0_name)s",
+    "ck": "ck_%(table_name)s_%(constraint_name)s",
+    "fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s",
+    "pk": "pk_%(table_name)s",
+})
+db = SQLAlchemy(metadata=metadata, session_options={'class_': RoutingSession})
+db.init_app(app)
+
+
+def init_migrate():
+    from flask_migrate import Migrate
+    Migrate(app, db)
+
+
+# Flask-Migrate pulls in Alembic, which only `flask db` needs; load it when that command runs.
+app.cli.add_command(LazyGroup('db', 'flask_migrate.cli.db', setup=init_migrate, help='Perform database migrations.'))
+
+
+@app.before_request
+def route_reads():
+    g.use_replica = request.method in ('GET', 'HEAD')
+
+
+# Instantiate REST API
+api = Api(app)
+
+# Instantiate CORS
+CORS(app)
+
+bcrypt = Bcrypt(app)
+login_manager = LoginManager()
+
+
+@login_manager.user_loader
+def load_user(user_id):
+    from models import User
+    return db.session.get(User, int(user_id))
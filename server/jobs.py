@@ -0,0 +1,396 @@
+"""Durable background jobs for write-side work that should not hold up a response.
+
+Handlers call ``enqueue`` (or ``enqueue_after_commit`` from inside a
+transaction) and return. Jobs are rows in their own SQLite database
+(JOB_QUEUE_URL) and run on JOB_WORKERS threads started with a process's first
+request, or in separate worker processes started with ``python worker.py``.
+
+A failing job runs again after an exponential backoff until it has made
+``max_attempts`` attempts, then stays ``failed``. A running job's worker
+renews its lease (JOB_LEASE_SECONDS) while the task runs. If the worker dies,
+the lease runs out and the job is claimed again, so tasks with attempts left
+must be safe to repeat. A job with none left is marked ``failed`` instead.
+Enqueueing with an idempotency key that is already in the table returns the
+existing job instead of adding another.
+
+A task's name starts with the module that defines it, e.g. ``bulk.import``.
+Modules whose routes are registered lazily are imported when a job of theirs
+is first enqueued or run.
+"""
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta, timezone
+from importlib import import_module
+
+from sqlalchemy import (Column, DateTime, Index, Integer, MetaData, String, Table, Text,
+                        and_, create_engine, event, func, or_, select)
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from config import app
+import metrics
+from serializers import format_value
+
+DEFAULT_QUEUE_URL = 'sqlite:///jobs.db'
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_POLL_INTERVAL = 1.0
+DEFAULT_RETENTION_DAYS = 7
+RETRY_BASE_SECONDS = 5
+RETRY_MAX_SECONDS = 600
+STATES = ('queued', 'running', 'done', 'failed')
+
+metadata = MetaData()
+jobs = Table(
+    'jobs', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('name', String, nullable=False),
+    Column('payload', Text, nullable=False),
+    Column('idempotency_key', String, unique=True),
+    Column('state', String, nullable=False),
+    Column('attempts', Integer, nullable=False, default=0),
+    Column('max_attempts', Integer, nullable=False),
+    Column('run_at', DateTime, nullable=False),
+    Column('locked_by', String),
+    Column('locked_until', DateTime),
+    Column('last_error', Text),
+    Column('result', Text),
+    Column('created_at', DateTime, nullable=False),
+    Column('started_at', DateTime),
+    Column('finished_at', DateTime),
+    Index('ix_jobs_state_run_at', 'state', 'run_at'),
+)
+
+TASKS = {}
+
+_engine = None
+_engine_lock = threading.Lock()
+_wakeup = threading.Event()
+_worker = None
+_worker_lock = threading.Lock()
+
+job_wait = metrics.registry.histogram('savor_job_wait_seconds', 'Time from when a job was due until a worker started it.')
+job_duration = metrics.registry.histogram('savor_job_duration_seconds', 'Time spent running a job.')
+job_outcomes = metrics.registry.counter('savor_jobs_total', 'Job attempts by outcome.')
+
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def task(name, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """Register ``f`` as the job ``name``; its keyword arguments come from the JSON payload."""
+    def decorator(f):
+        TASKS[name] = (f, max_attempts)
+        return f
+    return decorator
+
+
+def get_task(name):
+    """The ``(function, max_attempts)`` registered as ``name``, importing its module if need be."""
+    if name not in TASKS:
+        try:
+            import_module(name.partition('.')[0])
+        except ModuleNotFoundError:
+            pass
+    return TASKS.get(name)
+
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                url = make_url(app.config.get('JOB_QUEUE_URL', DEFAULT_QUEUE_URL))
+                options = {}
+                if url.get_backend_name() == 'sqlite':
+                    options['connect_args'] = {'timeout': app.config.get('STATEMENT_TIMEOUT', 30), 'check_same_thread': False}
+                    if url.database in (None, '', ':memory:'):
+                        options['poolclass'] = StaticPool
+                    elif not os.path.isabs(url.database):
+                        # Relative paths live in the instance folder, like Flask-SQLAlchemy's.
+                        os.makedirs(app.instance_path, exist_ok=True)
+                        url = url.set(database=os.path.join(app.instance_path, url.database))
+                engine = create_engine(url, **options)
+                metadata.create_all(engine)
+                _engine = engine
+    return _engine
+
+
+def enqueue(name, payload=None, key=None, delay=0):
+    """Add a job and return its id, or the id of the job already holding ``key``."""
+    registered = get_task(name)
+    if registered is None:
+        raise ValueError(f'Unknown job: {name}')
+    now = utcnow()
+    row = {
+        'name': name,
+        'payload': json.dumps(payload or {}),
+        'idempotency_key': key,
+        'state': 'queued',
+        'attempts': 0,
+        'max_attempts': registered[1],
+        'run_at': now + timedelta(seconds=delay),
+        'created_at': now,
+    }
+    engine = get_engine()
+    try:
+        with engine.begin() as connection:
+            job_id = connection.execute(jobs.insert(), row).inserted_primary_key[0]
+    except IntegrityError:
+        if key is None:
+            raise
+        return job_for_key(key)
+    _wakeup.set()
+    return job_id
+
+
+def enqueue_after_commit(session, name, payload=None, key=None):
+    """Enqueue once ``session`` commits; nothing is queued if it rolls back."""
+    session.info.setdefault('jobs_pending', []).append((name, payload, key))
+
+
+@event.listens_for(Session, 'after_commit')
+def enqueue_pending(session):
+    for name, payload, key in session.info.pop('jobs_pending', ()):
+        try:
+            enqueue(name, payload, key)
+        except Exception:
+            # The data is committed already; the work is lost until it is redone by hand.
+            app.logger.exception('Enqueueing %s failed', name)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_pending(session):
+    session.info.pop('jobs_pending', None)
+
+
+def job_for_key(key):
+    with get_engine().connect() as connection:
+        return connection.execute(select(jobs.c.id).where(jobs.c.idempotency_key == key)).scalar()
+
+
+def get_payload(job_id):
+    with get_engine().connect() as connection:
+        payload = connection.execute(select(jobs.c.payload).where(jobs.c.id == job_id)).scalar()
+    return json.loads(payload) if payload is not None else None
+
+
+def get_job(job_id):
+    with get_engine().connect() as connection:
+        row = connection.execute(select(jobs).where(jobs.c.id == job_id)).first()
+    if row is None:
+        return None
+    return {
+        'id': row.id,
+        'name': row.name,
+        'state': row.state,
+        'attempts': row.attempts,
+        'max_attempts': row.max_attempts,
+        'last_error': row.last_error,
+        'result': json.loads(row.result) if row.result is not None else None,
+        'created_at': format_value(row.created_at),
+        'finished_at': format_value(row.finished_at),
+    }
+
+
+def expire(connection):
+    """Fail running jobs whose lease ran out on their last attempt; returns how many."""
+    now = utcnow()
+    result = connection.execute(
+        jobs.update()
+        .where(jobs.c.state == 'running', jobs.c.locked_until < now, jobs.c.attempts >= jobs.c.max_attempts)
+        .values(state='failed', finished_at=now, locked_by=None, locked_until=None,
+                last_error='The worker stopped renewing its lease on the last attempt')
+    )
+    return result.rowcount
+
+
+def claim(connection, worker_id, lease):
+    """Mark the next due job (or one whose lease ran out) running for ``worker_id`` and return it."""
+    now = utcnow()
+    candidate = (
+        select(jobs.c.id)
+        .where(or_(
+            and_(jobs.c.state == 'queued', jobs.c.run_at <= now),
+            and_(jobs.c.state == 'running', jobs.c.locked_until < now, jobs.c.attempts < jobs.c.max_attempts),
+        ))
+        .order_by(jobs.c.run_at, jobs.c.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    return connection.execute(
+        jobs.update()
+        .where(jobs.c.id == candidate)
+        .values(state='running', attempts=jobs.c.attempts + 1, locked_by=worker_id,
+                locked_until=now + timedelta(seconds=lease), started_at=now)
+        .returning(jobs.c.id, jobs.c.name, jobs.c.payload, jobs.c.attempts, jobs.c.max_attempts, jobs.c.run_at)
+    ).first()
+
+
+def renew(connection, job_id, worker_id, lease):
+    """Push out the lease on a job ``worker_id`` still holds; False if another worker took it."""
+    result = connection.execute(
+        jobs.update()
+        .where(jobs.c.id == job_id, jobs.c.state == 'running', jobs.c.locked_by == worker_id)
+        .values(locked_until=utcnow() + timedelta(seconds=lease))
+    )
+    return result.rowcount == 1
+
+
+class Heartbeat:
+    """Renews a job's lease every third of ``lease`` seconds until the block exits."""
+
+    def __init__(self, job_id, worker_id, lease):
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.lease = lease
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.beat, name=f'job-heartbeat-{job_id}', daemon=True)
+
+    def beat(self):
+        while not self.done.wait(self.lease / 3):
+            try:
+                with get_engine().begin() as connection:
+                    if not renew(connection, self.job_id, self.worker_id, self.lease):
+                        app.logger.warning('Job %s lease was taken by another worker', self.job_id)
+                        return
+            except Exception:
+                # Try again on the next beat; the lease still has two thirds left.
+                app.logger.exception('Renewing the lease on job %s failed', self.job_id)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.done.set()
+        self.thread.join()
+
+
+def retry_delay(attempts):
+    return min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+
+
+def finish(connection, job, worker_id, result=None, error=None):
+    """Record the outcome of an attempt; returns ``done``, ``retry`` or ``failed``."""
+    now = utcnow()
+    values = {'locked_by': None, 'locked_until': None, 'last_error': error}
+    if error is None:
+        outcome = 'done'
+        values.update(state='done', finished_at=now, result=json.dumps(result))
+    elif job.attempts >= job.max_attempts:
+        outcome = 'failed'
+        values.update(state='failed', finished_at=now)
+    else:
+        outcome = 'retry'
+        values.update(state='queued', run_at=now + timedelta(seconds=retry_delay(job.attempts)))
+    # A worker that overran its lease may have lost the job to another one.
+    connection.execute(jobs.update().where(jobs.c.id == job.id, jobs.c.locked_by == worker_id).values(values))
+    return outcome
+
+
+def run_job(job, worker_id, lease=DEFAULT_LEASE_SECONDS):
+    started = time.perf_counter()
+    job_wait.observe(max((utcnow() - job.run_at).total_seconds(), 0), name=job.name)
+    result = error = None
+    function = (get_task(job.name) or (None,))[0]
+    if function is None:
+        error = f'Unknown job: {job.name}'
+    else:
+        try:
+            with app.app_context(), Heartbeat(job.id, worker_id, lease):
+                result = function(**json.loads(job.payload))
+        except Exception:
+            app.logger.exception('Job %s (%s) failed', job.id, job.name)
+            error = traceback.format_exc()
+    job_duration.observe(time.perf_counter() - started, name=job.name)
+    with get_engine().begin() as connection:
+        outcome = finish(connection, job, worker_id, result, error)
+    job_outcomes.inc(name=job.name, outcome=outcome)
+    return outcome
+
+
+class Worker:
+    """Threads that claim and run jobs until ``stop`` is called."""
+
+    def __init__(self, threads=1, poll_interval=DEFAULT_POLL_INTERVAL, lease=DEFAULT_LEASE_SECONDS, burst=False):
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.burst = burst
+        self.stopping = threading.Event()
+        self.running = []
+
+    def start(self):
+        prefix = f'{socket.gethostname()}:{os.getpid()}'
+        for n in range(self.threads):
+            thread = threading.Thread(target=self.loop, args=(f'{prefix}:{n}',), name=f'job-worker-{n}', daemon=True)
+            thread.start()
+            self.running.append(thread)
+        return self
+
+    def loop(self, worker_id):
+        while not self.stopping.is_set():
+            try:
+                with get_engine().begin() as connection:
+                    expire(connection)
+                    job = claim(connection, worker_id, self.lease)
+                if job is not None:
+                    run_job(job, worker_id, self.lease)
+                    continue
+            except Exception:
+                # The queue database is unreachable or locked; an unfinished job is retried when its lease ends.
+                app.logger.exception('Job worker %s failed', worker_id)
+            if self.burst:
+                return
+            if _wakeup.wait(self.poll_interval):
+                _wakeup.clear()
+
+    def join(self):
+        for thread in self.running:
+            while thread.is_alive():
+                thread.join(timeout=1)
+
+    def stop(self):
+        self.stopping.set()
+        _wakeup.set()
+        self.join()
+
+
+def queue_depth():
+    with get_engine().connect() as connection:
+        counts = dict(connection.execute(select(jobs.c.state, func.count()).group_by(jobs.c.state)).all())
+    return {(('state', state),): counts.get(state, 0) for state in STATES}
+
+
+def start_workers():
+    """Start this process's JOB_WORKERS threads; called on the first request so forked servers each get their own."""
+    global _worker
+    threads = app.config.get('JOB_WORKERS', 0)
+    if _worker is None and threads:
+        with _worker_lock:
+            if _worker is None:
+                _worker = Worker(
+                    threads,
+                    app.config.get('JOB_POLL_INTERVAL', DEFAULT_POLL_INTERVAL),
+                    app.config.get('JOB_LEASE_SECONDS', DEFAULT_LEASE_SECONDS),
+                ).start()
+
+
+def init_app(app):
+    app.before_request(start_workers)
+    metrics.registry.gauge('savor_jobs', 'Jobs in the queue by state.', queue_depth)
+
+
+def prune(connection, before):
+    """Delete finished jobs, which also frees their idempotency keys."""
+    result = connection.execute(jobs.delete().where(jobs.c.state.in_(('done', 'failed')), jobs.c.finished_at < before))
+    return result.rowcount
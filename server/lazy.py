@@ -0,0 +1,68 @@
+"""Register Flask-RESTful resources and CLI commands whose modules are only imported on first use."""
+import threading
+from importlib import import_module
+
+import click
+
+
+class LazyResource:
+    """View function that imports ``module.Resource`` the first time a request reaches it."""
+
+    def __init__(self, api, import_name, endpoint, methods):
+        self.api = api
+        self.import_name = import_name
+        self.endpoint = endpoint
+        self.methods = methods
+        self.view = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        if self.view is None:
+            with self.lock:
+                if self.view is None:
+                    module, _, name = self.import_name.rpartition('.')
+                    resource = getattr(import_module(module), name)
+                    self.view = self.api.output(resource.as_view(self.endpoint))
+        return self.view
+
+    @property
+    def view_class(self):
+        return self.load().view_class
+
+    def __call__(self, **kwargs):
+        return self.load()(**kwargs)
+
+
+def add_lazy_resource(api, import_name, *urls, methods, endpoint=None):
+    """Like ``api.add_resource`` but takes ``'module.ResourceClass'``; ``methods`` must be listed up front."""
+    endpoint = endpoint or import_name.rpartition('.')[2].lower()
+    view = LazyResource(api, import_name, endpoint, methods)
+    api.endpoints.add(endpoint)
+    for url in urls:
+        api.app.add_url_rule(url, endpoint=endpoint, view_func=view)
+    return view
+
+
+class LazyGroup(click.Group):
+    """Stand-in for the Click group ``module.name``, which is imported when the command first runs.
+
+    ``setup`` runs before the import, e.g. to initialise the extension the commands use.
+    """
+
+    def __init__(self, name, import_name, setup=None, **kwargs):
+        super().__init__(name, **kwargs)
+        self.import_name = import_name
+        self.setup = setup
+        self.group = None
+
+    def load(self):
+        if self.group is None:
+            if self.setup:
+                self.setup()
+            module, _, name = self.import_name.rpartition('.')
+            self.group = getattr(import_module(module), name)
+        return self.group
+
+    def make_context(self, info_name, args, parent=None, **extra):
+        # The real group parses the options and runs its own callback before the subcommand.
+        return self.load().make_context(info_name, args, parent=parent, **extra)
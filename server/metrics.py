@@ -0,0 +1,297 @@
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from functools import wraps
+
+from flask import g, request, Response, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from serializers import ModelSerializer
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+STATEMENT_LITERALS = re.compile(r"'[^']*'|\b\d+\b|\?(\s*,\s*\?)+|%\(\w+\)s(\s*,\s*%\(\w+\)s)+")
+
+
+def label_string(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in sorted(labels.items())) + '}'
+
+
+class Histogram:
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.series = defaultdict(lambda: [[0] * (len(self.buckets) + 1), 0.0, 0])
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            counts, total, count = self.series[key]
+            counts[bisect_left(self.buckets, value)] += 1
+            self.series[key] = [counts, total + value, count + 1]
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self.series.items()}
+        for key, (counts, total, count) in sorted(series.items()):
+            labels = dict(key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{label_string(dict(labels, le=bound))} {cumulative}')
+            lines.append(f'{self.name}_sum{label_string(labels)} {total}')
+            lines.append(f'{self.name}_count{label_string(labels)} {count}')
+        return lines
+
+
+class CounterMetric:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = Counter()
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        with self.lock:
+            self.values[tuple(sorted(labels.items()))] += amount
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{label_string(dict(key))} {value}')
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, help, function):
+        self.name = name
+        self.help = help
+        self.function = function
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge']
+        values = self.function()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            lines.append(f'{self.name}{label_string(dict(key))} {value}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        return self.metrics.setdefault(metric.name, metric)
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, buckets))
+
+    def counter(self, name, help):
+        return self.register(CounterMetric(name, help))
+
+    def gauge(self, name, help, function):
+        return self.register(Gauge(name, help, function))
+
+    def expose(self):
+        lines = []
+        for name in sorted(self.metrics):
+            lines.extend(self.metrics[name].expose())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+request_latency = registry.histogram('savor_request_duration_seconds', 'Request latency by endpoint.')
+request_statements = registry.histogram('savor_request_sql_statements', 'SQL statements per request.', COUNT_BUCKETS)
+request_db_time = registry.histogram('savor_request_db_seconds', 'Time spent in the database per request.')
+request_serialization = registry.histogram(
+    'savor_request_serialization_seconds', 'Time spent serializing rows and encoding the response body.')
+response_size = registry.histogram('savor_response_size_bytes', 'Response body size.', SIZE_BUCKETS)
+n_plus_one = registry.counter('savor_n_plus_one_total', 'Requests that repeated one statement shape past the threshold.')
+
+
+# The request's serialization Timer, where serializer calls in this context add their time.
+serialization = ContextVar('serialization', default=None)
+
+
+class Timer:
+    __slots__ = ('elapsed',)
+
+    def __init__(self):
+        self.elapsed = 0.0
+
+
+def timed_serializer(method):
+    """Add the time spent in ``method`` to the current request's serialization time."""
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        timer = serialization.get()
+        if timer is None:
+            return method(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            timer.elapsed += time.perf_counter() - started
+    return wrapper
+
+
+def track_serialization():
+    """Count serializer calls made in this context, e.g. an async handler's, toward the current request."""
+    serialization.set(g.get('serialization'))
+
+
+def statement_shape(statement):
+    return ' '.join(STATEMENT_LITERALS.sub('?', statement).split())
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'sql_shapes' in g:
+        conn.info.setdefault('statement_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def finish_statement(conn, cursor, statement, parameters, context, executemany):
+    if not (has_request_context() and 'sql_shapes' in g):
+        return
+    started = conn.info.get('statement_started')
+    if started:
+        g.db_time += time.perf_counter() - started.pop()
+    g.sql_shapes[statement_shape(statement)] += 1
+
+
+class SamplingProfiler:
+    """Samples the stacks of in-flight request threads and keeps those of slow requests."""
+
+    def __init__(self, interval, threshold, directory):
+        self.interval = interval
+        self.threshold = threshold
+        self.directory = directory
+        self.active = {}
+        self.lock = threading.Lock()
+        thread = threading.Thread(target=self.run, name='savor-profiler', daemon=True)
+        thread.start()
+
+    def begin(self):
+        stacks = Counter()
+        with self.lock:
+            self.active[threading.get_ident()] = stacks
+        return stacks
+
+    def end(self, stacks, endpoint, elapsed):
+        # Under asgi.py a request may end on a different thread than it began on.
+        with self.lock:
+            for ident, active in list(self.active.items()):
+                if active is stacks:
+                    del self.active[ident]
+        if elapsed < self.threshold or not stacks:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'{endpoint}-{int(time.time() * 1000)}.folded')
+        with open(path, 'w') as folded:
+            for stack, count in stacks.most_common():
+                folded.write(f'{stack} {count}\n')
+        return path
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self.lock:
+                active = list(self.active.items())
+            for ident, stacks in active:
+                frame = frames.get(ident)
+                if frame is not None:
+                    stack = ';'.join(
+                        f'{entry.name} ({os.path.basename(entry.filename)}:{entry.lineno})'
+                        for entry in traceback.extract_stack(frame)
+                    )
+                    stacks[stack] += 1
+
+
+def init_app(app, api=None):
+    threshold = app.config.get('NPLUSONE_THRESHOLD', 10)
+    profiler = None
+    if app.config.get('PROFILE_SLOW_REQUESTS'):
+        profiler = SamplingProfiler(
+            app.config.get('PROFILE_INTERVAL', 0.005),
+            app.config.get('PROFILE_THRESHOLD', 0.5),
+            app.config.get('PROFILE_DIR', 'profiles'),
+        )
+
+    @app.before_request
+    def start_request():
+        g.request_started = time.perf_counter()
+        g.sql_shapes = Counter()
+        g.db_time = 0.0
+        g.serialization = Timer()
+        track_serialization()
+        if profiler:
+            g.profile_stacks = profiler.begin()
+
+    @app.after_request
+    def record_request(response):
+        if 'request_started' not in g:
+            return response
+        elapsed = time.perf_counter() - g.request_started
+        endpoint = request.endpoint or 'unmatched'
+        request_latency.observe(elapsed, endpoint=endpoint)
+        request_statements.observe(sum(g.sql_shapes.values()), endpoint=endpoint)
+        request_db_time.observe(g.db_time, endpoint=endpoint)
+        request_serialization.observe(g.serialization.elapsed, endpoint=endpoint)
+        if not response.is_streamed:
+            response_size.observe(response.calculate_content_length() or 0, endpoint=endpoint)
+
+        repeated = [(shape, count) for shape, count in g.sql_shapes.items() if count > threshold]
+        if repeated:
+            n_plus_one.inc(endpoint=endpoint)
+            for shape, count in repeated:
+                app.logger.warning('Possible N+1 on %s: %d x %s', endpoint, count, shape)
+        if profiler and 'profile_stacks' in g:
+            path = profiler.end(g.pop('profile_stacks'), endpoint, elapsed)
+            if path:
+                app.logger.warning('Slow request on %s (%.0f ms), stacks in %s', endpoint, elapsed * 1000, path)
+        return response
+
+    @app.teardown_request
+    def release_profile(exc):
+        serialization.set(None)
+        if profiler and 'profile_stacks' in g:
+            profiler.end(g.pop('profile_stacks'), request.endpoint or 'unmatched', 0)
+
+    # Every serialize() and row() call goes through these two methods.
+    if not hasattr(ModelSerializer.row, '__wrapped__'):
+        ModelSerializer.__call__ = timed_serializer(ModelSerializer.__call__)
+        ModelSerializer.row = timed_serializer(ModelSerializer.row)
+
+    if api is not None:
+        encode = api.representations['application/json']
+
+        def timed_json(data, code, headers=None):
+            started = time.perf_counter()
+            response = encode(data, code, headers)
+            if has_request_context() and 'serialization' in g:
+                g.serialization.elapsed += time.perf_counter() - started
+            return response
+
+        api.representations['application/json'] = timed_json
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(registry.expose(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""Bring an existing database up to the indexes and constraints declared in models.py.
+
+Safe to run repeatedly:
+
+    python migrate_indexes.py
+"""
+
+from sqlalchemy import DateTime, MetaData, Table, bindparam, func, inspect, or_, select, text
+from sqlalchemy.schema import AddConstraint, CreateIndex, CreateTable, DropConstraint
+
+from config import app
+from models import (db, User, Recipe, Ingredient, RecipeIngredient, Category, RecipeCategory, CategoryStat,
+                    IngredientStat, UserStat, RecipeNeighbor, ChangeLogEntry, IndexVersion, normalize_email)
+from quantities import parse_quantity
+import changes
+import search
+import similarity
+import stats
+import versions
+
+BATCH_SIZE = 10000
+
+
+def add_email_key(connection):
+    columns = {column['name'] for column in inspect(connection).get_columns('users')}
+    if 'email_key' not in columns:
+        print("Adding users.email_key...")
+        connection.execute(text('ALTER TABLE users ADD COLUMN email_key VARCHAR'))
+
+    users = User.__table__
+    while True:
+        rows = connection.execute(
+            select(users.c.id, users.c.email)
+            .where(users.c.email_key.is_(None), users.c.email.isnot(None))
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        connection.execute(
+            users.update().where(users.c.id == bindparam('user_id')).values(email_key=bindparam('key')),
+            [{'user_id': row.id, 'key': normalize_email(row.email)} for row in rows],
+        )
+
+
+def remove_duplicate_links(connection, model, key):
+    table = model.__table__
+    keep = select(func.min(table.c.id)).group_by(table.c.recipe_id, table.c[key])
+    result = connection.execute(table.delete().where(table.c.id.notin_(keep)))
+    if result.rowcount:
+        print(f"Removed {result.rowcount} duplicate {table.name} rows")
+
+
+def add_structured_quantities(connection):
+    """Add recipes.servings and recipeingredients.amount/unit, then parse every quantity once."""
+    recipe_columns = {column['name'] for column in inspect(connection).get_columns('recipes')}
+    if 'servings' not in recipe_columns:
+        print("Adding recipes.servings...")
+        connection.execute(text('ALTER TABLE recipes ADD COLUMN servings INTEGER'))
+    link_columns = {column['name'] for column in inspect(connection).get_columns('recipeingredients')}
+    if 'amount' not in link_columns:
+        print("Adding recipeingredients.amount and unit...")
+        connection.execute(text('ALTER TABLE recipeingredients ADD COLUMN amount FLOAT'))
+        connection.execute(text('ALTER TABLE recipeingredients ADD COLUMN unit VARCHAR'))
+
+    # Rows that can't be parsed keep a NULL amount, so walk the ids instead of re-selecting NULLs.
+    links = RecipeIngredient.__table__
+    last_id, parsed = 0, 0
+    while True:
+        rows = connection.execute(
+            select(links.c.id, links.c.quantity)
+            .where(links.c.id > last_id, links.c.amount.is_(None), links.c.quantity.isnot(None))
+            .order_by(links.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        updates = []
+        for row in rows:
+            amount, unit = parse_quantity(row.quantity)
+            if amount is not None:
+                updates.append({'link_id': row.id, 'parsed_amount': amount, 'parsed_unit': unit})
+        if updates:
+            connection.execute(
+                links.update().where(links.c.id == bindparam('link_id'))
+                .values(amount=bindparam('parsed_amount'), unit=bindparam('parsed_unit')),
+                updates,
+            )
+            parsed += len(updates)
+    if parsed:
+        print(f"Parsed {parsed} ingredient quantities")
+
+
+def fix_tablespoon_units(connection):
+    """Re-parse quantities read as teaspoons before "T" was told apart from "t"."""
+    links = RecipeIngredient.__table__
+    last_id, fixed = 0, 0
+    while True:
+        rows = connection.execute(
+            select(links.c.id, links.c.quantity)
+            .where(links.c.id > last_id, links.c.unit == 'tsp')
+            .order_by(links.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        updates = []
+        for row in rows:
+            amount, unit = parse_quantity(row.quantity)
+            if unit != 'tsp':
+                updates.append({'link_id': row.id, 'parsed_unit': unit})
+        if updates:
+            connection.execute(
+                links.update().where(links.c.id == bindparam('link_id')).values(unit=bindparam('parsed_unit')),
+                updates,
+            )
+            fixed += len(updates)
+    if fixed:
+        print(f"Changed {fixed} ingredient quantities from teaspoons to tablespoons")
+
+
+def create_stats_tables(connection):
+    tables = [CategoryStat.__table__, IngredientStat.__table__, UserStat.__table__]
+    missing = [table for table in tables if not inspect(connection).has_table(table.name)]
+    if missing:
+        print("Creating and filling aggregate tables...")
+        db.metadata.create_all(connection, tables=missing)
+        stats.rebuild(connection)
+
+
+def create_neighbor_table(connection):
+    if not inspect(connection).has_table(RecipeNeighbor.__tablename__):
+        print("Creating and filling recipe_neighbors...")
+        RecipeNeighbor.__table__.create(connection)
+        similarity.rebuild(connection)
+
+
+def create_index_versions(connection):
+    if not inspect(connection).has_table(IndexVersion.__tablename__):
+        print("Creating index_versions...")
+        IndexVersion.__table__.create(connection)
+
+
+def create_change_log(connection):
+    if not inspect(connection).has_table(ChangeLogEntry.__tablename__):
+        print("Creating change_log...")
+        ChangeLogEntry.__table__.create(connection)
+        return
+    columns = {column['name'] for column in inspect(connection).get_columns(ChangeLogEntry.__tablename__)}
+    if 'recipe_id' not in columns:
+        print("Adding change_log.recipe_id...")
+        connection.execute(text('ALTER TABLE change_log ADD COLUMN recipe_id INTEGER'))
+
+
+def create_search_table(connection):
+    """Give SQLite the FTS5 table that searches read, so the first search does not build it."""
+    if connection.dialect.name != 'sqlite' or not search.FTS5Index.available(connection):
+        return
+    if search.FTS5Index.ready(connection):
+        return
+    print("Creating and filling recipe_search...")
+    search.create_search_table(connection)
+
+
+def remove_orphaned_links(connection):
+    """Delete links left behind by ORM deletes that nulled their foreign keys instead of cascading."""
+    removed = 0
+    for model, key, target in ((RecipeIngredient, 'ingredient_id', Ingredient), (RecipeCategory, 'category_id', Category)):
+        table = model.__table__
+        recipes, targets = Recipe.__table__, target.__table__
+        orphaned = or_(
+            table.c.recipe_id.is_(None),
+            table.c[key].is_(None),
+            table.c.recipe_id.notin_(select(recipes.c.id)),
+            table.c[key].notin_(select(targets.c.id)),
+        )
+        # Logged like any other delete, so running servers drop the links from their indexes.
+        changes.record_query(connection, table.name, select(table.c.id, table.c.recipe_id).where(orphaned), 'delete')
+        removed += connection.execute(table.delete().where(orphaned)).rowcount
+    if removed:
+        print(f"Removed {removed} orphaned recipe links")
+        stats.rebuild(connection)
+        for name in versions.NAMES:
+            versions.advance(connection, name)
+
+
+def missing_cascades(connection, table):
+    """The model's ON DELETE CASCADE foreign keys that the database's copy of ``table`` lacks."""
+    existing = {
+        tuple(fk['constrained_columns']): fk for fk in inspect(connection).get_foreign_keys(table.name)
+    }
+    missing = []
+    for constraint in table.foreign_key_constraints:
+        if constraint.ondelete != 'CASCADE':
+            continue
+        reflected = existing.get(tuple(column.name for column in constraint.columns))
+        if reflected is None or (reflected.get('options', {}).get('ondelete') or '').upper() != 'CASCADE':
+            missing.append((constraint, reflected))
+    return missing
+
+
+def rebuild_sqlite_table(connection, table):
+    """SQLite cannot alter a constraint, so recreate ``table`` from the model and copy its rows."""
+    columns = [column['name'] for column in inspect(connection).get_columns(table.name)]
+    columns = ', '.join(f'"{name}"' for name in columns if name in table.c)
+    connection.execute(text(f'ALTER TABLE "{table.name}" RENAME TO "{table.name}__old"'))
+    connection.execute(CreateTable(table))
+    connection.execute(text(f'INSERT INTO "{table.name}" ({columns}) SELECT {columns} FROM "{table.name}__old"'))
+    connection.execute(text(f'DROP TABLE "{table.name}__old"'))
+    for index in table.indexes:
+        create_index(connection, index)
+
+
+def rebuild_sqlite_tables(connection, tables):
+    # Rebuilding a parent table with foreign keys on would cascade its DROP into the
+    # children, and a plain RENAME would repoint their references at the old copy.
+    connection.execute(text('PRAGMA foreign_keys = OFF'))
+    connection.execute(text('PRAGMA legacy_alter_table = ON'))
+    connection.commit()
+    try:
+        with connection.begin():
+            for table in tables:
+                rebuild_sqlite_table(connection, table)
+            problems = connection.execute(text('PRAGMA foreign_key_check')).all()
+            if problems:
+                raise RuntimeError(f'{len(problems)} rows violate foreign keys; run remove_orphaned_links first')
+    finally:
+        connection.execute(text('PRAGMA legacy_alter_table = OFF'))
+        connection.execute(text('PRAGMA foreign_keys = ON'))
+        connection.commit()
+
+
+def add_delete_cascades(engine):
+    """Give existing foreign keys the ON DELETE CASCADE declared in models.py."""
+    tables = [Recipe.__table__, RecipeIngredient.__table__, RecipeCategory.__table__]
+    with engine.connect() as connection:
+        pending = [(table, missing_cascades(connection, table)) for table in tables]
+        pending = [(table, missing) for table, missing in pending if missing]
+        connection.commit()
+        if not pending:
+            return
+        print(f"Adding ON DELETE CASCADE to {', '.join(table.name for table, missing in pending)}...")
+        if connection.dialect.name != 'sqlite':
+            with connection.begin():
+                for table, missing in pending:
+                    current = Table(table.name, MetaData(), autoload_with=connection)
+                    for constraint, reflected in missing:
+                        if reflected is not None:
+                            connection.execute(DropConstraint(next(
+                                fk for fk in current.foreign_key_constraints if fk.name == reflected['name'])))
+                        connection.execute(AddConstraint(constraint))
+            return
+        rebuild_sqlite_tables(connection, [table for table, missing in pending])
+
+
+def timestamp_columns(connection, table):
+    existing = {column['name'] for column in inspect(connection).get_columns(table.name)}
+    return [column.name for column in table.c if isinstance(column.type, DateTime) and column.name in existing]
+
+
+def fix_sqlite_timestamps(engine):
+    """Store SQLite timestamps in the one text format SQLAlchemy compares them with.
+
+    Tables created before config.sqlite_now still default to CURRENT_TIMESTAMP,
+    which drops the fractional seconds; rebuild them from the models and pad
+    the timestamps they already hold.
+    """
+    with engine.connect() as connection:
+        if connection.dialect.name != 'sqlite':
+            return
+        tables = [table for table in db.metadata.sorted_tables if timestamp_columns(connection, table)]
+        stale = [
+            table for table in tables
+            if 'CURRENT_TIMESTAMP' in (connection.execute(
+                text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': table.name}
+            ).scalar() or '').upper()
+        ]
+        connection.commit()
+        with connection.begin():
+            for table in tables:
+                for name in timestamp_columns(connection, table):
+                    connection.execute(text(
+                        f'UPDATE "{table.name}" SET "{name}" = "{name}" || \'.000000\' WHERE length("{name}") = 19'))
+        if stale:
+            print(f"Updating timestamp defaults on {', '.join(table.name for table in stale)}...")
+            rebuild_sqlite_tables(connection, stale)
+
+
+def create_index(connection, index):
+    if connection.dialect.name == 'sqlite':
+        # checkfirst relies on reflection, which skips expression indexes on SQLite.
+        connection.execute(CreateIndex(index, if_not_exists=True))
+    else:
+        index.create(connection, checkfirst=True)
+
+
+def create_indexes(connection):
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            create_index(connection, index)
+
+
+if __name__ == '__main__':
+    with app.app_context():
+        with db.engine.begin() as connection:
+            add_email_key(connection)
+            add_structured_quantities(connection)
+            fix_tablespoon_units(connection)
+            remove_duplicate_links(connection, RecipeIngredient, 'ingredient_id')
+            remove_duplicate_links(connection, RecipeCategory, 'category_id')
+            create_stats_tables(connection)
+            create_index_versions(connection)
+            create_neighbor_table(connection)
+            create_change_log(connection)
+            remove_orphaned_links(connection)
+            create_indexes(connection)
+            create_search_table(connection)
+        add_delete_cascades(db.engine)
+        fix_sqlite_timestamps(db.engine)
+        print("Indexes are up to date.")
@@ -8,7 +8,17 @@ from sqlalchemy.sql import select
 from flask_login import LoginManager
 import re
 
-from config import bcrypt, db
+from config import db
+import passwords
+from quantities import parse_quantity
+
+
+class DuplicateEmailError(ValueError):
+    pass
+
+
+def normalize_email(email):
+    return email.strip().casefold()
 
 
 class User(db.Model, SerializerMixin):
@@ -18,14 +28,15 @@ class User(db.Model, SerializerMixin):
     first_name = db.Column(db.String)
     last_name = db.Column(db.String)
     email = db.Column(db.String, unique=True)
+    email_key = db.Column(db.String, unique=True, index=True)
     _password_hash = db.Column(db.String)
     admin = db.Column(db.String, default=False)
     created_at = db.Column(db.DateTime, server_default=db.func.now())
     updated_at = db.Column(db.DateTime, onupdate=db.func.now())
 
-    recipes = db.relationship('Recipe', back_populates='user')
+    recipes = db.relationship('Recipe', back_populates='user', cascade='all, delete', passive_deletes=True)
 
-    serialize_rules = ('-recipes',)
+    serialize_rules = ('-recipes', '-email_key')
 
     @hybrid_property
     def password_hash(self):
@@ -33,26 +44,35 @@ class User(db.Model, SerializerMixin):
 
     @password_hash.setter
     def password_hash(self, password):
-        password_hash = bcrypt.generate_password_hash(
-            password.encode('utf-8'))
-        self._password_hash = password_hash.decode('utf-8')
+        self._password_hash = passwords.hash_password(password)
 
     def authenticate(self, password):
-        return bcrypt.check_password_hash(
-            self._password_hash, password.encode('utf-8'))
+        if not passwords.check_password(self._password_hash, password):
+            return False
+        if passwords.needs_rehash(self._password_hash):
+            self.password_hash = password
+        return True
 
     @validates('email')
     def validate_email(self, key, email):
-        users = User.query.all()
-        emails = [user.email for user in users]
         if not email:
             raise ValueError('Email must be provided')
-        elif email in emails:
-            raise ValueError('This email is already registered to an account - please log in.')
         elif not re.search('@', email):
             raise ValueError('Must be a valid email')
+        email = email.strip()
+        email_key = normalize_email(email)
+        if email_key != self.email_key and User.email_taken(email_key):
+            raise DuplicateEmailError('This email is already registered to an account - please log in.')
+        self.email_key = email_key
         return email
 
+    @classmethod
+    def email_taken(cls, email_key):
+        with db.session.no_autoflush:
+            return db.session.query(
+                db.session.query(cls.id).filter(cls.email_key == email_key).exists()
+            ).scalar()
+
     @validates('password')
     def validate_password(self, key, password):
         if len(password) < 8:
@@ -78,26 +98,36 @@ class Recipe(db.Model, SerializerMixin):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
     description = db.Column(db.String)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    servings = db.Column(db.Integer)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'))
     created_at = db.Column(db.DateTime, server_default=db.func.now())
     updated_at = db.Column(db.DateTime, onupdate=db.func.now())
 
     user = db.relationship('User', back_populates='recipes')
-    recipe_ingredients = db.relationship('RecipeIngredient', back_populates='recipe')
-    recipe_category = db.relationship('RecipeCategory', back_populates='recipe')
+    recipe_ingredients = db.relationship('RecipeIngredient', back_populates='recipe', cascade='all, delete', passive_deletes=True)
+    recipe_category = db.relationship('RecipeCategory', back_populates='recipe', cascade='all, delete', passive_deletes=True)
 
     serialize_rules = ('-user', '-recipe_ingredients', '-recipe_category')
 
+    __table_args__ = (
+        db.Index('ix_recipes_user_id_created_at', 'user_id', 'created_at'),
+        db.Index('ix_recipes_created_at_id', 'created_at', 'id'),
+    )
+
+
+# Recipes never edited have no updated_at, so "last modified" falls back to created_at.
+db.Index('ix_recipes_user_id_modified_at', Recipe.user_id, func.coalesce(Recipe.updated_at, Recipe.created_at), Recipe.id)
+
 
 class Ingredient(db.Model, SerializerMixin):
     __tablename__ = 'ingredients'
 
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String)
+    name = db.Column(db.String, index=True)
     created_at = db.Column(db.DateTime, server_default=db.func.now())
     updated_at = db.Column(db.DateTime, onupdate=db.func.now())
 
-    recipe_ingredients = db.relationship('RecipeIngredient', back_populates='ingredient')
+    recipe_ingredients = db.relationship('RecipeIngredient', back_populates='ingredient', cascade='all, delete', passive_deletes=True)
 
     serialize_rules = ('-recipe_ingredients',)
 
@@ -106,9 +136,11 @@ class RecipeIngredient(db.Model, SerializerMixin):
     __tablename__ = 'recipeingredients'
 
     id = db.Column(db.Integer, primary_key=True)
-    recipe_id = db.Column(db.Integer, db.ForeignKey('recipes.id'))
-    ingredient_id = db.Column(db.Integer, db.ForeignKey('ingredients.id'))
+    recipe_id = db.Column(db.Integer, db.ForeignKey('recipes.id', ondelete='CASCADE'))
+    ingredient_id = db.Column(db.Integer, db.ForeignKey('ingredients.id', ondelete='CASCADE'))
     quantity = db.Column(db.String)
+    amount = db.Column(db.Float)
+    unit = db.Column(db.String)
     created_at = db.Column(db.DateTime, server_default=db.func.now())
     updated_at = db.Column(db.DateTime, onupdate=db.func.now())
 
@@ -117,16 +149,26 @@ class RecipeIngredient(db.Model, SerializerMixin):
 
     serialize_rules = ('-recipe', '-ingredient')
 
+    @validates('quantity')
+    def validate_quantity(self, key, quantity):
+        self.amount, self.unit = parse_quantity(quantity)
+        return quantity
+
+    __table_args__ = (
+        db.Index('uq_recipeingredients_recipe_id_ingredient_id', 'recipe_id', 'ingredient_id', unique=True),
+        db.Index('ix_recipeingredients_ingredient_id', 'ingredient_id'),
+    )
+
 
 class Category(db.Model, SerializerMixin):
     __tablename__ = 'categories'
 
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String)
+    name = db.Column(db.String, index=True)
     created_at = db.Column(db.DateTime, server_default=db.func.now())
     updated_at = db.Column(db.DateTime, onupdate=db.func.now())
 
-    recipe_category = db.relationship('RecipeCategory', back_populates='category')
+    recipe_category = db.relationship('RecipeCategory', back_populates='category', cascade='all, delete', passive_deletes=True)
 
     serialize_rules = ('-recipe_category')
 
@@ -135,8 +177,8 @@ class RecipeCategory(db.Model, SerializerMixin):
     __tablename__ = 'recipecategories'
 
     id = db.Column(db.Integer, primary_key=True)
-    recipe_id = db.Column(db.Integer, db.ForeignKey('recipes.id'))
-    category_id = db.Column(db.Integer, db.ForeignKey('categories.id'))
+    recipe_id = db.Column(db.Integer, db.ForeignKey('recipes.id', ondelete='CASCADE'))
+    category_id = db.Column(db.Integer, db.ForeignKey('categories.id', ondelete='CASCADE'))
     created_at = db.Column(db.DateTime, server_default=db.func.now())
     updated_at = db.Column(db.DateTime, onupdate=db.func.now())
 
@@ -145,3 +187,64 @@ class RecipeCategory(db.Model, SerializerMixin):
 
     serialize_rules = ('-recipe', '-category')
 
+    __table_args__ = (
+        db.Index('uq_recipecategories_recipe_id_category_id', 'recipe_id', 'category_id', unique=True),
+        db.Index('ix_recipecategories_category_id', 'category_id'),
+    )
+
+
+
+class CategoryStat(db.Model):
+    __tablename__ = 'category_stats'
+
+    category_id = db.Column(db.Integer, db.ForeignKey('categories.id', ondelete='CASCADE'), primary_key=True)
+    recipe_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class IngredientStat(db.Model):
+    __tablename__ = 'ingredient_stats'
+
+    ingredient_id = db.Column(db.Integer, db.ForeignKey('ingredients.id', ondelete='CASCADE'), primary_key=True)
+    usage_count = db.Column(db.Integer, nullable=False, default=0, index=True)
+
+
+class UserStat(db.Model):
+    __tablename__ = 'user_stats'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    recipe_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class RecipeNeighbor(db.Model):
+    __tablename__ = 'recipe_neighbors'
+
+    recipe_id = db.Column(db.Integer, db.ForeignKey('recipes.id', ondelete='CASCADE'), primary_key=True)
+    neighbor_id = db.Column(db.Integer, db.ForeignKey('recipes.id', ondelete='CASCADE'), primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_recipe_neighbors_neighbor_id', 'neighbor_id'),
+    )
+
+
+class ChangeLogEntry(db.Model):
+    __tablename__ = 'change_log'
+
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String, nullable=False)
+    row_id = db.Column(db.Integer)
+    # For recipe link rows, the recipe they belong to; a deleted link can't be looked up afterwards.
+    recipe_id = db.Column(db.Integer)
+    op = db.Column(db.String, nullable=False)
+    created_at = db.Column(db.DateTime, server_default=db.func.now(), index=True)
+
+    # Ids are change tokens, so SQLite must never hand out a deleted id again.
+    __table_args__ = {'sqlite_autoincrement': True}
+
+
+# Counts the committed transactions that changed what each in-memory index is built from.
+class IndexVersion(db.Model):
+    __tablename__ = 'index_versions'
+
+    name = db.Column(db.String, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
@@ -0,0 +1,163 @@
+import base64
+import json
+from datetime import datetime
+
+from flask import request, current_app
+from sqlalchemy import Column, and_, or_
+
+from serializers import serializer_for
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def sort_keys(model):
+    """Columns ``model`` pages can sort by: id, and any column indexed together with id as ``(column, id)``.
+
+    Without that index a keyset page has to scan and sort the whole table.
+    """
+    table = model.__table__
+    keys = ['id']
+    for index in table.indexes:
+        expressions = list(index.expressions)
+        if len(expressions) == 2 and expressions[1] is table.c.id and isinstance(expressions[0], Column):
+            keys.append(expressions[0].key)
+    return tuple(keys)
+
+
+def cursor_value(value):
+    """A sort value as written into a cursor; timestamps keep their microseconds."""
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ', timespec='microseconds')
+    return value
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+
+def decode_keyset(cursor, sort):
+    """Decode a keyset cursor into its sort values: a timestamp unless ``sort`` is id, then the id."""
+    try:
+        values = decode_cursor(cursor)
+        if not isinstance(values, list) or len(values) != (1 if sort == 'id' else 2) or not isinstance(values[-1], int):
+            raise ValueError('Invalid cursor')
+        if sort != 'id':
+            values[0] = datetime.fromisoformat(values[0])
+    except (ValueError, TypeError, KeyError):
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def decode_offset(cursor):
+    """Decode an offset cursor from a ranked listing; no cursor means the first page."""
+    if not cursor:
+        return 0
+    try:
+        offset = decode_cursor(cursor)[0]
+        if not isinstance(offset, int) or offset < 0:
+            raise ValueError('Invalid cursor')
+    except (ValueError, TypeError, KeyError, IndexError):
+        raise ValueError('Invalid cursor')
+    return offset
+
+
+def page_size():
+    default = current_app.config.get('PAGE_SIZE', DEFAULT_PAGE_SIZE)
+    maximum = current_app.config.get('MAX_PAGE_SIZE', MAX_PAGE_SIZE)
+    try:
+        limit = int(request.args.get('limit', default))
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        raise ValueError('limit must be a positive integer')
+    return min(limit, maximum)
+
+
+def requested_fields(model):
+    fields = request.args.get('fields')
+    if not fields:
+        return None
+    allowed = serializer_for(model).fields
+    names = [name.strip() for name in fields.split(',') if name.strip()]
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        raise ValueError(f'Unknown fields: {", ".join(unknown)}')
+    return names
+
+
+class Page:
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def headers(self):
+        if self.next_cursor is None:
+            return {}
+        return {'X-Next-Cursor': self.next_cursor}
+
+
+def paginate(model, query=None, serialize=None):
+    """Return one keyset page of ``model`` rows driven by the request args.
+
+    Supports ``limit``, ``cursor``, ``sort`` (one of ``sort_keys(model)``), ``order``
+    (asc or desc) and ``fields``. Unless a ``serialize`` callable is given,
+    only the selected columns are read and rows are never hydrated.
+    """
+    sort = request.args.get('sort', 'id')
+    keys = sort_keys(model)
+    if sort not in keys:
+        raise ValueError(f'sort must be one of: {", ".join(keys)}')
+    descending = request.args.get('order', 'asc') == 'desc'
+    limit = page_size()
+    fields = requested_fields(model)
+    serializer = serializer_for(model)
+    if fields is None and serialize is None:
+        fields = list(serializer.fields)
+
+    id_column = model.__table__.c.id
+    sort_columns = [id_column] if sort == 'id' else [model.__table__.c[sort], id_column]
+
+    if query is None:
+        query = model.query
+    if fields is not None:
+        extra = [column for column in sort_columns if column.key not in fields]
+        query = query.with_entities(*[model.__table__.c[name] for name in fields], *extra)
+
+    cursor = request.args.get('cursor')
+    if cursor:
+        query = query.filter(keyset_after(sort_columns, decode_keyset(cursor, sort), descending))
+
+    order = [column.desc() if descending else column.asc() for column in sort_columns]
+    rows = query.order_by(*order).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor([cursor_value(getattr(last, column.key)) for column in sort_columns])
+
+    if fields is not None:
+        items = [serializer.row(row, fields) for row in rows]
+    else:
+        items = [serialize(row) for row in rows]
+    return Page(items, next_cursor)
+
+
+def keyset_after(columns, values, descending=False):
+    clauses = []
+    for index, column in enumerate(columns):
+        equal = [columns[i] == values[i] for i in range(index)]
+        beyond = column < values[index] if descending else column > values[index]
+        clauses.append(and_(*equal, beyond))
+    return or_(*clauses)
@@ -0,0 +1,130 @@
+import heapq
+import threading
+from collections import Counter, defaultdict
+from itertools import chain
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from batches import chunked
+from models import Recipe, RecipeIngredient
+import changes
+import versions
+
+
+def load_ingredient_sets(connection, recipe_ids=None):
+    """Return ``{recipe_id: frozenset(ingredient_ids)}`` read from the join table."""
+    links = RecipeIngredient.__table__
+    base = links.select().with_only_columns(links.c.recipe_id, links.c.ingredient_id)
+    sets = defaultdict(set)
+    if recipe_ids is None:
+        batches = [connection.execution_options(stream_results=True).execute(base)]
+    else:
+        batches = (connection.execute(base.where(links.c.recipe_id.in_(ids))) for ids in chunked(recipe_ids))
+    for rows in batches:
+        for row in rows:
+            if row.recipe_id is not None and row.ingredient_id is not None:
+                sets[row.recipe_id].add(row.ingredient_id)
+    return {recipe_id: frozenset(ingredients) for recipe_id, ingredients in sets.items()}
+
+
+def current_sets(connection, recipe_ids):
+    """``load_ingredient_sets`` for ``recipe_ids``, with an empty set for recipes without links or rows."""
+    ingredient_sets = load_ingredient_sets(connection, recipe_ids)
+    ingredient_sets.update({recipe_id: frozenset() for recipe_id in set(recipe_ids) - set(ingredient_sets)})
+    return ingredient_sets
+
+
+class PantryIndex:
+    """Postings from ingredient to recipes, plus each recipe's ingredient set."""
+
+    def __init__(self, connection):
+        self.lock = threading.RLock()
+        self.recipes = {}
+        self.postings = defaultdict(set)
+        self.apply(load_ingredient_sets(connection), ())
+
+    def apply(self, ingredient_sets, removed):
+        with self.lock:
+            for recipe_id in chain(ingredient_sets, removed):
+                for ingredient_id in self.recipes.pop(recipe_id, ()):
+                    posting = self.postings[ingredient_id]
+                    posting.discard(recipe_id)
+                    if not posting:
+                        del self.postings[ingredient_id]
+            for recipe_id, ingredients in ingredient_sets.items():
+                if not ingredients:
+                    continue
+                self.recipes[recipe_id] = ingredients
+                for ingredient_id in ingredients:
+                    self.postings[ingredient_id].add(recipe_id)
+
+    def match(self, ingredient_ids, limit, offset=0, max_missing=None):
+        """Rank recipes by how few of their ingredients are missing from ``ingredient_ids``.
+
+        Returns ``(recipe_id, covered, missing)`` tuples, fully makeable recipes first.
+        """
+        with self.lock:
+            postings = [self.postings[i] for i in set(ingredient_ids) if i in self.postings]
+            covered = Counter()
+            covered.update(chain.from_iterable(postings))
+            candidates = (
+                (recipe_id, count, len(self.recipes[recipe_id]) - count)
+                for recipe_id, count in covered.items()
+            )
+            if max_missing is not None:
+                candidates = (candidate for candidate in candidates if candidate[2] <= max_missing)
+            ranked = heapq.nsmallest(offset + limit, candidates, key=lambda c: (c[2], -c[1], c[0]))
+        return ranked[offset:]
+
+    def missing(self, recipe_id, ingredient_ids):
+        with self.lock:
+            return sorted(self.recipes.get(recipe_id, frozenset()) - set(ingredient_ids))
+
+
+def catch_up(index, connection, entries):
+    """Reload the ingredient sets of the recipes that change_log ``entries`` touched."""
+    recipe_ids = changes.touched_recipes(entries, (RecipeIngredient.__tablename__,))
+    index.apply(current_sets(connection, recipe_ids), ())
+
+
+_index = versions.LocalIndex('pantry', PantryIndex, catch_up)
+
+
+def get_index():
+    return _index.get()
+
+
+@event.listens_for(Session, 'after_flush')
+def record_pantry_changes(session, flush_context):
+    changed, removed = set(), set()
+    for instance in chain(session.new, session.dirty, session.deleted):
+        if isinstance(instance, RecipeIngredient):
+            changed.add(instance.recipe_id)
+            changed.update(inspect(instance).attrs.recipe_id.history.deleted or ())
+        elif isinstance(instance, Recipe) and instance in session.deleted:
+            removed.add(instance.id)
+    changed.discard(None)
+    if changed or removed:
+        mark_recipes_changed(session, changed, removed)
+
+
+def mark_recipes_changed(session, changed, removed=()):
+    """Queue recipes written outside the ORM unit of work for reindexing on commit."""
+    version = versions.bump(session, 'pantry')
+    if _index.index is None:
+        return
+    changed, removed = set(changed) - set(removed), set(removed)
+    ingredient_sets = current_sets(session.connection(), changed)
+    session.info.setdefault('pantry_pending', []).append((ingredient_sets, removed, version))
+
+
+@event.listens_for(Session, 'after_commit')
+def apply_pantry_changes(session):
+    for ingredient_sets, removed, version in session.info.pop('pantry_pending', ()):
+        _index.apply(version, lambda index: index.apply(ingredient_sets, removed))
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_pantry_changes(session):
+    session.info.pop('pantry_pending', None)
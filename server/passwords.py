@@ -0,0 +1,80 @@
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as HashTimeout
+
+import bcrypt
+from flask import current_app
+
+DEFAULT_ROUNDS = 12
+HASH_TIMEOUT = 10
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = None
+
+
+class PasswordHasherBusy(RuntimeError):
+    pass
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check(password_hash, password):
+    return bcrypt.checkpw(password, password_hash.encode('utf-8'))
+
+
+def rounds():
+    return current_app.config.get('BCRYPT_LOG_ROUNDS', DEFAULT_ROUNDS)
+
+
+def get_pool():
+    """Return the shared hashing pool, or None when hashing runs inline (workers = 0)."""
+    global _pool, _slots
+    workers = current_app.config.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1)
+    if not workers:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                queue = current_app.config.get('PASSWORD_HASH_QUEUE', workers * 4)
+                _slots = threading.BoundedSemaphore(workers + queue)
+                _pool = ProcessPoolExecutor(max_workers=workers)
+    return _pool
+
+
+def run(function, *args):
+    pool = get_pool()
+    if pool is None:
+        return function(*args)
+    slots = _slots
+    if not slots.acquire(timeout=current_app.config.get('PASSWORD_HASH_WAIT', 1)):
+        raise PasswordHasherBusy('Too many password operations in progress')
+    try:
+        future = pool.submit(function, *args)
+    except BaseException:
+        slots.release()
+        raise
+    # The slot stays taken until the hash finishes, even when the request stops waiting for it.
+    future.add_done_callback(lambda future: slots.release())
+    try:
+        return future.result(timeout=HASH_TIMEOUT)
+    except HashTimeout:
+        raise PasswordHasherBusy('Password operation timed out')
+
+
+def hash_password(password):
+    return run(_hash, password.encode('utf-8'), rounds())
+
+
+def check_password(password_hash, password):
+    if not password_hash:
+        return False
+    return run(_check, password_hash, password.encode('utf-8'))
+
+
+def needs_rehash(password_hash):
+    match = re.match(r'^\$2[abxy]?\$(\d{2})\$', password_hash or '')
+    return match is None or int(match.group(1)) != rounds()
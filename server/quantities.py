@@ -0,0 +1,121 @@
+"""Parse free-form ingredient quantities such as "1 1/2 cups" into an amount and a canonical unit."""
+import re
+from fractions import Fraction
+
+DEFAULT_SERVINGS = 4
+
+# canonical unit -> (dimension, size in the dimension's base unit: ml, g or piece)
+UNITS = {
+    'ml': ('volume', 1.0),
+    'l': ('volume', 1000.0),
+    'tsp': ('volume', 4.92892),
+    'tbsp': ('volume', 14.7868),
+    'fl oz': ('volume', 29.5735),
+    'cup': ('volume', 236.588),
+    'pint': ('volume', 473.176),
+    'quart': ('volume', 946.353),
+    'gallon': ('volume', 3785.41),
+    'mg': ('mass', 0.001),
+    'g': ('mass', 1.0),
+    'kg': ('mass', 1000.0),
+    'oz': ('mass', 28.3495),
+    'lb': ('mass', 453.592),
+    'piece': ('count', 1.0),
+    'clove': ('clove', 1.0),
+    'slice': ('slice', 1.0),
+    'can': ('can', 1.0),
+    'pinch': ('pinch', 1.0),
+}
+
+# Recipes write a tablespoon as "T" and a teaspoon as "t", so these are matched before lowercasing.
+CASE_SENSITIVE_ALIASES = {'T': 'tbsp', 'Tb': 'tbsp', 't': 'tsp'}
+
+ALIASES = {
+    'milliliter': 'ml', 'millilitre': 'ml', 'ml': 'ml',
+    'liter': 'l', 'litre': 'l', 'l': 'l',
+    'teaspoon': 'tsp', 'tsp': 'tsp',
+    'tablespoon': 'tbsp', 'tbsp': 'tbsp', 'tbs': 'tbsp', 'tbl': 'tbsp',
+    'fluid ounce': 'fl oz', 'fl oz': 'fl oz', 'fl. oz': 'fl oz',
+    'cup': 'cup', 'c': 'cup',
+    'pint': 'pint', 'pt': 'pint',
+    'quart': 'quart', 'qt': 'quart',
+    'gallon': 'gallon', 'gal': 'gallon',
+    'milligram': 'mg', 'mg': 'mg',
+    'gram': 'g', 'gramme': 'g', 'g': 'g', 'gr': 'g',
+    'kilogram': 'kg', 'kilo': 'kg', 'kg': 'kg',
+    'ounce': 'oz', 'oz': 'oz',
+    'pound': 'lb', 'lb': 'lb',
+    'piece': 'piece', 'pc': 'piece', 'pcs': 'piece', 'whole': 'piece', 'each': 'piece',
+    'clove': 'clove', 'slice': 'slice', 'can': 'can', 'pinch': 'pinch',
+}
+
+VULGAR_FRACTIONS = {'¼': '1/4', '½': '1/2', '¾': '3/4', '⅓': '1/3', '⅔': '2/3', '⅛': '1/8'}
+
+NUMBER = r'\d+\s+\d+/\d+|\d+/\d+|\d*\.\d+|\d+'
+QUANTITY = re.compile(rf'^\s*(?P<amount>{NUMBER})(?:\s*(?:-|to)\s*(?P<upper>{NUMBER}))?\s*(?P<unit>[a-z][a-z. ]*)?', re.I)
+
+
+def parse_number(text):
+    return float(sum(Fraction(part) for part in text.split()))
+
+
+def canonical_unit(word):
+    """Map a unit as written ("Tablespoons", "lbs.", "T") to its canonical name, or None."""
+    word = ' '.join(word.replace('.', ' ').split())
+    if word in CASE_SENSITIVE_ALIASES:
+        return CASE_SENSITIVE_ALIASES[word]
+    word = word.lower()
+    for candidate in (word, word[:-2] if word.endswith('es') else word, word[:-1] if word.endswith('s') else word):
+        if candidate in ALIASES:
+            return ALIASES[candidate]
+    return None
+
+
+def parse_quantity(text):
+    """Return ``(amount, unit)`` for a quantity string, or ``(None, None)`` if it can't be read.
+
+    A number without a known unit ("3", "3 large eggs") counts pieces; a range
+    such as "2-3 cups" keeps the upper bound.
+    """
+    if not text or not isinstance(text, str):
+        return None, None
+    for symbol, fraction in VULGAR_FRACTIONS.items():
+        text = text.replace(symbol, f' {fraction}')
+    match = QUANTITY.match(text)
+    if not match:
+        return None, None
+    amount = parse_number(match.group('upper') or match.group('amount'))
+    words = (match.group('unit') or '').split()
+    # Try the longest prefix first so "fl oz" wins over "fl"; trailing words are descriptions ("chopped").
+    for length in range(min(len(words), 2), 0, -1):
+        unit = canonical_unit(' '.join(words[:length]))
+        if unit:
+            return amount, unit
+    return amount, 'piece'
+
+
+def format_quantity(amount, unit):
+    if amount is None:
+        return None
+    amount = round(amount, 2)
+    if unit == 'piece':
+        return f'{amount:g}'
+    return f'{amount:g} {unit}'
+
+
+def scaled_quantity(quantity, amount, unit, factor):
+    """The ``quantity``/``amount``/``unit`` fields of a recipe ingredient multiplied by ``factor``.
+
+    Quantities that could not be parsed are returned unchanged.
+    """
+    if amount is None or factor == 1:
+        return {'quantity': quantity, 'amount': amount, 'unit': unit}
+    amount = amount * factor
+    return {'quantity': format_quantity(amount, unit), 'amount': round(amount, 4), 'unit': unit}
+
+
+def servings_factor(servings, base_servings):
+    """Multiplier that takes a recipe from its own servings (or DEFAULT_SERVINGS) to ``servings``."""
+    if not servings:
+        return 1
+    return servings / (base_servings or DEFAULT_SERVINGS)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""Fail if a statement the app issues while serving a request would scan a whole table.
+
+Sends each request in SCENARIOS through the Flask test client against a
+small dataset, records every statement the app sends to the database, and
+runs EXPLAIN on each one:
+
+    python query_plans.py
+    python query_plans.py --database-url postgresql://localhost/savor_scratch --verbose
+
+--database-url must name a scratch database: the tables are created if they
+are missing, and the sample rows are inserted and deleted again.
+"""
+import argparse
+import os
+import re
+import sys
+
+SQLITE_FULL_SCAN = re.compile(r'\bSCAN (\w+)')
+POSTGRES_FULL_SCAN = re.compile(r'Seq Scan on (\w+)')
+EXPLAINED = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+PASSWORD = 'sample!pass'
+
+# (label, method, path, JSON body); the path is formatted with the ids from fill().
+# Run in order with the owner logged in, so the deletes come last.
+SCENARIOS = [
+    ('Login.post', 'POST', '/login', {'email': 'owner@example.com', 'password': PASSWORD}),
+    ('Users.get', 'GET', '/users?limit=1', None),
+    ('Users.get next page', 'GET', '/users?limit=1&cursor={user_cursor}', None),
+    ('UserByID.get', 'GET', '/users/{owner}?with_counts=1', None),
+    ('UserRecipes.get', 'GET', '/users/{owner}/recipes?limit=1', None),
+    ('UserRecipes.get by updated_at', 'GET', '/users/{owner}/recipes?sort=updated_at&order=desc', None),
+    ('UserRecommendations.get', 'GET', '/users/{owner}/recommendations', None),
+    ('Recipes.get', 'GET', '/recipes?limit=1', None),
+    ('Recipes.get by created_at', 'GET', '/recipes?sort=created_at&order=desc&limit=1', None),
+    ('Recipes.get expanded', 'GET', '/recipes?expand=ingredients,categories,user', None),
+    ('RecipeByID.get', 'GET', '/recipes/{recipe}?expand=ingredients,categories,user&servings=4', None),
+    ('RecipeSearch.get', 'GET', '/recipes/search?q=tomato&expand=ingredients', None),
+    ('MakeableRecipes.get', 'GET', '/recipes/makeable?ingredients={ingredient}', None),
+    ('SimilarRecipes.get', 'GET', '/recipes/{recipe}/similar', None),
+    ('ShoppingList.get', 'GET', '/shopping-list?recipes={recipe}:4,{other_recipe}', None),
+    ('Ingredients.get', 'GET', '/ingredients', None),
+    ('TopIngredients.get', 'GET', '/ingredients/top', None),
+    ('IngredientByID.get', 'GET', '/ingredients/{ingredient}', None),
+    ('Categories.get', 'GET', '/categories?with_counts=1', None),
+    ('CategoryByID.get', 'GET', '/categories/{category}', None),
+    ('Changes.get', 'GET', '/changes?since={change_token}', None),
+    ('RecipeIngredients.put', 'PUT', '/recipes/{recipe}/ingredients',
+     {'ingredients': [{'ingredient_id': '{other_ingredient}', 'quantity': '2 cups'}]}),
+    ('RecipeCategories.put', 'PUT', '/recipes/{recipe}/categories', {'category_ids': ['{other_category}']}),
+    ('IngredientByID.delete', 'DELETE', '/ingredients/{spare_ingredient}', None),
+    ('CategoryByID.delete', 'DELETE', '/categories/{spare_category}', None),
+    ('RecipesBulk.delete', 'DELETE', '/recipes/bulk', {'ids': ['{other_recipe}']}),
+    ('RecipeByID.delete', 'DELETE', '/recipes/{recipe}', None),
+    ('UserByID.delete', 'DELETE', '/users/{owner}', None),
+]
+
+
+def fill(db):
+    """A few linked rows for the scenarios to read and delete; returns their ids."""
+    from models import User, Recipe, Ingredient, RecipeIngredient, Category, RecipeCategory
+    from pagination import encode_cursor
+    import changes
+
+    owner = User(first_name='Owner', last_name='Sample', email='owner@example.com')
+    owner.password_hash = PASSWORD
+    reader = User(first_name='Reader', last_name='Sample', email='reader@example.com')
+    reader.password_hash = PASSWORD
+    ingredients = [Ingredient(name=name) for name in ('Tomato', 'Basil', 'Garlic', 'Saffron')]
+    categories = [Category(name=name) for name in ('Dinner', 'Soup', 'Spare')]
+    recipes = []
+    for n, name in enumerate(('Tomato soup', 'Tomato salad', 'Garlic bread')):
+        recipe = Recipe(name=name, description=f'Sample {name.lower()}', servings=2, user=owner)
+        recipe.recipe_ingredients = [
+            RecipeIngredient(ingredient=ingredient, quantity='1 cup') for ingredient in ingredients[n:n + 2]]
+        recipe.recipe_category = [RecipeCategory(category=categories[n % 2])]
+        recipes.append(recipe)
+    db.session.add_all([reader, *recipes, ingredients[3], categories[2]])
+    db.session.commit()
+    token = changes.head(db.session.connection())
+    db.session.commit()
+    return {
+        'owner': owner.id,
+        'user_cursor': encode_cursor([owner.id]),
+        'recipe': recipes[0].id,
+        'other_recipe': recipes[1].id,
+        'ingredient': ingredients[0].id,
+        'other_ingredient': ingredients[2].id,
+        'spare_ingredient': ingredients[3].id,
+        'category': categories[0].id,
+        'other_category': categories[1].id,
+        'spare_category': categories[2].id,
+        'change_token': encode_cursor([token - 1]),
+    }
+
+
+def fill_in(value, ids):
+    """``value`` with each ``'{name}'`` string formatted from ``ids``; lone placeholders become ints."""
+    if isinstance(value, dict):
+        return {key: fill_in(item, ids) for key, item in value.items()}
+    if isinstance(value, list):
+        return [fill_in(item, ids) for item in value]
+    if isinstance(value, str):
+        formatted = value.format(**ids)
+        return int(formatted) if re.fullmatch(r'\{\w+\}', value) and formatted.isdigit() else formatted
+    return value
+
+
+def explain(connection, statement, parameters):
+    """The plan lines for one statement as the app sent it, and the pattern of a full scan."""
+    if connection.dialect.name == 'sqlite':
+        rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).all()
+        return [row[-1] for row in rows], SQLITE_FULL_SCAN
+    connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+    rows = connection.exec_driver_sql(f'EXPLAIN {statement}', parameters).all()
+    return [row[0] for row in rows], POSTGRES_FULL_SCAN
+
+
+def first_page(statement, plan):
+    """An unfiltered ORDER BY ... LIMIT that walks the key in order and stops after LIMIT rows."""
+    statement = statement.upper()
+    return ' WHERE ' not in statement and ' LIMIT ' in statement and not any('TEMP B-TREE' in line for line in plan)
+
+
+def full_scans(statement, plan, pattern, tables):
+    """Plan lines that scan one of ``tables`` without an index."""
+    if first_page(statement, plan):
+        return []
+    return [line for line in plan if (match := pattern.search(line)) and match.group(1) in tables]
+
+
+def capture(client, method, path, body):
+    """Send one request; returns its response and the (statement, parameters) the app executed."""
+    from sqlalchemy import event
+    from models import db
+
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(EXPLAINED):
+            executed.append((statement, parameters[0] if executemany else parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        response = client.open(path, method=method, json=body)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    return response, executed
+
+
+def check(app, db):
+    """Run every scenario; yields ``(label, status, explained)`` with ``(statement, plan, scans)`` per statement."""
+    from cache import response_cache
+    import pantry
+    import search
+
+    ids = fill(db)
+    # Build the in-memory indexes up front; building them reads whole tables once by design.
+    pantry.get_index()
+    search.get_index()
+    client = app.test_client()
+    tables = set(db.metadata.tables)
+    for label, method, path, body in SCENARIOS:
+        response_cache.backend.clear()
+        response, executed = capture(client, method, fill_in(path, ids), fill_in(body, ids))
+        explained = []
+        for statement, parameters in executed:
+            with db.engine.begin() as connection:
+                plan, pattern = explain(connection, statement, parameters)
+            explained.append((statement, plan, full_scans(statement, plan, pattern, tables)))
+        yield label, response.status_code, explained
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default='sqlite://')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    os.environ.update(SAVOR_ENV='testing', DATABASE_URL=args.database_url, JOB_WORKERS='0', RATE_LIMIT_ENABLED='0')
+    from app import app
+    from models import db
+
+    failures = 0
+    with app.app_context():
+        db.create_all()
+        try:
+            for label, status, explained in check(app, db):
+                if status >= 400:
+                    failures += 1
+                    print(f'HTTP {status}  {label}')
+                    continue
+                for statement, plan, scans in explained:
+                    if scans:
+                        failures += 1
+                        print(f'FULL SCAN  {label}: {"; ".join(scans)}\n    {" ".join(statement.split())}')
+                    elif args.verbose:
+                        print(f'ok         {label}: {"; ".join(plan)}')
+        finally:
+            db.session.rollback()
+            for table in reversed(db.metadata.sorted_tables):
+                db.session.execute(table.delete())
+            db.session.commit()
+    if failures:
+        print(f'{failures} requests or statements failed the check')
+        return 1
+    print('Every statement uses an index.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,320 @@
+import heapq
+import json
+import math
+import re
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import Session
+
+from batches import chunked
+from config import app, db
+from models import Recipe, Ingredient, RecipeIngredient
+import changes
+import versions
+
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+NAME_WEIGHT = 3
+
+
+def tokenize(value):
+    return TOKEN_PATTERN.findall((value or '').lower())
+
+
+def load_documents(connection, recipe_ids):
+    """Return ``{recipe_id: (name, description, ingredient_names)}`` for existing recipes."""
+    documents = {}
+    recipes = Recipe.__table__
+    links = RecipeIngredient.__table__
+    ingredients = Ingredient.__table__
+    for ids in chunked(recipe_ids):
+        rows = connection.execute(
+            recipes.select().with_only_columns(recipes.c.id, recipes.c.name, recipes.c.description)
+            .where(recipes.c.id.in_(ids))
+        )
+        names = defaultdict(list)
+        for row in rows:
+            documents[row.id] = (row.name, row.description, names[row.id])
+        link_rows = connection.execute(
+            links.join(ingredients, links.c.ingredient_id == ingredients.c.id)
+            .select().with_only_columns(links.c.recipe_id, ingredients.c.name)
+            .where(links.c.recipe_id.in_(ids))
+        )
+        for row in link_rows:
+            if row.recipe_id in documents:
+                names[row.recipe_id].append(row.name or '')
+    return {recipe_id: (name, description, ' '.join(ingredient_names))
+            for recipe_id, (name, description, ingredient_names) in documents.items()}
+
+
+def all_recipe_ids(connection):
+    recipes = Recipe.__table__
+    result = connection.execute(recipes.select().with_only_columns(recipes.c.id).order_by(recipes.c.id))
+    return [row.id for row in result]
+
+
+class FTS5Index:
+    """Searches recipe_search, which create_search_table makes outside of any request."""
+
+    transactional = True
+
+    @staticmethod
+    def available(connection):
+        try:
+            options = connection.execute(text('PRAGMA compile_options')).scalars().all()
+        except Exception:
+            return False
+        return 'ENABLE_FTS5' in options
+
+    @classmethod
+    def ready(cls, connection):
+        """Whether this database is SQLite with FTS5 and already has the recipe_search table."""
+        if connection.dialect.name != 'sqlite' or not cls.available(connection):
+            return False
+        return connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'recipe_search'")
+        ).first() is not None
+
+    def apply(self, connection, documents, removed):
+        stale = set(documents) | set(removed)
+        if stale:
+            # One statement however many rows go: the ids travel as a single JSON array parameter.
+            connection.execute(
+                text('DELETE FROM recipe_search WHERE rowid IN (SELECT value FROM json_each(:ids))'),
+                {'ids': json.dumps(sorted(int(i) for i in stale))},
+            )
+        if documents:
+            connection.execute(
+                text('INSERT INTO recipe_search (rowid, name, description, ingredients) '
+                     'VALUES (:id, :name, :description, :ingredients)'),
+                [{'id': recipe_id, 'name': name or '', 'description': description or '', 'ingredients': names}
+                 for recipe_id, (name, description, names) in documents.items()],
+            )
+
+    def search(self, query, limit, offset):
+        terms = tokenize(query)
+        if not terms:
+            return []
+        match = ' '.join(f'"{term}"*' for term in terms)
+        rows = db.session.execute(
+            text('SELECT rowid, bm25(recipe_search, 10.0, 1.0, 3.0) AS rank FROM recipe_search '
+                 'WHERE recipe_search MATCH :match ORDER BY rank LIMIT :limit OFFSET :offset'),
+            {'match': match, 'limit': limit, 'offset': offset},
+        )
+        return [(row.rowid, -row.rank) for row in rows]
+
+
+class InvertedIndex:
+    transactional = False
+
+    def __init__(self, connection):
+        self.lock = threading.RLock()
+        self.postings = defaultdict(dict)
+        self.documents = {}
+        self.total_length = 0
+        self.terms = []
+        self.terms_dirty = False
+        for ids in chunked(all_recipe_ids(connection), 10000):
+            self.apply(connection, load_documents(connection, ids), set())
+
+    def apply(self, connection, documents, removed):
+        with self.lock:
+            for recipe_id in set(documents) | set(removed):
+                self._remove(recipe_id)
+            for recipe_id, (name, description, names) in documents.items():
+                frequencies = defaultdict(int)
+                for term in tokenize(name):
+                    frequencies[term] += NAME_WEIGHT
+                for term in tokenize(description) + tokenize(names):
+                    frequencies[term] += 1
+                for term, frequency in frequencies.items():
+                    if term not in self.postings:
+                        self.terms_dirty = True
+                    self.postings[term][recipe_id] = frequency
+                length = sum(frequencies.values())
+                self.documents[recipe_id] = (tuple(frequencies), length)
+                self.total_length += length
+
+    def _remove(self, recipe_id):
+        document = self.documents.pop(recipe_id, None)
+        if document is None:
+            return
+        terms, length = document
+        self.total_length -= length
+        for term in terms:
+            posting = self.postings[term]
+            posting.pop(recipe_id, None)
+            if not posting:
+                del self.postings[term]
+                self.terms_dirty = True
+
+    def expand(self, prefix):
+        if self.terms_dirty:
+            self.terms = sorted(self.postings)
+            self.terms_dirty = False
+        start = bisect_left(self.terms, prefix)
+        matches = []
+        for term in self.terms[start:]:
+            if not term.startswith(prefix):
+                break
+            matches.append(term)
+        return matches
+
+    def search(self, query, limit, offset):
+        terms = tokenize(query)
+        if not terms:
+            return []
+        with self.lock:
+            count = len(self.documents) or 1
+            average = self.total_length / count or 1
+            scores = None
+            for prefix in terms:
+                term_scores = defaultdict(float)
+                for term in self.expand(prefix):
+                    posting = self.postings[term]
+                    idf = math.log(1 + (count - len(posting) + 0.5) / (len(posting) + 0.5))
+                    for recipe_id, frequency in posting.items():
+                        norm = frequency + 1.2 * (0.25 + 0.75 * self.documents[recipe_id][1] / average)
+                        term_scores[recipe_id] += idf * frequency * 2.2 / norm
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {recipe_id: score + term_scores[recipe_id]
+                              for recipe_id, score in scores.items() if recipe_id in term_scores}
+                if not scores:
+                    return []
+        ranked = heapq.nsmallest(offset + limit, scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[offset:]
+
+
+def create_search_table(connection):
+    """Create recipe_search if it is missing and fill it from every recipe.
+
+    seed.py and migrate_indexes.py call this, and so does creating the
+    recipes table, so no request has to build it. Returns False where SQLite
+    lacks FTS5 and searches use the in-memory InvertedIndex instead.
+    """
+    if connection.dialect.name != 'sqlite' or not FTS5Index.available(connection):
+        return False
+    connection.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS recipe_search USING fts5("
+        "name, description, ingredients, tokenize = 'unicode61')"
+    ))
+    connection.execute(text('DELETE FROM recipe_search'))
+    index = FTS5Index()
+    for ids in chunked(all_recipe_ids(connection), 10000):
+        index.apply(connection, load_documents(connection, ids), set())
+    return True
+
+
+@event.listens_for(Recipe.__table__, 'after_create')
+def create_search_table_with_recipes(target, connection, **kw):
+    create_search_table(connection)
+
+
+def build_index(connection):
+    if FTS5Index.ready(connection):
+        return FTS5Index()
+    if connection.dialect.name == 'sqlite' and FTS5Index.available(connection):
+        app.logger.warning('recipe_search does not exist; searching in memory until migrate_indexes.py creates it')
+    return InvertedIndex(connection)
+
+
+def recipes_using(connection, ingredient_ids):
+    links = RecipeIngredient.__table__
+    recipe_ids = set()
+    for ids in chunked(ingredient_ids):
+        rows = connection.execute(
+            links.select().with_only_columns(links.c.recipe_id).where(links.c.ingredient_id.in_(ids))
+        )
+        recipe_ids.update(row.recipe_id for row in rows)
+    return recipe_ids
+
+
+def catch_up(index, connection, entries):
+    """Reindex the recipes that change_log ``entries`` touched, including through renamed ingredients."""
+    if index.transactional:
+        return
+    recipe_ids = changes.touched_recipes(entries, (RecipeIngredient.__tablename__,))
+    recipe_ids |= recipes_using(connection, {
+        entry.row_id for entry in entries if entry.table_name == Ingredient.__tablename__ and entry.op == 'update'})
+    recipe_ids.discard(None)
+    documents = load_documents(connection, recipe_ids)
+    index.apply(connection, documents, recipe_ids - set(documents))
+
+
+# FTS5 changes commit with the data, so only the in-memory fallback bumps the version.
+_index = versions.LocalIndex('search', build_index, catch_up)
+
+
+def get_index(connection=None):
+    return _index.get(connection)
+
+
+def search_recipes(query, limit, offset):
+    return get_index().search(query, limit, offset)
+
+
+def affected_recipe_ids(session):
+    changed, removed, renamed = set(), set(), set()
+    for instance in session.new | session.dirty:
+        if isinstance(instance, Recipe):
+            changed.add(instance.id)
+        elif isinstance(instance, RecipeIngredient):
+            changed.add(instance.recipe_id)
+            history = inspect(instance).attrs.recipe_id.history
+            changed.update(history.deleted or ())
+        elif isinstance(instance, Ingredient) and instance in session.dirty:
+            renamed.add(instance.id)
+    for instance in session.deleted:
+        if isinstance(instance, Recipe):
+            removed.add(instance.id)
+        elif isinstance(instance, RecipeIngredient):
+            changed.add(instance.recipe_id)
+        elif isinstance(instance, Ingredient):
+            renamed.add(instance.id)
+    return changed, removed, renamed
+
+
+@event.listens_for(Session, 'after_flush')
+def record_search_changes(session, flush_context):
+    changed, removed, renamed = affected_recipe_ids(session)
+    if changed or removed or renamed:
+        mark_recipes_changed(session, changed, removed, renamed)
+
+
+def mark_recipes_changed(session, changed, removed=(), renamed=()):
+    """Reindex recipes written outside the ORM unit of work, e.g. by Core bulk inserts."""
+    changed, removed = set(changed), set(removed)
+    connection = session.connection()
+    changed |= recipes_using(connection, renamed)
+    changed.discard(None)
+    changed -= removed
+    index = _index.index
+    if index is None:
+        # An in-memory index is built from committed rows on first search; a
+        # persistent FTS5 table must see every change, so open it now.
+        if not FTS5Index.ready(connection):
+            versions.bump(session, 'search')
+            return
+        index = get_index(connection)
+    documents = load_documents(connection, changed)
+    removed |= changed - set(documents)
+    if index.transactional:
+        index.apply(connection, documents, removed)
+    else:
+        pending = session.info.setdefault('search_pending', [])
+        pending.append((documents, removed, versions.bump(session, 'search')))
+
+
+@event.listens_for(Session, 'after_commit')
+def apply_search_changes(session):
+    for documents, removed, version in session.info.pop('search_pending', ()):
+        _index.apply(version, lambda index: index.apply(None, documents, removed))
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_search_changes(session):
+    session.info.pop('search_pending', None)
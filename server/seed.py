@@ -1,91 +1,271 @@
+#!/usr/bin/env python3
+"""Generate a reproducible dataset of any size.
+
+    python seed.py                                   # small development dataset
+    python seed.py --users 100000 --recipes 2000000 --ingredients 10000 --workers 8
+"""
+
 # Standard library imports
-from random import randint, choice as rc
+import argparse
+import itertools
+import random
+import time
+from datetime import datetime, timedelta
+from multiprocessing import Pool
 
 # Remote library imports
 from faker import Faker
+from sqlalchemy import text
 
 # Local imports
-from app import app
-from models import db, User, Recipe, Ingredient, RecipeIngredient, Category, RecipeCategory
+from config import app
+from config import bcrypt
+from models import db, User, Recipe, Ingredient, RecipeIngredient, Category, RecipeCategory, normalize_email
+from quantities import parse_quantity
+import changes
+import search
+import similarity
+import stats
+import versions
+
+CATEGORIES = ["Dessert", "Main Course", "Appetizer", "Beverage", "Snack", "Breakfast", "Lunch", "Dinner", "Brunch", "Salad"]
+BASE_INGREDIENTS = ["Eggs", "Milk", "Flour", "Sugar", "Butter", "Baking Powder", "Salt", "Vanilla Extract", "Chocolate", "Yeast"]
+UNITS = ['cups', 'tablespoons', 'teaspoons', 'pieces', 'grams', 'ounces']
+DEFAULT_PASSWORD = 'savor-seed!'
+EPOCH = datetime(2023, 1, 1)
+CHUNK_SIZE = 10000
+VOCABULARY_SIZE = 2000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--recipes', type=int, default=100)
+    parser.add_argument('--ingredients', type=int, default=len(BASE_INGREDIENTS))
+    parser.add_argument('--categories', type=int, default=len(CATEGORIES))
+    parser.add_argument('--ingredients-per-recipe', type=int, default=4,
+                        help='mean number of ingredient links per recipe')
+    parser.add_argument('--categories-per-recipe', type=int, default=2,
+                        help='maximum number of category links per recipe')
+    parser.add_argument('--skew', type=float, default=1.1,
+                        help='Zipf exponent for ingredient and author popularity (0 = uniform)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--batch-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='processes used to generate rows; inserts stay in this process')
+    parser.add_argument('--keep', action='store_true', help='append instead of deleting existing rows')
+    return parser.parse_args()
+
+
+def build_vocabulary(fake, size=VOCABULARY_SIZE):
+    """``size`` distinct words: Faker's word list, then those words again with numeric suffixes.
+
+    ``fake.words(unique=True)`` cannot return more words than the locale's list has (971 for en_US).
+    """
+    words = sorted(set(fake.get_words_list()))
+    suffixed = (f'{word}{n}' for n in itertools.count(2) for word in words)
+    return words + list(itertools.islice(suffixed, max(size - len(words), 0)))
+
+
+def zipf_weights(count, skew):
+    """Cumulative weights favouring low ids, for ``random.choices``."""
+    return list(itertools.accumulate(1.0 / (rank ** skew) for rank in range(1, count + 1)))
+
+
+class Generator:
+    """Builds rows for one chunk of a table from ``(seed, table, chunk)`` alone.
+
+    Chunks are independent of each other and of the worker count, so any
+    number of processes produces the same dataset.
+    """
+
+    def __init__(self, args, offsets, vocabulary, password_hash):
+        self.args = args
+        self.offsets = offsets
+        self.vocabulary = vocabulary
+        self.password_hash = password_hash
+        self.user_weights = zipf_weights(args.users, args.skew)
+        self.ingredient_weights = zipf_weights(args.ingredients, args.skew)
+
+    def rng(self, table, chunk):
+        return random.Random(f'{self.args.seed}:{table}:{chunk}')
+
+    def timestamp(self, rng):
+        return EPOCH + timedelta(seconds=rng.randrange(365 * 24 * 3600))
+
+    def __call__(self, task):
+        table, chunk, start, stop = task
+        return table, getattr(self, table)(self.rng(table, chunk), start, stop)
+
+    def users(self, rng, start, stop):
+        rows = []
+        for n in range(start, stop):
+            email = f'user{n}@example.com'
+            rows.append({
+                'id': self.offsets['users'] + n,
+                'first_name': rng.choice(self.vocabulary).title(),
+                'last_name': rng.choice(self.vocabulary).title(),
+                'email': email,
+                'email_key': normalize_email(email),
+                '_password_hash': self.password_hash,
+                'admin': False,
+                'created_at': self.timestamp(rng),
+            })
+        return rows
+
+    def recipes(self, rng, start, stop):
+        user_ids = range(self.offsets['users'] + 1, self.offsets['users'] + self.args.users + 1)
+        authors = rng.choices(user_ids, cum_weights=self.user_weights, k=stop - start)
+        rows = []
+        for n, user_id in zip(range(start, stop), authors):
+            rows.append({
+                'id': self.offsets['recipes'] + n,
+                'name': ' '.join(rng.choices(self.vocabulary, k=rng.randint(2, 5))).capitalize(),
+                'description': ' '.join(rng.choices(self.vocabulary, k=rng.randint(10, 40))),
+                'servings': rng.choice((1, 2, 4, 6, 8)),
+                'user_id': user_id,
+                'created_at': self.timestamp(rng),
+            })
+        return rows
+
+    def recipeingredients(self, rng, start, stop):
+        ingredient_ids = range(self.offsets['ingredients'] + 1, self.offsets['ingredients'] + self.args.ingredients + 1)
+        rows = []
+        for n in range(start, stop):
+            count = min(max(1, round(rng.gauss(self.args.ingredients_per_recipe, 2))), self.args.ingredients)
+            chosen = set(rng.choices(ingredient_ids, cum_weights=self.ingredient_weights, k=count))
+            for ingredient_id in sorted(chosen):
+                quantity = f"{rng.randint(1, 5)} {rng.choice(UNITS)}"
+                amount, unit = parse_quantity(quantity)
+                rows.append({
+                    'recipe_id': self.offsets['recipes'] + n,
+                    'ingredient_id': ingredient_id,
+                    'quantity': quantity,
+                    'amount': amount,
+                    'unit': unit,
+                })
+        return rows
+
+    def recipecategories(self, rng, start, stop):
+        category_ids = range(self.offsets['categories'] + 1, self.offsets['categories'] + self.args.categories + 1)
+        rows = []
+        for n in range(start, stop):
+            count = rng.randint(1, min(self.args.categories_per_recipe, self.args.categories))
+            for category_id in sorted(rng.sample(category_ids, count)):
+                rows.append({'recipe_id': self.offsets['recipes'] + n, 'category_id': category_id})
+        return rows
+
+
+_generator = None
+
+
+def init_worker(generator):
+    global _generator
+    _generator = generator
+
+
+def run_task(task):
+    return _generator(task)
+
+
+def tasks(table, count, chunk_size):
+    for chunk, start in enumerate(range(1, count + 1, chunk_size)):
+        yield table, chunk, start, min(start + chunk_size, count + 1)
+
+
+def reset():
+    print("Deleting all records...")
+    for model in (RecipeCategory, RecipeIngredient, Category, Ingredient, Recipe, User):
+        db.session.execute(model.__table__.delete())
+    db.session.commit()
+
+
+def next_offsets():
+    offsets = {}
+    for key, model in (('users', User), ('recipes', Recipe), ('ingredients', Ingredient), ('categories', Category)):
+        offsets[key] = db.session.query(db.func.coalesce(db.func.max(model.id), 0)).scalar()
+    return offsets
+
+
+def seed_names(model, names, offset):
+    rows = [{'id': offset + n, 'name': name} for n, name in enumerate(names, start=1)]
+    db.session.execute(model.__table__.insert(), rows)
+    db.session.commit()
+
+
+def seed_table(pool, generator, table, count, chunk_size):
+    print(f"Seeding {table}...")
+    started = time.perf_counter()
+    model_table = db.metadata.tables[table]
+    work = tasks(table, count, chunk_size)
+    results = pool.imap(run_task, work) if pool else map(generator, work)
+    inserted = 0
+    for _, rows in results:
+        if rows:
+            db.session.execute(model_table.insert(), rows)
+            db.session.commit()
+            inserted += len(rows)
+    elapsed = time.perf_counter() - started
+    print(f"  {inserted} rows in {elapsed:.1f}s ({inserted / max(elapsed, 1e-9):,.0f} rows/s)")
+
 
 if __name__ == '__main__':
+    args = parse_args()
     fake = Faker()
+    Faker.seed(args.seed)
+
+    # Everything that can fail before a row is written runs ahead of reset().
+    vocabulary = build_vocabulary(fake)
 
     with app.app_context():
-        # Deleting all records
-        print("Deleting all records...")
-        RecipeCategory.query.delete()
-        RecipeIngredient.query.delete()
-        Category.query.delete()
-        Ingredient.query.delete()
-        Recipe.query.delete()
-        User.query.delete()
-
-        # Seeding Users
-        print("Seeding Users...")
-        users = []
-        for _ in range(50):  # Seeding 50 users
-            user = User(
-                username=fake.unique.user_name(),
-                email=fake.unique.email(),
-                password_hash=fake.password(),
-            )
-            users.append(user)
-            db.session.add(user)
-        db.session.commit()
+        if db.engine.dialect.name == 'sqlite':
+            db.session.execute(text('PRAGMA synchronous = OFF'))
+        if not args.keep:
+            reset()
+        offsets = next_offsets()
 
-        # Seeding Recipes
-        print("Seeding Recipes...")
-        recipes = []
-        for _ in range(100):  # Seeding 100 recipes
-            recipe = Recipe(
-                name=fake.unique.sentence(),
-                description=fake.text(),
-                user_id=rc(users).id
-            )
-            recipes.append(recipe)
-            db.session.add(recipe)
-        db.session.commit()
+        ingredient_names = BASE_INGREDIENTS[:args.ingredients] + [
+            f'{word.title()} {n}' for n, word in
+            zip(range(len(BASE_INGREDIENTS), args.ingredients), itertools.cycle(vocabulary))
+        ]
+        category_names = CATEGORIES[:args.categories] + [
+            f'Category {n}' for n in range(len(CATEGORIES), args.categories)
+        ]
+        print("Seeding Ingredients and Categories...")
+        seed_names(Ingredient, ingredient_names, offsets['ingredients'])
+        seed_names(Category, category_names, offsets['categories'])
 
-        # Seeding Ingredients
-        print("Seeding Ingredients...")
-        ingredients = ["Eggs", "Milk", "Flour", "Sugar", "Butter", "Baking Powder", "Salt", "Vanilla Extract", "Chocolate", "Yeast"]
-        for ingredient in ingredients:
-            db.session.add(Ingredient(name=ingredient))
-        db.session.commit()
+        password_hash = bcrypt.generate_password_hash(DEFAULT_PASSWORD.encode('utf-8')).decode('utf-8')
+        generator = Generator(args, offsets, vocabulary, password_hash)
+        pool = Pool(args.workers, initializer=init_worker, initargs=(generator,)) if args.workers > 1 else None
+        try:
+            seed_table(pool, generator, 'users', args.users, args.batch_size)
+            seed_table(pool, generator, 'recipes', args.recipes, args.batch_size)
+            seed_table(pool, generator, 'recipeingredients', args.recipes, args.batch_size)
+            seed_table(pool, generator, 'recipecategories', args.recipes, args.batch_size)
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
 
-        # Fetching seeded ingredients
-        seeded_ingredients = Ingredient.query.all()
-
-        # Seeding RecipeIngredients
-        print("Seeding RecipeIngredients...")
-        for _ in range(200):  # Seeding 200 recipe-ingredient relationships
-            ri = RecipeIngredient(
-                recipe_id=rc(recipes).id,
-                ingredient_id=rc(seeded_ingredients).id,
-                quantity=f"{randint(1, 5)} {rc(['cups', 'tablespoons', 'teaspoons', 'pieces'])}"
-            )
-            db.session.add(ri)
+        print("Rebuilding aggregates...")
+        stats.rebuild(db.session.connection())
         db.session.commit()
 
-        # Seeding Categories
-        print("Seeding Categories...")
-        categories = ["Dessert", "Main Course", "Appetizer", "Beverage", "Snack", "Breakfast", "Lunch", "Dinner", "Brunch", "Salad"]
-        for category in categories:
-            db.session.add(Category(name=category))
+        print("Computing recipe neighbours...")
+        with db.engine.begin() as connection:
+            similarity.rebuild(connection)
+
+        # The rows above were written without change log entries, so every sync token is now stale,
+        # and running servers have to rebuild their in-memory indexes.
+        changes.mark_reset(db.session.connection())
+        for name in versions.NAMES:
+            versions.advance(db.session.connection(), name)
         db.session.commit()
 
-        # Fetching seeded categories
-        seeded_categories = Category.query.all()
-
-        # Seeding RecipeCategories
-        print("Seeding RecipeCategories...")
-        for _ in range(150):  # Seeding 150 recipe-category relationships
-            rc_entry = RecipeCategory(
-                recipe_id=rc(recipes).id,
-                category_id=rc(seeded_categories).id
-            )
-            db.session.add(rc_entry)
+        # Core inserts bypass the flush hooks that keep the search table current.
+        if search.create_search_table(db.session.connection()):
+            print("Rebuilt recipe_search.")
         db.session.commit()
 
-        print("Seeding finished!")
\ No newline at end of file
+        print("Seeding finished!")
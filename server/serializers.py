@@ -0,0 +1,71 @@
+from datetime import date, datetime
+
+from sqlalchemy import DateTime
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+_serializers = {}
+
+
+def format_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.strftime(DATETIME_FORMAT)
+    return value
+
+
+def excluded_columns(model):
+    rules = getattr(model, 'serialize_rules', ())
+    if isinstance(rules, str):
+        rules = (rules,)
+    return {rule[1:] for rule in rules if rule.startswith('-') and '.' not in rule}
+
+
+class ModelSerializer:
+    """Flat column serializer for a model, compiled once per class.
+
+    Produces the same column output as ``SerializerMixin.to_dict()`` for the
+    models in this app, minus private columns, without walking relationships.
+    """
+
+    def __init__(self, model):
+        hidden = excluded_columns(model)
+        self.model = model
+        self.columns = [
+            column for column in model.__table__.columns
+            if not column.key.startswith('_') and column.key not in hidden
+        ]
+        self.fields = tuple(column.key for column in self.columns)
+        self.datetime_fields = frozenset(
+            column.key for column in self.columns if isinstance(column.type, DateTime)
+        )
+
+    def __call__(self, instance):
+        state = instance.__dict__
+        datetimes = self.datetime_fields
+        data = {}
+        for key in self.fields:
+            value = state[key] if key in state else getattr(instance, key)
+            if key in datetimes and value is not None:
+                value = value.strftime(DATETIME_FORMAT)
+            data[key] = value
+        return data
+
+    def row(self, row, fields=None):
+        """Serialize a result row selected with ``self.columns`` (or ``fields``)."""
+        fields = fields or self.fields
+        datetimes = self.datetime_fields
+        return {
+            key: (value.strftime(DATETIME_FORMAT) if key in datetimes and value is not None else value)
+            for key, value in zip(fields, row)
+        }
+
+
+def serializer_for(model):
+    serializer = _serializers.get(model)
+    if serializer is None:
+        serializer = _serializers[model] = ModelSerializer(model)
+    return serializer
+
+
+def serialize(instance):
+    return serializer_for(type(instance))(instance)
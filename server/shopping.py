@@ -0,0 +1,130 @@
+"""Multi-recipe shopping lists: scale, convert and total ingredient quantities with NumPy.
+
+app.py registers ShoppingList lazily, so NumPy loads with the first shopping-list request.
+"""
+import numpy as np
+from flask import request
+from flask_restful import Resource
+from sqlalchemy import select
+
+from admission import limiter
+from cache import response_cache
+from config import db
+from models import Recipe, Ingredient, RecipeIngredient
+from quantities import DEFAULT_SERVINGS, UNITS, format_quantity
+
+UNIT_NAMES = list(UNITS)
+UNIT_CODES = {unit: code for code, unit in enumerate(UNIT_NAMES)}
+DIMENSIONS = sorted({dimension for dimension, factor in UNITS.values()})
+UNIT_DIMENSIONS = np.array([DIMENSIONS.index(UNITS[unit][0]) for unit in UNIT_NAMES])
+UNIT_FACTORS = np.array([UNITS[unit][1] for unit in UNIT_NAMES])
+
+# Units a total may be shown in, smallest first; the largest unit the total reaches is used.
+# Dimensions without a ladder (pieces, cloves, cans...) keep their only unit.
+DISPLAY_UNITS = {
+    'metric': {'volume': ('ml', 'l'), 'mass': ('g', 'kg')},
+    'us': {'volume': ('tsp', 'tbsp', 'cup', 'gallon'), 'mass': ('oz', 'lb')},
+}
+SYSTEMS = tuple(DISPLAY_UNITS)
+MAX_RECIPES = 500
+
+
+def display_units(dimensions, totals, system):
+    """Pick a display unit for each total (in base units) and convert it, one dimension at a time."""
+    units = np.empty(len(totals), dtype=object)
+    amounts = totals.copy()
+    for code, dimension in enumerate(DIMENSIONS):
+        mask = dimensions == code
+        if not mask.any():
+            continue
+        ladder = DISPLAY_UNITS[system].get(dimension)
+        if ladder is None:
+            units[mask] = next(unit for unit in UNIT_NAMES if UNITS[unit][0] == dimension)
+            continue
+        factors = UNIT_FACTORS[[UNIT_CODES[unit] for unit in ladder]]
+        chosen = np.maximum(np.searchsorted(factors, totals[mask], side='right') - 1, 0)
+        units[mask] = np.array(ladder, dtype=object)[chosen]
+        amounts[mask] = totals[mask] / factors[chosen]
+    return units, amounts
+
+
+def shopping_list(requested, system='metric'):
+    """Total the ingredients of several recipes.
+
+    ``requested`` maps recipe ids to the servings wanted (None keeps the
+    recipe's own). Returns None if a recipe does not exist.
+    """
+    recipes, links, ingredients = Recipe.__table__, RecipeIngredient.__table__, Ingredient.__table__
+    recipe_ids = list(requested)
+    found = db.session.execute(select(recipes.c.id).where(recipes.c.id.in_(recipe_ids))).scalars().all()
+    if len(found) != len(set(recipe_ids)):
+        return None
+
+    rows = db.session.execute(
+        select(links.c.recipe_id, links.c.ingredient_id, ingredients.c.name, links.c.quantity,
+               links.c.amount, links.c.unit, recipes.c.servings)
+        .join(recipes, recipes.c.id == links.c.recipe_id)
+        .join(ingredients, ingredients.c.id == links.c.ingredient_id)
+        .where(links.c.recipe_id.in_(recipe_ids))
+    ).all()
+    parsed = [row for row in rows if row.amount is not None and row.unit in UNIT_CODES]
+    unparsed = [
+        {'recipe_id': row.recipe_id, 'ingredient_id': row.ingredient_id, 'name': row.name, 'quantity': row.quantity}
+        for row in rows if row.amount is None or row.unit not in UNIT_CODES
+    ]
+
+    items = []
+    if parsed:
+        recipe_ids, ingredient_ids, names, quantities, amounts, units, servings = zip(*parsed)
+        base = np.array([s or DEFAULT_SERVINGS for s in servings], dtype=float)
+        wanted = np.array([requested[r] or b for r, b in zip(recipe_ids, base)], dtype=float)
+        codes = np.array([UNIT_CODES[unit] for unit in units])
+        in_base_units = np.array(amounts, dtype=float) * (wanted / base) * UNIT_FACTORS[codes]
+
+        keys = np.stack((np.array(ingredient_ids), UNIT_DIMENSIONS[codes]), axis=1)
+        groups, inverse = np.unique(keys, axis=0, return_inverse=True)
+        totals = np.bincount(inverse.ravel(), weights=in_base_units, minlength=len(groups))
+        display, display_amounts = display_units(groups[:, 1], totals, system)
+
+        names = dict(zip(ingredient_ids, names))
+        for (ingredient_id, _), unit, amount in zip(groups.tolist(), display, display_amounts.tolist()):
+            items.append({
+                'ingredient_id': ingredient_id,
+                'name': names[ingredient_id],
+                'amount': round(amount, 2),
+                'unit': unit,
+                'quantity': format_quantity(amount, unit),
+            })
+        items.sort(key=lambda item: (item['name'] or '', item['unit']))
+    return {'items': items, 'unparsed': unparsed}
+
+
+class ShoppingList(Resource):
+    @limiter.budget('expensive')
+    @response_cache.cached('recipes', 'ingredients', 'recipe_ingredients')
+    def get(self):
+        """``?recipes=12,15:6`` totals recipes 12 and 15, scaling 15 to six servings."""
+        system = request.args.get('units', 'metric')
+        if system not in SYSTEMS:
+            return {'error': f'units must be one of: {", ".join(SYSTEMS)}'}, 400
+        requested = {}
+        try:
+            for entry in request.args.get('recipes', '').split(','):
+                if not entry.strip():
+                    continue
+                recipe_id, _, servings = entry.partition(':')
+                servings = int(servings) if servings else None
+                if servings is not None and servings < 1:
+                    raise ValueError
+                requested[int(recipe_id)] = servings
+        except ValueError:
+            return {'error': 'recipes must be a comma separated list of id or id:servings'}, 400
+        if not requested:
+            return {'error': 'recipes must be a comma separated list of id or id:servings'}, 400
+        if len(requested) > MAX_RECIPES:
+            return {'error': f'At most {MAX_RECIPES} recipes per list'}, 400
+
+        result = shopping_list(requested, system)
+        if result is None:
+            return {'error': 'Recipe not found'}, 404
+        return result, 200
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""Recipe similarity over the ingredient and category link graph.
+
+Every recipe is a sparse vector over its ingredients and categories. Scores
+(cosine or weighted Jaccard, per SIMILARITY_METRIC) are computed with SciPy
+sparse products, and the top SIMILARITY_NEIGHBORS of each recipe are stored in
+recipe_neighbors, so the similar and recommendation endpoints are indexed reads.
+
+    python similarity.py                     # rebuild recipe_neighbors from scratch
+    python similarity.py --block-size 256    # smaller blocks use less memory
+"""
+import argparse
+import time
+from collections import defaultdict
+from itertools import chain
+
+from sqlalchemy import Select, event, func, inspect, select
+from sqlalchemy.orm import Session
+
+from batches import CHUNK_SIZE, chunked
+from cache import response_cache
+from config import app, db
+import changes
+import jobs
+from models import Recipe, RecipeIngredient, RecipeCategory, RecipeNeighbor
+from serializers import serializer_for
+import versions
+
+BLOCK_SIZE = 512
+DEFAULT_NEIGHBORS = 20
+METRICS = ('cosine', 'jaccard')
+REFRESH_FANOUT = 100
+LINK_KEYS = {RecipeIngredient: 'ingredient_id', RecipeCategory: 'category_id'}
+
+
+def current_metric():
+    metric = app.config.get('SIMILARITY_METRIC', 'cosine')
+    if metric not in METRICS:
+        raise ValueError(f'SIMILARITY_METRIC must be one of: {", ".join(METRICS)}')
+    return metric
+
+
+def neighbor_count():
+    return app.config.get('SIMILARITY_NEIGHBORS', DEFAULT_NEIGHBORS)
+
+
+# Ingredients and categories share one feature space: even columns are
+# ingredients, odd columns are categories.
+def ingredient_feature(ingredient_id):
+    return 2 * ingredient_id
+
+
+def category_feature(category_id):
+    return 2 * category_id + 1
+
+
+def load_features(connection, recipe_ids=None):
+    """Return ``{recipe_id: frozenset(features)}`` read from both link tables."""
+    features = defaultdict(set)
+    for model, key in LINK_KEYS.items():
+        table = model.__table__
+        to_feature = ingredient_feature if key == 'ingredient_id' else category_feature
+        base = select(table.c.recipe_id, table.c[key])
+        if recipe_ids is None:
+            batches = [connection.execution_options(stream_results=True).execute(base)]
+        else:
+            batches = (connection.execute(base.where(table.c.recipe_id.in_(ids))) for ids in chunked(recipe_ids))
+        for rows in batches:
+            for recipe_id, target_id in rows:
+                if recipe_id is not None and target_id is not None:
+                    features[recipe_id].add(to_feature(target_id))
+    return {recipe_id: frozenset(values) for recipe_id, values in features.items()}
+
+
+def build_index(connection):
+    from vectors import SimilarityIndex
+    return SimilarityIndex(load_features(connection))
+
+
+def catch_up(index, connection, entries):
+    """Reload the features of the recipes that change_log ``entries`` touched."""
+    recipe_ids = changes.touched_recipes(entries, [model.__tablename__ for model in LINK_KEYS])
+    features = load_features(connection, recipe_ids)
+    index.apply({recipe_id: features.get(recipe_id, frozenset()) for recipe_id in recipe_ids}, ())
+
+
+_index = versions.LocalIndex('similarity', build_index, catch_up)
+
+
+def get_index():
+    return _index.get()
+
+
+def insert_neighbors(connection, neighbors):
+    rows = [
+        {'recipe_id': recipe_id, 'neighbor_id': neighbor_id, 'score': score}
+        for recipe_id, pairs in neighbors.items() for neighbor_id, score in pairs
+    ]
+    if rows:
+        connection.execute(RecipeNeighbor.__table__.insert(), rows)
+
+
+def write_neighbors(connection, neighbors):
+    """Replace the stored lists of the recipes in ``neighbors``."""
+    table = RecipeNeighbor.__table__
+    for ids in chunked(neighbors):
+        connection.execute(table.delete().where(table.c.recipe_id.in_(ids)))
+    insert_neighbors(connection, neighbors)
+
+
+def load_neighbors(connection, recipe_ids):
+    table = RecipeNeighbor.__table__
+    neighbors = {recipe_id: [] for recipe_id in recipe_ids}
+    for ids in chunked(recipe_ids):
+        rows = connection.execute(
+            select(table.c.recipe_id, table.c.neighbor_id, table.c.score).where(table.c.recipe_id.in_(ids))
+        )
+        for row in rows:
+            neighbors[row.recipe_id].append((row.neighbor_id, row.score))
+    return neighbors
+
+
+def referencing(connection, recipe_ids):
+    """Recipes whose stored lists include any of ``recipe_ids``, given as ids or a SELECT of ids."""
+    table = RecipeNeighbor.__table__
+    if isinstance(recipe_ids, Select):
+        return set(connection.execute(select(table.c.recipe_id).where(table.c.neighbor_id.in_(recipe_ids))).scalars())
+    found = set()
+    for ids in chunked(recipe_ids):
+        found.update(connection.execute(select(table.c.recipe_id).where(table.c.neighbor_id.in_(ids))).scalars())
+    return found
+
+
+def rebuild(connection, block_size=BLOCK_SIZE):
+    """Recompute every recipe's neighbours and replace the whole table."""
+    version = versions.current(connection, 'similarity')
+    position = changes.head(connection)
+    index = build_index(connection)
+    connection.execute(RecipeNeighbor.__table__.delete())
+    batch = {}
+    for recipe_id, pairs in index.all_neighbors(neighbor_count(), current_metric(), block_size):
+        batch[recipe_id] = pairs
+        if len(batch) >= CHUNK_SIZE:
+            insert_neighbors(connection, batch)
+            batch = {}
+    insert_neighbors(connection, batch)
+    _index.set(index, version, position)
+
+
+def refresh(changed, removed, orphaned, version=None):
+    """Bring recipe_neighbors up to date after a commit changed some recipes' links.
+
+    ``changed`` maps recipe ids to their new features, ``removed`` holds
+    deleted recipes and ``orphaned`` the recipes whose lists pointed at them.
+    Changed recipes and every list mentioning them are recomputed. The
+    REFRESH_FANOUT recipes most similar to a changed recipe take it into their
+    list if it now ranks there; recipes further away wait for a full rebuild.
+    ``version`` is the similarity version the change committed with.
+    """
+    from vectors import top_k
+    _index.apply(version, lambda index: index.apply(changed, removed))
+    index = get_index()
+    k = neighbor_count()
+    with db.engine.begin() as connection:
+        stale = (referencing(connection, changed) | set(orphaned)) - set(changed) - set(removed)
+        stale_features = load_features(connection, stale)
+        targets = dict(changed)
+        targets.update({recipe_id: stale_features.get(recipe_id, frozenset()) for recipe_id in stale})
+
+        updates = {recipe_id: [] for recipe_id, features in targets.items() if not features}
+        scored = [recipe_id for recipe_id, features in targets.items() if features]
+        offers = defaultdict(list)
+        for recipe_id, (ids, scores) in zip(scored, index.scores([targets[i] for i in scored], current_metric())):
+            updates[recipe_id] = top_k(ids, scores, k, exclude=recipe_id)
+            if recipe_id in changed:
+                for neighbor_id, score in top_k(ids, scores, REFRESH_FANOUT, exclude=recipe_id):
+                    offers[neighbor_id].append((recipe_id, score))
+
+        for recipe_id in updates:
+            offers.pop(recipe_id, None)
+        current = load_neighbors(connection, offers)
+        for recipe_id, pairs in offers.items():
+            merged = dict(current[recipe_id])
+            merged.update(pairs)
+            ranked = sorted(merged.items(), key=lambda pair: (-pair[1], pair[0]))[:k]
+            if set(ranked) != set(current[recipe_id]):
+                updates[recipe_id] = ranked
+        write_neighbors(connection, updates)
+
+
+@jobs.task('similarity.refresh')
+def refresh_job(changed, removed, orphaned, version=None):
+    changed = set(changed) - set(removed)
+    with db.engine.connect() as connection:
+        features = load_features(connection, changed)
+    refresh({recipe_id: features.get(recipe_id, frozenset()) for recipe_id in changed}, removed, orphaned, version)
+    response_cache.bump(['recipe_neighbors'])
+
+
+def pending_changes(session):
+    return session.info.setdefault(
+        'similarity_pending', {'changed': set(), 'removed': set(), 'orphaned': set(), 'version': None})
+
+
+@event.listens_for(Session, 'before_flush')
+def record_orphans(session, flush_context, instances):
+    removed = [instance.id for instance in session.deleted if isinstance(instance, Recipe) and instance.id]
+    if removed:
+        # The foreign keys cascade, so find the lists that lose a neighbour before the rows go.
+        pending_changes(session)['orphaned'].update(referencing(session.connection(), removed))
+
+
+@event.listens_for(Session, 'after_flush')
+def record_similarity_changes(session, flush_context):
+    changed, removed = set(), set()
+    for instance in chain(session.new, session.dirty, session.deleted):
+        key = LINK_KEYS.get(type(instance))
+        if key:
+            state = inspect(instance)
+            if instance in session.dirty and not (
+                state.attrs[key].history.has_changes() or state.attrs.recipe_id.history.has_changes()
+            ):
+                continue
+            changed.add(instance.recipe_id)
+            changed.update(state.attrs.recipe_id.history.deleted or ())
+        elif isinstance(instance, Recipe) and instance in session.deleted:
+            removed.add(instance.id)
+    changed.discard(None)
+    if changed or removed:
+        mark_recipes_changed(session, changed, removed)
+
+
+def mark_recipes_changed(session, changed, removed=()):
+    """Queue recipes written outside the ORM unit of work for a neighbour refresh on commit."""
+    pending = pending_changes(session)
+    pending['changed'].update(set(changed) - set(removed))
+    pending['removed'].update(removed)
+    pending['version'] = versions.bump(session, 'similarity')
+
+
+@event.listens_for(Session, 'after_commit')
+def queue_similarity_refresh(session):
+    pending = session.info.pop('similarity_pending', None)
+    if pending and (pending['changed'] or pending['removed']):
+        payload = {key: sorted(pending[key]) for key in ('changed', 'removed', 'orphaned')}
+        try:
+            jobs.enqueue('similarity.refresh', dict(payload, version=pending['version']))
+        except Exception:
+            # The commit already happened; a stale list is repaired by the next rebuild.
+            app.logger.exception('Queueing a recipe neighbour refresh failed')
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_similarity_changes(session):
+    session.info.pop('similarity_pending', None)
+
+
+def similar_recipes(recipe_id, limit):
+    recipes, neighbors = Recipe.__table__, RecipeNeighbor.__table__
+    serializer = serializer_for(Recipe)
+    rows = db.session.execute(
+        select(*serializer.columns, neighbors.c.score)
+        .join(neighbors, neighbors.c.neighbor_id == recipes.c.id)
+        .where(neighbors.c.recipe_id == recipe_id)
+        .order_by(neighbors.c.score.desc(), neighbors.c.neighbor_id)
+        .limit(limit)
+    )
+    return [dict(serializer.row(row), score=round(row.score, 4)) for row in rows]
+
+
+def recommended_recipes(user_id, limit):
+    """Recipes by other authors, ranked by summed similarity to the user's own recipes."""
+    recipes, neighbors = Recipe.__table__, RecipeNeighbor.__table__
+    serializer = serializer_for(Recipe)
+    own = select(recipes.c.id).where(recipes.c.user_id == user_id)
+    ranked = (
+        select(neighbors.c.neighbor_id, func.sum(neighbors.c.score).label('score'))
+        .where(neighbors.c.recipe_id.in_(own))
+        .group_by(neighbors.c.neighbor_id)
+        .subquery()
+    )
+    rows = db.session.execute(
+        select(*serializer.columns, ranked.c.score)
+        .join(ranked, ranked.c.neighbor_id == recipes.c.id)
+        .where(recipes.c.user_id.is_distinct_from(user_id))
+        .order_by(ranked.c.score.desc(), recipes.c.id)
+        .limit(limit)
+    )
+    return [dict(serializer.row(row), score=round(row.score, 4)) for row in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--block-size', type=int, default=BLOCK_SIZE,
+                        help='recipes scored per sparse product')
+    args = parser.parse_args()
+    with app.app_context():
+        started = time.perf_counter()
+        with db.engine.begin() as connection:
+            rebuild(connection, args.block_size)
+            count = connection.execute(select(func.count()).select_from(RecipeNeighbor.__table__)).scalar()
+        print(f'{count} neighbour rows in {time.perf_counter() - started:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+import os
+import sys
+
+import pytest
+from sqlalchemy import event
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+# config.py reads these when it is first imported.
+os.environ['SAVOR_ENV'] = 'testing'
+os.environ['DATABASE_URL'] = os.environ.get('TEST_DATABASE_URL', 'sqlite://')
+os.environ['JOB_WORKERS'] = '0'
+os.environ['RATE_LIMIT_ENABLED'] = '0'
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import app
+    from models import db
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def db(app):
+    """The app's database, emptied and with a cold response cache after each test."""
+    from cache import response_cache
+    from models import db
+    import search
+    yield db
+    db.session.rollback()
+    for table in reversed(db.metadata.sorted_tables):
+        db.session.execute(table.delete())
+    # Core deletes bypass the flush hooks that keep recipe_search in step.
+    search.create_search_table(db.session.connection())
+    db.session.commit()
+    response_cache.backend.clear()
+
+
+@pytest.fixture
+def client(app, db):
+    return app.test_client()
+
+
+@pytest.fixture
+def statements(db):
+    """SQL statements sent to the database while the test runs."""
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    yield executed
+    event.remove(db.engine, 'before_cursor_execute', record)
@@ -0,0 +1,26 @@
+import io
+import uuid
+
+import bulk
+from models import Recipe
+
+
+def test_a_line_that_is_not_utf8_is_a_row_error(db):
+    lines = [b'{"name": "Tomato soup"}\n', b'{"name": "Caf\xe9"}\n', b'{"name": "Garlic bread"}\n']
+
+    report = bulk.import_ndjson(lines)
+
+    assert report['inserted'] == 2
+    assert [error['line'] for error in report['errors']] == [2]
+    assert report['errors'][0]['error'].startswith('Invalid UTF-8')
+    assert sorted(db.session.scalars(db.select(Recipe.name))) == ['Garlic bread', 'Tomato soup']
+
+
+def test_a_repeated_import_key_deletes_its_spooled_upload(app, tmp_path):
+    key = f'bulk.import:{uuid.uuid4()}'
+
+    first = bulk.enqueue_import(io.BytesIO(b'{"name": "Tomato soup"}\n'), str(tmp_path), key=key)
+    second = bulk.enqueue_import(io.BytesIO(b'{"name": "Tomato soup"}\n'), str(tmp_path), key=key)
+
+    assert second == first
+    assert len(list(tmp_path.iterdir())) == 1
@@ -0,0 +1,21 @@
+from sqlalchemy import create_engine
+
+from cache import MemoryCache, ResponseCache, SharedGeneration
+from models import IndexVersion
+
+
+def test_a_bump_in_another_process_reaches_a_memory_cache(app, tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "shared.db"}')
+    IndexVersion.__table__.create(engine)
+    # Two processes' caches: separate memory, one database.
+    web, worker = (ResponseCache(MemoryCache(), SharedGeneration(lambda: engine, interval=0)) for _ in range(2))
+
+    with app.test_request_context('/recipes'):
+        key, entry = web.lookup(('recipes',), {})
+        web.store(key, ([{'name': 'Tomato soup'}], 200))
+        assert web.lookup(('recipes',), {})[1] is not None
+
+        worker.bump(['recipes'])
+
+        assert web.lookup(('recipes',), {})[1] is None
+    engine.dispose()
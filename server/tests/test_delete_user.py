@@ -0,0 +1,25 @@
+from benchmarks.delete_user import fill_user, time_delete
+from models import Recipe, RecipeIngredient, RecipeCategory
+
+LINKS = 8
+# Deleting a user with 10k recipes and 80k links stays well inside this on one core.
+DELETE_BUDGET_SECONDS = 5.0
+
+
+def delete_user_with(db, recipes):
+    user_id, ingredient_ids, category_id = fill_user(recipes, LINKS)
+    deleted, removed, statements, elapsed = time_delete(user_id)
+    assert (deleted, removed) == (1, recipes)
+    assert db.session.query(Recipe).count() == 0
+    assert db.session.query(RecipeIngredient).count() == 0
+    assert db.session.query(RecipeCategory).count() == 0
+    return statements, elapsed
+
+
+def test_deleting_a_user_takes_the_same_statements_for_10k_recipes(db):
+    # The first delete also builds the in-process indexes; measure from the second.
+    delete_user_with(db, 1)
+    few, _ = delete_user_with(db, 10)
+    many, elapsed = delete_user_with(db, 10000)
+    assert many == few
+    assert elapsed < DELETE_BUDGET_SECONDS
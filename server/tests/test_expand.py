@@ -0,0 +1,56 @@
+import pytest
+
+from models import User, Recipe, Ingredient, RecipeIngredient, Category, RecipeCategory
+
+EXPAND = 'ingredients,categories,user'
+
+
+def add_recipes(db, count, links, prefix='a'):
+    """``count`` recipes, each linked to ``links`` ingredients and ``links`` categories."""
+    users = [User(first_name='Cook', last_name=str(n), email=f'{prefix}{n}@example.com') for n in range(count)]
+    ingredients = [Ingredient(name=f'Ingredient {prefix}{n}') for n in range(links)]
+    categories = [Category(name=f'Category {prefix}{n}') for n in range(links)]
+    recipes = [Recipe(name=f'Recipe {prefix}{n}', user=user) for n, user in enumerate(users)]
+    for recipe in recipes:
+        recipe.recipe_ingredients = [RecipeIngredient(ingredient=ingredient, quantity='1') for ingredient in ingredients]
+        recipe.recipe_category = [RecipeCategory(category=category) for category in categories]
+    db.session.add_all(recipes)
+    db.session.commit()
+    ids = [recipe.id for recipe in recipes]
+    db.session.remove()
+    return ids
+
+
+def count_get(client, statements, url):
+    del statements[:]
+    response = client.get(url)
+    assert response.status_code == 200
+    return len(statements), response.get_json()
+
+
+@pytest.mark.parametrize('links', [1, 10])
+def test_recipe_detail_expands_in_three_statements(client, db, statements, links):
+    recipe_id, = add_recipes(db, 1, links)
+
+    count, body = count_get(client, statements, f'/recipes/{recipe_id}?expand={EXPAND}')
+
+    # The recipe with its user, then one statement each for ingredient and category links.
+    assert count == 3
+    assert len(body['ingredients']) == links
+    assert len(body['categories']) == links
+    assert body['user']['first_name'] == 'Cook'
+
+
+def test_recipe_list_statement_count_does_not_grow_with_recipes(client, db, statements):
+    first = add_recipes(db, 2, 2)
+    few, body = count_get(client, statements, f'/recipes?expand={EXPAND}')
+    assert len(body) == 2
+
+    db.session.execute(Recipe.__table__.delete().where(Recipe.id.in_(first)))
+    db.session.commit()
+    add_recipes(db, 30, 5, prefix='b')
+    many, body = count_get(client, statements, f'/recipes?expand={EXPAND}&limit=50')
+
+    assert len(body) == 30
+    assert all(len(recipe['ingredients']) == 5 and len(recipe['categories']) == 5 for recipe in body)
+    assert many == few
@@ -0,0 +1,68 @@
+import json
+
+import bulk
+import cascades
+import changes
+import pantry
+import search
+import versions
+from models import Recipe, Ingredient, RecipeIngredient
+
+
+def other_process(name, build, catch_up):
+    """A LocalIndex standing in for another process's copy, counting its full builds."""
+    builds = []
+
+    def counted(connection):
+        builds.append(name)
+        return build(connection)
+
+    return versions.LocalIndex(name, counted, catch_up), builds
+
+
+def test_another_process_catches_up_from_the_change_log(db):
+    tomato, basil, garlic = Ingredient(name='Tomato'), Ingredient(name='Basil'), Ingredient(name='Garlic')
+    soup = Recipe(name='Soup', recipe_ingredients=[RecipeIngredient(ingredient=tomato, quantity='2')])
+    salad = Recipe(name='Salad', recipe_ingredients=[
+        RecipeIngredient(ingredient=tomato, quantity='1'), RecipeIngredient(ingredient=basil, quantity='1')])
+    db.session.add_all([soup, salad, garlic])
+    db.session.commit()
+    other_pantry, pantry_builds = other_process('pantry', pantry.PantryIndex, pantry.catch_up)
+    other_search, search_builds = other_process('search', search.InvertedIndex, search.catch_up)
+    other_pantry.get()
+    other_search.get()
+
+    # An ORM link change and ingredient rename, a Core bulk insert and Core cascade deletes.
+    db.session.delete(soup.recipe_ingredients[0])
+    db.session.add(RecipeIngredient(recipe=soup, ingredient=garlic, quantity='3 cloves'))
+    basil.name = 'Thai basil'
+    db.session.commit()
+    bulk.import_ndjson([json.dumps({'name': 'Bread', 'ingredients': ['Garlic', 'Flour']}).encode()])
+    cascades.delete_rows(db.session, Ingredient, [tomato.id])
+    db.session.commit()
+    cascades.delete_rows(db.session, Recipe, [soup.id])
+    db.session.commit()
+    with db.engine.begin() as connection:
+        # With FTS5 this process never bumps the in-memory search version itself.
+        versions.advance(connection, 'search')
+        fresh_pantry = pantry.PantryIndex(connection)
+        fresh_search = search.InvertedIndex(connection)
+
+    assert other_pantry.get().recipes == fresh_pantry.recipes
+    assert dict(other_pantry.index.postings) == dict(fresh_pantry.postings)
+    assert other_search.get().documents == fresh_search.documents
+    assert {term: dict(posting) for term, posting in other_search.index.postings.items()} == \
+        {term: dict(posting) for term, posting in fresh_search.postings.items()}
+    assert (pantry_builds, search_builds) == (['pantry'], ['search'])
+
+
+def test_a_reset_log_rebuilds_the_copy(db):
+    other_pantry, builds = other_process('pantry', pantry.PantryIndex, pantry.catch_up)
+    other_pantry.get()
+
+    with db.engine.begin() as connection:
+        changes.mark_reset(connection)
+        versions.advance(connection, 'pantry')
+    other_pantry.get()
+
+    assert builds == ['pantry', 'pantry']
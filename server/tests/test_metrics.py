@@ -0,0 +1,26 @@
+import time
+from datetime import datetime
+
+from flask import g
+
+from models import Recipe
+from serializers import serializer_for
+
+
+class SlowDatetime(datetime):
+    def strftime(self, format):
+        time.sleep(0.02)
+        return super().strftime(format)
+
+
+def test_serializer_calls_count_toward_serialization_time(app):
+    serializer = serializer_for(Recipe)
+    row = tuple(SlowDatetime(2026, 1, 1) if key in serializer.datetime_fields else None for key in serializer.fields)
+
+    with app.test_request_context('/recipes'):
+        app.preprocess_request()
+        serializer.row(row)
+        elapsed = g.serialization.elapsed
+
+    assert serializer.datetime_fields
+    assert elapsed >= 0.02 * len(serializer.datetime_fields)
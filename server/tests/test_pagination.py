@@ -0,0 +1,83 @@
+import asyncio
+import json
+from datetime import datetime
+
+import pytest
+
+from models import Recipe
+
+
+def walk(client, url):
+    """Ids from every page of ``url``, following X-Next-Cursor."""
+    ids, cursor = [], None
+    for _ in range(100):
+        response = client.get(url + (f'&cursor={cursor}' if cursor else ''))
+        assert response.status_code == 200, response.get_json()
+        ids += [item['id'] for item in response.get_json()]
+        cursor = response.headers.get('X-Next-Cursor')
+        if not cursor:
+            return ids
+    raise AssertionError(f'still paging after 100 pages: {ids[:20]}...')
+
+
+def asgi_get(path, query):
+    """``(status, body)`` for a GET sent straight to asgi.application."""
+    import asgi
+
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        'type': 'http', 'http_version': '1.1', 'method': 'GET', 'scheme': 'http', 'path': path,
+        'raw_path': path.encode(), 'root_path': '', 'query_string': query.encode(), 'headers': [],
+        'server': ('testserver', 80), 'client': ('127.0.0.1', 5000),
+    }
+    asyncio.run(asgi.application(scope, receive, send))
+    return sent[0]['status'], json.loads(sent[1]['body'])
+
+
+@pytest.mark.parametrize('order', ['asc', 'desc'])
+def test_created_at_pages_keep_sub_second_order(client, db, order):
+    # Stamps inside one second, plus rows stamped by the column default in a single flush.
+    stamped = [Recipe(name=f'Stamped {n}', created_at=datetime(2024, 1, 1, 12, 0, 0, n * 250)) for n in range(6)]
+    db.session.add_all(stamped + [Recipe(name=f'Default {n}') for n in range(4)])
+    db.session.commit()
+    expected = [recipe.id for recipe in sorted(stamped + db.session.query(Recipe).filter(
+        Recipe.name.like('Default%')).all(), key=lambda recipe: (recipe.created_at, recipe.id))]
+    if order == 'desc':
+        expected.reverse()
+
+    assert walk(client, f'/recipes?sort=created_at&order={order}&limit=1') == expected
+
+
+@pytest.mark.parametrize('url', ['/users', '/ingredients', '/categories'])
+def test_sort_without_an_index_is_rejected(client, db, url):
+    response = client.get(f'{url}?sort=created_at')
+
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'sort must be one of: id'}
+
+
+@pytest.mark.parametrize('url, cursor', [
+    ('/users?', 'not-base64!'),
+    ('/users?', 'bnVsbA'),                      # null
+    ('/users?', 'WyJ4Il0'),                     # ["x"]
+    ('/recipes?sort=created_at&', 'WzFd'),      # [1]: no timestamp
+    ('/recipes?sort=created_at&', 'WyJ4IiwxXQ'),  # ["x",1]
+])
+def test_malformed_cursor_is_a_bad_request(client, db, url, cursor):
+    assert client.get(f'{url}cursor={cursor}').status_code == 400
+
+
+@pytest.mark.parametrize('limit', ['abc', '1.5', '0', '-1'])
+def test_bad_limit_is_a_bad_request_under_wsgi_and_asgi(client, db, limit):
+    response = client.get(f'/recipes?limit={limit}')
+
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'limit must be a positive integer'}
+    assert asgi_get('/recipes', f'limit={limit}') == (400, response.get_json())
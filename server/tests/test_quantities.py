@@ -0,0 +1,37 @@
+import pytest
+from sqlalchemy import select
+
+import migrate_indexes
+from models import Recipe, Ingredient, RecipeIngredient
+from quantities import parse_quantity
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('1 T sugar', (1.0, 'tbsp')),
+    ('1 T. sugar', (1.0, 'tbsp')),
+    ('2 Tbsp butter', (2.0, 'tbsp')),
+    ('1 tbsp oil', (1.0, 'tbsp')),
+    ('1 t salt', (1.0, 'tsp')),
+    ('1/2 tsp pepper', (0.5, 'tsp')),
+    ('1 Teaspoon vanilla', (1.0, 'tsp')),
+])
+def test_capital_t_is_a_tablespoon_and_lowercase_t_a_teaspoon(text, expected):
+    assert parse_quantity(text) == expected
+
+
+def test_migration_fixes_tablespoons_parsed_as_teaspoons(db):
+    links = RecipeIngredient.__table__
+    recipe = Recipe(name='Tomato soup', recipe_ingredients=[
+        RecipeIngredient(ingredient=Ingredient(name='Sugar'), quantity='1 T'),
+        RecipeIngredient(ingredient=Ingredient(name='Salt'), quantity='1 t'),
+    ])
+    db.session.add(recipe)
+    db.session.commit()
+    db.session.execute(links.update().values(unit='tsp'))
+    db.session.commit()
+
+    migrate_indexes.fix_tablespoon_units(db.session.connection())
+    db.session.commit()
+
+    units = dict(db.session.execute(select(links.c.quantity, links.c.unit)).all())
+    assert units == {'1 T': 'tbsp', '1 t': 'tsp'}
@@ -0,0 +1,12 @@
+import query_plans
+
+
+def test_every_request_uses_an_index(app, db):
+    results = list(query_plans.check(app, db))
+
+    failed = [f'{label}: HTTP {status}' for label, status, explained in results if status >= 400]
+    assert not failed, '\n'.join(failed)
+    assert [label for label, status, explained in results if not explained] == []
+    scans = [f'{label}: {"; ".join(found)} in {" ".join(statement.split())}'
+             for label, status, explained in results for statement, plan, found in explained if found]
+    assert not scans, '\n'.join(scans)
@@ -0,0 +1,42 @@
+import pytest
+from sqlalchemy import text
+
+import migrate_indexes
+import search
+from models import Recipe
+
+
+@pytest.fixture
+def fts5(db):
+    connection = db.session.connection()
+    if connection.dialect.name != 'sqlite' or not search.FTS5Index.available(connection):
+        pytest.skip('needs SQLite with FTS5')
+
+
+def test_the_first_search_does_not_build_the_search_table(client, db, fts5, statements):
+    db.session.add(Recipe(name='Tomato soup'))
+    db.session.commit()
+    search._index.set(None, None)
+    statements.clear()
+
+    response = client.get('/recipes/search?q=tomato')
+
+    assert [recipe['name'] for recipe in response.get_json()] == ['Tomato soup']
+    writes = [statement for statement in statements
+              if 'recipe_search' in statement and not statement.lstrip().upper().startswith('SELECT')]
+    assert writes == []
+
+
+def test_migration_creates_and_fills_a_missing_search_table(db, fts5):
+    recipes = Recipe.__table__
+    db.session.execute(text('DROP TABLE recipe_search'))
+    recipe_id = db.session.execute(recipes.insert().values(name='Garlic bread')).inserted_primary_key[0]
+    db.session.commit()
+
+    with db.engine.begin() as connection:
+        migrate_indexes.create_search_table(connection)
+        found = connection.execute(
+            text("SELECT rowid FROM recipe_search WHERE recipe_search MATCH 'garlic'")).scalars().all()
+    search._index.set(None, None)
+
+    assert found == [recipe_id]
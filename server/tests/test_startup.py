@@ -0,0 +1,34 @@
+import statistics
+import sys
+
+import jobs
+from benchmarks import startup
+
+RUNS = 3
+# Loaded with their first request or job rather than at startup.
+DEFERRED = ('bulk', 'shopping', 'numpy', 'sqlalchemy.dialects.mysql', 'sqlalchemy.dialects.postgresql')
+
+
+def test_cold_start_is_within_budget():
+    runs = [startup.probe('/metrics')[0] for _ in range(RUNS)]
+    assert all(run['status'] == 200 for run in runs)
+    cold_start = statistics.median(run['process_ms'] for run in runs)
+    assert cold_start <= startup.COLD_START_BUDGET_MS, (
+        f'cold start {cold_start:.0f} ms is over the {startup.COLD_START_BUDGET_MS} ms budget')
+
+
+def test_lazily_registered_modules_stay_unloaded_at_startup():
+    result, report = startup.probe('/metrics', importtime=True)
+    imported = {name for name, own, cumulative, depth in startup.parse_importtime(report)}
+    assert result['status'] == 200
+    assert imported.isdisjoint(DEFERRED)
+
+
+def test_a_job_imports_the_module_that_defines_it(monkeypatch):
+    monkeypatch.delitem(jobs.TASKS, 'bulk.import', raising=False)
+    monkeypatch.delitem(sys.modules, 'bulk', raising=False)
+
+    function, max_attempts = jobs.get_task('bulk.import')
+
+    assert function.__module__ == 'bulk'
+    assert jobs.get_task('nowhere.task') is None
@@ -0,0 +1,15 @@
+import stats
+from models import Recipe, Ingredient, RecipeIngredient
+
+
+def test_counts_are_kept_without_a_dialect_upsert(db, monkeypatch):
+    monkeypatch.setattr(stats, 'upsert_increment', lambda connection, aggregate: None)
+    tomato, basil = Ingredient(name='Tomato'), Ingredient(name='Basil')
+    db.session.add(Recipe(name='Tomato soup', recipe_ingredients=[RecipeIngredient(ingredient=tomato)]))
+    db.session.commit()
+
+    db.session.add(Recipe(name='Tomato salad', recipe_ingredients=[
+        RecipeIngredient(ingredient=tomato), RecipeIngredient(ingredient=basil)]))
+    db.session.commit()
+
+    assert {row['name']: row['usage_count'] for row in stats.top_ingredients(10)} == {'Tomato': 2, 'Basil': 1}
@@ -0,0 +1,47 @@
+from models import User
+
+
+def create_user(client, email, **fields):
+    body = dict({'first_name': 'Ada', 'last_name': 'Lovelace', 'email': email, 'password': 'secret!pass'}, **fields)
+    return client.post('/users', json=body)
+
+
+def test_create_user_hashes_the_password(client, db):
+    response = create_user(client, 'ada@example.com')
+
+    assert response.status_code == 201
+    user = db.session.get(User, response.get_json()['id'])
+    assert user.authenticate('secret!pass')
+    assert not user.authenticate('wrong!pass')
+
+
+def test_duplicate_email_is_a_conflict(client, db):
+    assert create_user(client, 'ada@example.com').status_code == 201
+
+    response = create_user(client, 'ada@example.com')
+
+    assert response.status_code == 409
+    assert db.session.query(User).count() == 1
+
+
+def test_email_differing_only_in_case_is_a_duplicate(client, db):
+    assert create_user(client, 'A@x.com').status_code == 201
+
+    assert create_user(client, 'a@x.com').status_code == 409
+    assert create_user(client, ' a@X.COM ').status_code == 409
+
+
+def test_unique_constraint_race_is_a_conflict(client, db, monkeypatch):
+    assert create_user(client, 'ada@example.com').status_code == 201
+    # Another request inserts the same address between the existence probe and the commit.
+    monkeypatch.setattr(User, 'email_taken', classmethod(lambda cls, email_key: False))
+
+    response = create_user(client, 'ADA@example.com')
+
+    assert response.status_code == 409
+    assert db.session.query(User).count() == 1
+
+
+def test_invalid_user_is_unprocessable(client, db):
+    assert create_user(client, 'not-an-email').status_code == 422
+    assert create_user(client, 'ada@example.com', password='').status_code == 422
@@ -0,0 +1,148 @@
+"""Sparse recipe vectors and the NumPy/SciPy scoring behind similarity.py.
+
+Kept apart so the web process only imports NumPy and SciPy once the
+similarity index is first needed.
+"""
+import threading
+from itertools import chain
+
+import numpy as np
+from scipy import sparse
+
+BLOCK_SIZE = 512
+CATEGORY_WEIGHT = 0.5
+COMPACT_AFTER = 1000
+
+
+def feature_weights(features):
+    return np.where(features % 2 == 0, 1.0, CATEGORY_WEIGHT)
+
+
+def total_weight(features):
+    return float(feature_weights(np.fromiter(features, dtype=np.int64)).sum()) if features else 0.0
+
+
+def feature_matrix(feature_sets, width=0):
+    """CSR matrix with a row per feature set, holding the square root of each feature's weight.
+
+    With that scaling a row product is the total weight two recipes share, and
+    a row's squared norm is its own total weight.
+    """
+    lengths = np.fromiter((len(features) for features in feature_sets), dtype=np.int64, count=len(feature_sets))
+    indptr = np.concatenate(([0], np.cumsum(lengths)))
+    indices = np.fromiter(chain.from_iterable(feature_sets), dtype=np.int64, count=int(indptr[-1]))
+    width = max(width, int(indices.max()) + 1 if len(indices) else 0)
+    data = np.sqrt(feature_weights(indices))
+    return sparse.csr_matrix((data, indices, indptr), shape=(len(feature_sets), width))
+
+
+def score(shared, size, sizes, metric):
+    """Score from the shared weight and each side's total weight."""
+    if metric == 'jaccard':
+        return shared / (size + sizes - shared)
+    return shared / np.sqrt(size * sizes)
+
+
+def top_k(ids, scores, k, exclude=None):
+    """The ``k`` best ``(id, score)`` pairs, best first, ties broken by id."""
+    keep = scores > 0
+    if exclude is not None:
+        keep &= ids != exclude
+    ids, scores = ids[keep], scores[keep]
+    if len(scores) > k:
+        chosen = np.argpartition(-scores, k - 1)[:k]
+        ids, scores = ids[chosen], scores[chosen]
+    order = np.lexsort((ids, -scores))
+    return list(zip(ids[order].tolist(), scores[order].tolist()))
+
+
+class SimilarityIndex:
+    """Feature vectors of every linked recipe as a CSC matrix.
+
+    Recipes changed since the matrix was built live in ``overrides`` and are
+    scored directly; they are folded back in once there are COMPACT_AFTER of
+    them, so a write costs one sparse product rather than a rebuild.
+    """
+
+    def __init__(self, features):
+        self.lock = threading.RLock()
+        ids = sorted(recipe_id for recipe_id, values in features.items() if values)
+        self.replace(feature_matrix([features[recipe_id] for recipe_id in ids]), np.array(ids, dtype=np.int64))
+
+    def replace(self, matrix, row_ids):
+        self.matrix = matrix.tocsc()
+        self.row_ids = row_ids
+        self.sizes = np.asarray(matrix.power(2).sum(axis=1)).ravel()
+        self.overrides = {}
+
+    def positions(self, recipe_ids):
+        recipe_ids = np.fromiter(recipe_ids, dtype=np.int64)
+        found = np.searchsorted(self.row_ids, recipe_ids)
+        inside = found < len(self.row_ids)
+        found, recipe_ids = found[inside], recipe_ids[inside]
+        return found[self.row_ids[found] == recipe_ids]
+
+    def apply(self, changed, removed):
+        with self.lock:
+            for recipe_id in removed:
+                self.overrides[recipe_id] = (frozenset(), 0.0)
+            for recipe_id, features in changed.items():
+                self.overrides[recipe_id] = (features, total_weight(features))
+            if len(self.overrides) > COMPACT_AFTER:
+                self.compact()
+
+    def compact(self):
+        keep = np.ones(len(self.row_ids), dtype=bool)
+        keep[self.positions(self.overrides)] = False
+        added = sorted(recipe_id for recipe_id, (features, _) in self.overrides.items() if features)
+        fresh = feature_matrix([self.overrides[recipe_id][0] for recipe_id in added], self.matrix.shape[1])
+        base = self.matrix.tocsr()[keep]
+        base.resize(base.shape[0], fresh.shape[1])
+        ids = np.concatenate((self.row_ids[keep], np.array(added, dtype=np.int64)))
+        order = np.argsort(ids, kind='stable')
+        self.replace(sparse.vstack([base, fresh]).tocsr()[order], ids[order])
+
+    def scores(self, feature_sets, metric):
+        """Yield ``(recipe_ids, scores)`` against every indexed recipe for each feature set.
+
+        All sets are scored with one sparse product, so refreshing a batch of
+        recipes costs about the same as refreshing one.
+        """
+        with self.lock:
+            queries = feature_matrix(feature_sets, self.matrix.shape[1])
+            gram = (queries[:, :self.matrix.shape[1]] @ self.matrix.T).tocsr()
+            stale = np.zeros(len(self.row_ids), dtype=bool)
+            stale[self.positions(self.overrides)] = True
+            extra_ids = np.array(
+                [recipe_id for recipe_id, (values, _) in self.overrides.items() if values], dtype=np.int64)
+            extra_sizes = np.array([size for values, size in self.overrides.values() if values])
+            extra = feature_matrix([values for values, _ in self.overrides.values() if values], queries.shape[1])
+            queries.resize(queries.shape[0], extra.shape[1])
+            extra_gram = (queries @ extra.T).toarray()
+            row_ids, sizes = self.row_ids, self.sizes
+        query_sizes = np.asarray(queries.power(2).sum(axis=1)).ravel()
+        for row in range(gram.shape[0]):
+            lo, hi = gram.indptr[row], gram.indptr[row + 1]
+            columns = gram.indices[lo:hi]
+            fresh = ~stale[columns]
+            columns, shared = columns[fresh], gram.data[lo:hi][fresh]
+            hit = extra_gram[row] > 0
+            ids = np.concatenate((row_ids[columns], extra_ids[hit]))
+            shared = np.concatenate((shared, extra_gram[row][hit]))
+            yield ids, score(shared, query_sizes[row], np.concatenate((sizes[columns], extra_sizes[hit])), metric)
+
+    def all_neighbors(self, k, metric, block_size=BLOCK_SIZE):
+        """Yield ``(recipe_id, [(neighbor_id, score), ...])`` for every indexed recipe."""
+        with self.lock:
+            if self.overrides:
+                self.compact()
+            rows, transposed = self.matrix.tocsr(), self.matrix.T.tocsr()
+            row_ids, sizes = self.row_ids, self.sizes
+        for start in range(0, rows.shape[0], block_size):
+            gram = (rows[start:start + block_size] @ transposed).tocsr()
+            for offset in range(gram.shape[0]):
+                lo, hi = gram.indptr[offset], gram.indptr[offset + 1]
+                columns = gram.indices[lo:hi]
+                scores = score(gram.data[lo:hi], sizes[start + offset], sizes[columns], metric)
+                recipe_id = int(row_ids[start + offset])
+                yield recipe_id, top_k(row_ids[columns], scores, k, exclude=recipe_id)
@@ -0,0 +1,112 @@
+"""Version counters that tell a process when its in-memory copy of an index is stale.
+
+The pantry postings, the in-memory search index and the similarity vectors
+are built into each process's memory, and a process applies only the changes
+it commits itself. Every transaction that changes what one of them is built
+from bumps that index's counter in index_versions, so another web server or
+``python worker.py`` writing the same tables shows up as a counter the local
+copy has not seen. On its next read the copy replays the change_log entries
+written since it was last current, reloading only the recipes they touched.
+It is rebuilt from scratch only when seed.py has reset the log, when the
+entries it needs were pruned, or when more than CATCH_UP_LIMIT are waiting.
+"""
+import threading
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from config import app, db
+from models import IndexVersion
+import changes
+import stats
+
+NAMES = ('pantry', 'search', 'similarity')
+VERSIONS = (IndexVersion.__table__, 'name', 'version')
+# Past this many waiting change_log entries a rebuild is cheaper than replaying them.
+CATCH_UP_LIMIT = 50000
+
+
+def current(connection, name):
+    table = IndexVersion.__table__
+    return connection.execute(select(table.c.version).where(table.c.name == name)).scalar() or 0
+
+
+def advance(connection, name):
+    """Increment ``name`` and return the value it commits with."""
+    stats.apply_deltas(connection, VERSIONS, {name: 1})
+    return current(connection, name)
+
+
+def bump(session, name):
+    """Advance ``name`` once per transaction of ``session``; later calls return the same value."""
+    bumped = session.info.setdefault('index_versions', {})
+    if name not in bumped:
+        bumped[name] = advance(session.connection(), name)
+    return bumped[name]
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def forget_bumps(session):
+    session.info.pop('index_versions', None)
+
+
+class LocalIndex:
+    """This process's copy of the index ``name``.
+
+    ``build(connection)`` makes the copy from scratch. ``catch_up(index,
+    connection, entries)`` applies change_log entries to it in place.
+    """
+
+    def __init__(self, name, build, catch_up=None):
+        self.name = name
+        self.build = build
+        self.catch_up = catch_up
+        self.index = None
+        self.version = None
+        self.position = None
+        self.lock = threading.Lock()
+
+    def get(self, connection=None):
+        """Return the copy, first catching it up if another process has changed the index."""
+        if connection is None:
+            with db.engine.begin() as connection:
+                return self.get(connection)
+        # Read before catching up: a write that lands meanwhile makes the next read catch up again.
+        version = current(connection, self.name)
+        if self.index is None or version != self.version:
+            with self.lock:
+                if self.index is None or version != self.version:
+                    self.refresh(connection, version)
+        return self.index
+
+    def refresh(self, connection, version):
+        if self.index is not None and self.catch_up is not None and self.position is not None:
+            try:
+                entries, position = changes.entries_since(
+                    connection, self.position, CATCH_UP_LIMIT, app.config.get('CHANGE_FEED_SETTLE_SECONDS', 0))
+            except changes.ResyncRequired:
+                pass
+            else:
+                self.catch_up(self.index, connection, entries)
+                self.version, self.position = version, position
+                return
+        position = changes.head(connection)
+        self.set(self.build(connection), version, position)
+
+    def set(self, index, version, position=None):
+        """Replace the copy with one built at ``version``, from the log as of token ``position``."""
+        self.index, self.version, self.position = index, version, position
+
+    def apply(self, version, update):
+        """Run ``update(index)`` for a change this process committed as ``version``.
+
+        The copy stays current only if no other transaction committed in
+        between; otherwise its version is left behind and the next read rebuilds.
+        """
+        with self.lock:
+            if self.index is None:
+                return
+            update(self.index)
+            if version is not None and version == self.version + 1:
+                self.version = version
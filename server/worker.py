@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""Run background jobs outside the web processes.
+
+    python worker.py                      # work until interrupted
+    python worker.py --threads 4
+    python worker.py --burst              # exit once no job is due
+    python worker.py --status             # jobs per state
+    python worker.py --prune              # drop finished jobs past JOB_RETENTION_DAYS
+
+Run any number of workers against the same JOB_QUEUE_URL; each job is
+claimed by one of them. Set JOB_WORKERS=0 on the web servers to leave all
+jobs to these processes.
+"""
+import argparse
+from datetime import timedelta
+
+from app import app  # jobs.get_task imports the other task modules as their jobs run
+import jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--burst', action='store_true', help='exit once no job is due')
+    parser.add_argument('--status', action='store_true', help='print jobs per state and exit')
+    parser.add_argument('--prune', action='store_true', help='delete finished jobs past JOB_RETENTION_DAYS and exit')
+    args = parser.parse_args()
+
+    if args.status:
+        for ((_, state),), count in jobs.queue_depth().items():
+            print(f'{state:<8} {count}')
+        return
+    if args.prune:
+        days = app.config.get('JOB_RETENTION_DAYS', jobs.DEFAULT_RETENTION_DAYS)
+        with jobs.get_engine().begin() as connection:
+            removed = jobs.prune(connection, jobs.utcnow() - timedelta(days=days))
+        print(f'Pruned {removed} finished jobs older than {days} days')
+        return
+
+    worker = jobs.Worker(
+        args.threads,
+        app.config.get('JOB_POLL_INTERVAL', jobs.DEFAULT_POLL_INTERVAL),
+        app.config.get('JOB_LEASE_SECONDS', jobs.DEFAULT_LEASE_SECONDS),
+        burst=args.burst,
+    ).start()
+    print(f'Working on {app.config.get("JOB_QUEUE_URL", jobs.DEFAULT_QUEUE_URL)} with {args.threads} thread(s)')
+    try:
+        worker.join()
+    except KeyboardInterrupt:
+        print('Stopping after the running jobs finish...')
+        worker.stop()
+
+
+if __name__ == '__main__':
+    main()
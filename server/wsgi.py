@@ -0,0 +1,20 @@
+"""WSGI entry point for process managers that take an app factory.
+
+    gunicorn 'wsgi:create_app()' --workers 4 --threads 8
+"""
+import os
+
+
+def create_app(config_name=None):
+    """Import and return the app.
+
+    The app, db and extensions are module globals that every module shares,
+    so this defers the import rather than building a new app: every call
+    returns the same one. The bulk and shopping-list routes are registered
+    lazily and import their modules on first use. ``config_name`` works like
+    SAVOR_ENV and must be given before the app is first imported in the process.
+    """
+    if config_name:
+        os.environ['SAVOR_ENV'] = config_name
+    from app import app
+    return app